@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Local mock of the generateContent API for benchmarks.
+
+Answers ``POST {base}/models/{model}:generateContent`` with an inline image
+whose size follows the requested ``imageSize``, after a configurable latency.
+``candidateCount`` is honored up to ``max_candidates``, to mimic models that
+cap it. Errors can be injected at a given rate. ``GET /__stats`` reports how many
+requests were served and how long the server spent on them; ``POST /__reset``
+clears the counters.
+
+Run standalone:
+
+    python bench/mock_server.py --port 8765 --latency lognormal:2:0.5
+
+The API base to point the client at is ``http://127.0.0.1:PORT/v1beta``.
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Decoded image sizes roughly matching PNG output at each resolution.
+DEFAULT_IMAGE_BYTES = {"1K": 1_500_000, "2K": 6_000_000, "4K": 20_000_000}
+WRITE_CHUNK = 256 * 1024
+PATH_PATTERN = re.compile(r"/models/([^/:]+):generateContent$")
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+def parse_latency(spec):
+    """Turn a latency spec into a function returning seconds.
+
+    Specs: ``0.5`` or ``fixed:0.5``, ``uniform:LOW:HIGH``,
+    ``lognormal:MEDIAN:SIGMA``, ``exp:MEAN``, and ``tail:BASE:SLOW:RATE``
+    (BASE seconds, but SLOW seconds for a RATE share of requests).
+    """
+    kind, _, rest = str(spec).partition(":")
+    if not rest:
+        kind, rest = "fixed", kind
+    args = [float(value) for value in rest.split(":")]
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "lognormal":
+        mu = math.log(args[0])
+        return lambda: random.lognormvariate(mu, args[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1 / args[0]) if args[0] else 0.0
+    if kind == "tail":
+        return lambda: args[1] if random.random() < args[2] else args[0]
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+class MockState:
+    def __init__(self, latency, image_bytes, error_rate, error_status, drop_rate, max_candidates):
+        self.latency = latency
+        self.image_bytes = image_bytes
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.drop_rate = drop_rate
+        self.max_candidates = max_candidates
+        self.images = {}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.drops = 0
+            self.service_s = 0.0
+            self.delay_s = 0.0
+            self.first_request_at = None
+
+    def encoded_image(self, image_size):
+        """Base64 of a PNG-prefixed random blob, built once per size."""
+        size = self.image_bytes.get(image_size) or self.image_bytes["1K"]
+        with self.lock:
+            data = self.images.get(size)
+        if data is None:
+            data = base64.b64encode(PNG_HEADER + os.urandom(max(0, size - len(PNG_HEADER))))
+            with self.lock:
+                self.images[size] = data
+        return data
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "drops": self.drops,
+                "service_s": self.service_s,
+                "delay_s": self.delay_s,
+                "first_request_at": self.first_request_at,
+            }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload, extra_headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/__stats":
+            self.send_json(200, self.state.stats())
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        started = time.monotonic()
+        with self.state.lock:
+            if self.state.first_request_at is None:
+                # Wall clock, so other processes can compare it with their own.
+                self.state.first_request_at = time.time()
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        if self.path.rstrip("/") == "/__reset":
+            self.state.reset()
+            self.send_json(200, {})
+            return
+        if not PATH_PATTERN.search(self.path.split("?", 1)[0]):
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        try:
+            request = json.loads(raw)
+        except ValueError:
+            self.send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+        config = request.get("generationConfig") or {}
+        image_size = (config.get("imageConfig") or {}).get("imageSize") or "1K"
+        state = self.state
+        count = int(config.get("candidateCount") or 1)
+        if state.max_candidates:
+            count = min(count, state.max_candidates)
+        delay = max(0.0, state.latency())
+        time.sleep(delay)
+        roll = random.random()
+        try:
+            if roll < state.error_rate:
+                with state.lock:
+                    state.errors += 1
+                self.send_json(
+                    state.error_status,
+                    {"error": {"code": state.error_status, "message": "injected error"}},
+                    {"Retry-After": "1"} if state.error_status in (429, 503) else None,
+                )
+                return
+            self.send_image(state.encoded_image(image_size), count, roll)
+        finally:
+            with state.lock:
+                state.requests += 1
+                state.delay_s += delay
+                state.service_s += time.monotonic() - started
+
+    def send_image(self, data, count, roll):
+        state = self.state
+        head = b'{"candidates":['
+        part_head = (
+            b'{"content":{"role":"model","parts":'
+            b'[{"inlineData":{"mimeType":"image/png","data":"'
+        )
+        part_tail = b'"}}]},"finishReason":"STOP"}'
+        tail = b"]}"
+        length = (
+            len(head)
+            + count * (len(part_head) + len(data) + len(part_tail))
+            + (count - 1)
+            + len(tail)
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        drop = roll < state.error_rate + state.drop_rate
+        self.wfile.write(head)
+        for index in range(count):
+            if index:
+                self.wfile.write(b",")
+            self.wfile.write(part_head)
+            view = memoryview(data)
+            for start in range(0, len(data), WRITE_CHUNK):
+                if drop and start >= len(data) // 2:
+                    with state.lock:
+                        state.drops += 1
+                    self.close_connection = True
+                    return
+                self.wfile.write(view[start : start + WRITE_CHUNK])
+            self.wfile.write(part_tail)
+        self.wfile.write(tail)
+
+
+class MockServer:
+    """A mock API server running on a background thread."""
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency="0",
+        image_bytes=None,
+        error_rate=0.0,
+        error_status=500,
+        drop_rate=0.0,
+        max_candidates=None,
+    ):
+        state = MockState(
+            parse_latency(latency),
+            dict(image_bytes or DEFAULT_IMAGE_BYTES),
+            error_rate,
+            error_status,
+            drop_rate,
+            max_candidates,
+        )
+        handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+        ThreadingHTTPServer.request_queue_size = 1024
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.state = state
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def api_base(self):
+        return f"http://{self.httpd.server_address[0]}:{self.port}/v1beta"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def parse_sizes(text):
+    sizes = dict(DEFAULT_IMAGE_BYTES)
+    for item in filter(None, (text or "").split(",")):
+        name, _, value = item.partition("=")
+        sizes[name.strip().upper()] = int(float(value))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock generateContent server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765, help="0 picks a free port")
+    parser.add_argument("--latency", default="0", help="Latency spec, e.g. lognormal:2:0.5")
+    parser.add_argument(
+        "--sizes",
+        default="",
+        help="Decoded image bytes per resolution, e.g. 1K=1500000,4K=20000000",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument(
+        "--drop-rate",
+        type=float,
+        default=0.0,
+        help="Share of responses cut off halfway through the body",
+    )
+    parser.add_argument(
+        "--max-candidates",
+        type=int,
+        default=None,
+        help="Send at most this many images per response, whatever candidateCount asks",
+    )
+    args = parser.parse_args()
+
+    server = MockServer(
+        args.host,
+        args.port,
+        args.latency,
+        parse_sizes(args.sizes),
+        args.error_rate,
+        args.error_status,
+        args.drop_rate,
+        args.max_candidates,
+    )
+    print(f"listening on {server.port} api_base={server.api_base}", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""Benchmark the client against the local mock generateContent server.
+
+Starts bench/mock_server.py in a subprocess, then runs every combination of
+mode, resolution and concurrency in its own worker process so that peak RSS
+is measured per scenario. For each scenario it reports requests/sec, latency
+percentiles, client overhead per call (client latency minus the time the
+server spent on the request) and peak memory.
+
+    python bench/run_bench.py --resolutions 1k,4k --concurrency 1,8 --requests 40
+
+Modes: ``sync`` (generate_image on a thread pool), ``batch``
+(generate_images_batch) and ``async`` (agenerate_image under a semaphore).
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+MODES = ("sync", "batch", "async")
+MOCK_SERVER = os.path.join(ROOT, "bench", "mock_server.py")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def mock_call(api_base, method, path):
+    url = api_base.rsplit("/v1beta", 1)[0] + path
+    req = urllib.request.Request(url, data=b"" if method == "POST" else None, method=method)
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        return json.loads(resp.read() or b"{}")
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def run_sync(kwargs, requests, concurrency, output_dir):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from core.app import generate_image
+
+    def one(index):
+        path = os.path.join(output_dir, f"{index}.png")
+        started = time.monotonic()
+        error = None
+        try:
+            generate_image(prompt=f"bench {index}", output_path=path, **kwargs)
+        except Exception as exc:
+            error = str(exc)
+        elapsed = time.monotonic() - started
+        remove_quietly(path)
+        return elapsed, error
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(requests)))
+
+
+def run_batch(kwargs, requests, concurrency, output_dir):
+    from core.batch import generate_images_batch
+
+    outcomes = []
+
+    def on_result(result):
+        outcomes.append((result["elapsed"], result["error"]))
+        if result["output_path"]:
+            remove_quietly(result["output_path"])
+
+    generate_images_batch(
+        ({"prompt": f"bench {index}"} for index in range(requests)),
+        concurrency=concurrency,
+        output_dir=output_dir,
+        on_result=on_result,
+        **kwargs,
+    )
+    return outcomes
+
+
+def run_async(kwargs, requests, concurrency, output_dir):
+    import asyncio
+
+    from core.aio import agenerate_image
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(index):
+            path = os.path.join(output_dir, f"{index}.png")
+            async with semaphore:
+                started = time.monotonic()
+                error = None
+                try:
+                    await agenerate_image(prompt=f"bench {index}", output_path=path, **kwargs)
+                except Exception as exc:
+                    error = str(exc)
+                elapsed = time.monotonic() - started
+            remove_quietly(path)
+            return elapsed, error
+
+        return await asyncio.gather(*(one(index) for index in range(requests)))
+
+    return asyncio.run(run_all())
+
+
+RUNNERS = {"sync": run_sync, "batch": run_batch, "async": run_async}
+
+
+def run_worker(scenario):
+    """Run one scenario in this process and return its measurements."""
+    from core.transport import set_transport
+
+    set_transport(scenario["transport"])
+    kwargs = {
+        "api_base": scenario["api_base"],
+        "api_key": "bench",
+        "output_resolution": scenario["resolution"],
+        "timeout": scenario["timeout"],
+        "max_retries": scenario["max_retries"],
+        "rate_limit": 0,
+    }
+    output_dir = tempfile.mkdtemp(prefix="ai-draw-bench-")
+    if scenario["tracemalloc"]:
+        tracemalloc.start()
+    mock_call(scenario["api_base"], "POST", "/__reset")
+    started = time.monotonic()
+    try:
+        outcomes = RUNNERS[scenario["mode"]](
+            kwargs, scenario["requests"], scenario["concurrency"], output_dir
+        )
+    finally:
+        wall = time.monotonic() - started
+        shutil.rmtree(output_dir, ignore_errors=True)
+    traced_peak = tracemalloc.get_traced_memory()[1] if scenario["tracemalloc"] else None
+    server = mock_call(scenario["api_base"], "GET", "/__stats")
+
+    latencies = [elapsed for elapsed, _ in outcomes]
+    errors = [error for _, error in outcomes if error]
+    total = len(outcomes)
+    return {
+        **{key: scenario[key] for key in ("mode", "resolution", "concurrency", "transport")},
+        "requests": total,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "wall_s": wall,
+        "req_per_s": total / wall if wall else 0.0,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "overhead_ms": (sum(latencies) - server["service_s"]) / total * 1000 if total else 0.0,
+        # ru_maxrss is in KiB on Linux and bytes on macOS.
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / (1024 * 1024 if sys.platform == "darwin" else 1024),
+        "tracemalloc_peak_mb": traced_peak / (1024 * 1024) if traced_peak is not None else None,
+    }
+
+
+def start_mock_server(args):
+    command = [
+        sys.executable,
+        MOCK_SERVER,
+        "--port",
+        "0",
+        "--latency",
+        args.latency,
+        "--error-rate",
+        str(args.error_rate),
+        "--error-status",
+        str(args.error_status),
+        "--drop-rate",
+        str(args.drop_rate),
+    ]
+    if args.sizes:
+        command += ["--sizes", args.sizes]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("listening on"):
+        process.kill()
+        raise RuntimeError(f"Mock server failed to start: {line!r}")
+    return process, line.split("api_base=", 1)[1].strip()
+
+
+def format_row(result):
+    memory = f"{result['peak_rss_mb']:8.1f}"
+    if result["tracemalloc_peak_mb"] is not None:
+        memory += f" {result['tracemalloc_peak_mb']:8.1f}"
+    return (
+        f"{result['mode']:<6} {result['resolution']:<4} {result['concurrency']:>4} "
+        f"{result['requests']:>5} {result['errors']:>4} {result['req_per_s']:>8.2f} "
+        f"{result['p50_s'] * 1000:>8.1f} {result['p95_s'] * 1000:>8.1f} "
+        f"{result['overhead_ms']:>9.2f} {memory}"
+    )
+
+
+def split_list(text):
+    return [item.strip() for item in text.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ai-draw against a mock server")
+    parser.add_argument(
+        "--modes", default="sync,async", help=f"Comma-separated: {', '.join(MODES)}"
+    )
+    parser.add_argument("--resolutions", default="1k,2k,4k")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated levels")
+    parser.add_argument("--requests", type=int, default=32, help="Requests per scenario")
+    parser.add_argument("--transport", default="pooled", choices=("pooled", "urllib"))
+    parser.add_argument("--latency", default="0", help="Mock latency spec (see mock_server.py)")
+    parser.add_argument("--sizes", default="", help="Mock image bytes, e.g. 1K=1500000")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--max-retries", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="Also report the tracemalloc peak (slows the client down)",
+    )
+    parser.add_argument("--api-base", default=None, help="Use a running mock server")
+    parser.add_argument("--json", default=None, help="Write all results to this file")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(json.loads(args.worker))))
+        return 0
+
+    modes = split_list(args.modes)
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"unknown mode: {mode}")
+    server = None
+    api_base = args.api_base
+    if not api_base:
+        server, api_base = start_mock_server(args)
+
+    header = (
+        f"{'mode':<6} {'res':<4} {'conc':>4} {'reqs':>5} {'errs':>4} {'req/s':>8} "
+        f"{'p50 ms':>8} {'p95 ms':>8} {'ovh ms':>9} {'rss MB':>8}"
+    )
+    if args.tracemalloc:
+        header += f" {'heap MB':>8}"
+    print(header)
+    results = []
+    try:
+        for resolution in split_list(args.resolutions):
+            for concurrency in [int(level) for level in split_list(args.concurrency)]:
+                for mode in modes:
+                    scenario = {
+                        "api_base": api_base,
+                        "mode": mode,
+                        "resolution": resolution.upper(),
+                        "concurrency": concurrency,
+                        "requests": args.requests,
+                        "transport": args.transport,
+                        "timeout": args.timeout,
+                        "max_retries": args.max_retries,
+                        "tracemalloc": args.tracemalloc,
+                    }
+                    output = subprocess.run(
+                        [
+                            sys.executable,
+                            os.path.abspath(__file__),
+                            "--worker",
+                            json.dumps(scenario),
+                        ],
+                        check=True,
+                        stdout=subprocess.PIPE,
+                        text=True,
+                    ).stdout
+                    result = json.loads(output.strip().splitlines()[-1])
+                    results.append(result)
+                    print(format_row(result), flush=True)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
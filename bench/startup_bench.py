@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""Measure how fast the CLI and GUI start, and fail on regressions.
+
+Every measurement runs in a fresh interpreter, the way a user (or a script
+making hundreds of ``main.py`` calls) pays for it:
+
+- ``import_main`` / ``import_gui``: time to import the entry point modules
+- ``cli_help``: wall time of ``main.py --help``
+- ``cli_first_request``: from spawning ``main.py`` to the mock server
+  receiving its request
+- ``gui_first_window``: from spawning the interpreter to the main window's
+  first paint (uses the offscreen Qt platform unless one is set)
+
+Each metric is the median of ``--runs`` samples. Save a run with ``--json``
+and pass it back with ``--baseline`` to fail (exit 1) when a metric gets more
+than ``--tolerance`` slower. Independently of timings, the run fails when an
+entry point eagerly imports a module listed in LAZY_MODULES.
+
+    python bench/startup_bench.py --json startup.json
+    python bench/startup_bench.py --baseline startup.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+BENCH_DIR = os.path.join(ROOT, "bench")
+if BENCH_DIR not in sys.path:
+    sys.path.insert(0, BENCH_DIR)
+
+METRICS = ("import_main", "import_gui", "cli_help", "cli_first_request", "gui_first_window")
+# Modules that only some commands need; importing an entry point must not load them.
+LAZY_MODULES = {
+    "main": (
+        "PySide6",
+        "asyncio",
+        "sqlite3",
+        "http.server",
+        "multiprocessing",
+        "concurrent.futures.process",
+        "http.client",
+        "ssl",
+        "core.app",
+        "core.aio",
+        "core.batch",
+        "core.cache",
+        "core.service",
+        "core.trace",
+        "core.transport",
+    ),
+    "gui_app": (
+        "asyncio",
+        "sqlite3",
+        "http.server",
+        "http.client",
+        "ssl",
+        "multiprocessing",
+        "concurrent.futures.process",
+        "core.app",
+        "core.transport",
+        "core.service",
+    ),
+}
+# Differences below this many milliseconds are noise, whatever the tolerance.
+NOISE_MS = 5.0
+
+
+def child_env(home):
+    env = dict(os.environ)
+    env["HOME"] = home
+    env["USERPROFILE"] = home
+    env.pop("GPTSAPI_API_KEY", None)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def run_python(args, env, **kwargs):
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+        **kwargs,
+    )
+
+
+def measure_import(module, env):
+    code = (
+        "import sys, time\n"
+        f"started = time.perf_counter(); import {module}\n"
+        "print(time.perf_counter() - started)\n"
+    )
+    return float(run_python(["-c", code], env).stdout.strip()) * 1000
+
+
+def eager_imports(module, env):
+    code = f"import json, sys\nimport {module}\nprint(json.dumps(sorted(sys.modules)))\n"
+    loaded = set(json.loads(run_python(["-c", code], env).stdout))
+    return [
+        name
+        for name in LAZY_MODULES[module]
+        if name in loaded or any(mod.startswith(name + ".") for mod in loaded)
+    ]
+
+
+def measure_cli_help(env):
+    started = time.perf_counter()
+    run_python(["main.py", "--help"], env)
+    return (time.perf_counter() - started) * 1000
+
+
+def measure_cli_first_request(server, env, output_dir):
+    from run_bench import mock_call
+
+    mock_call(server.api_base, "POST", "/__reset")
+    started = time.time()
+    run_python(
+        [
+            "main.py",
+            "startup bench",
+            "--api-base",
+            server.api_base,
+            "--api-key",
+            "bench",
+            "--out",
+            os.path.join(output_dir, "startup.png"),
+            "--cache",
+            "off",
+            "--rate-limit",
+            "0",
+        ],
+        env,
+    )
+    first = mock_call(server.api_base, "GET", "/__stats")["first_request_at"]
+    return (first - started) * 1000
+
+
+def measure_gui_first_window(env):
+    started = time.time()
+    result = run_python(
+        [os.path.abspath(__file__), "--worker", "gui", "--started", repr(started)], env
+    )
+    return float(result.stdout.strip().splitlines()[-1]) * 1000
+
+
+def run_gui_worker(started):
+    """Build the GUI like gui_app.main() and report the first paint."""
+    import gui_app
+    from PySide6 import QtCore, QtWidgets
+
+    app = QtWidgets.QApplication([])
+    gui_app.apply_style(app)
+    window = gui_app.MainWindow()
+    painted = []
+
+    class PaintProbe(QtCore.QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QtCore.QEvent.Type.Paint and not painted:
+                painted.append(time.time())
+            return False
+
+    probe = PaintProbe()
+    window.installEventFilter(probe)
+    window.show()
+    deadline = time.time() + 10
+    while not painted and time.time() < deadline:
+        app.processEvents(QtCore.QEventLoop.ProcessEventsFlag.AllEvents, 50)
+    print(painted[0] - started if painted else float("nan"))
+    window.removeEventFilter(probe)
+    window.close()
+
+
+def median(values):
+    return statistics.median(values) if values else None
+
+
+def compare(results, baseline, tolerance):
+    failures = []
+    for name in METRICS:
+        current, previous = results.get(name), baseline.get(name)
+        if current is None or previous is None:
+            continue
+        budget = max(previous * (1 + tolerance), previous + NOISE_MS)
+        if current > budget:
+            failures.append(
+                f"{name}: {current:.1f} ms > {budget:.1f} ms (baseline {previous:.1f} ms)"
+            )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Samples per metric")
+    parser.add_argument(
+        "--skip", default="", help=f"Comma-separated metrics to skip: {', '.join(METRICS)}"
+    )
+    parser.add_argument(
+        "--baseline", default=None, help="Fail on regressions against this --json file"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="Allowed slowdown (0.25 = 25%%)"
+    )
+    parser.add_argument("--json", default=None, help="Write the results to this file")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--started", type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker == "gui":
+        run_gui_worker(args.started)
+        return
+
+    skip = {name.strip() for name in args.skip.split(",") if name.strip()}
+    home = tempfile.mkdtemp(prefix="ai-draw-startup-")
+    env = child_env(home)
+    samples = {name: [] for name in METRICS if name not in skip}
+    server = None
+    try:
+        if "cli_first_request" in samples:
+            from mock_server import MockServer
+
+            server = MockServer().start()
+        # One untimed round first, so every sample sees warm caches and bytecode.
+        for attempt in range(args.runs + 1):
+            round_samples = {}
+            if "import_main" in samples:
+                round_samples["import_main"] = measure_import("main", env)
+            if "import_gui" in samples:
+                round_samples["import_gui"] = measure_import("gui_app", env)
+            if "cli_help" in samples:
+                round_samples["cli_help"] = measure_cli_help(env)
+            if "cli_first_request" in samples:
+                round_samples["cli_first_request"] = measure_cli_first_request(server, env, home)
+            if "gui_first_window" in samples:
+                round_samples["gui_first_window"] = measure_gui_first_window(env)
+            if attempt:
+                for name, value in round_samples.items():
+                    samples[name].append(value)
+        eager = {module: eager_imports(module, env) for module in LAZY_MODULES}
+    finally:
+        if server:
+            server.stop()
+        shutil.rmtree(home, ignore_errors=True)
+
+    results = {name: median(values) for name, values in samples.items()}
+    for name, values in samples.items():
+        print(f"{name:<20} {results[name]:8.1f} ms  (min {min(values):.1f}, max {max(values):.1f})")
+
+    failures = [
+        f"{module} eagerly imports {', '.join(names)}" for module, names in eager.items() if names
+    ]
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            failures.extend(compare(results, json.load(f)["results"], args.tolerance))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "python": sys.version.split()[0],
+                    "runs": args.runs,
+                    "results": results,
+                    "samples": samples,
+                },
+                f,
+                indent=2,
+            )
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,11 @@
 """Core logic for ai-draw."""
 
-from .app import (
+from .config import (
     DEFAULT_ASPECT,
     DEFAULT_FORMAT,
     DEFAULT_MODEL,
     DEFAULT_PROVIDER,
     DEFAULT_RESOLUTION,
-    generate_image,
-)
-from .config import (
     get_api_key,
     get_default_config,
     load_config,
@@ -22,8 +19,23 @@ __all__ = [
     "DEFAULT_PROVIDER",
     "DEFAULT_RESOLUTION",
     "generate_image",
+    "generate_images_batch",
     "get_api_key",
     "get_default_config",
     "load_config",
     "save_config",
 ]
+
+
+def __getattr__(name):
+    # The HTTP client stack is only imported once something asks for it, so
+    # that importing core.config (e.g. from the GUI) stays cheap.
+    if name == "generate_image":
+        from .app import generate_image
+
+        return generate_image
+    if name == "generate_images_batch":
+        from .batch import generate_images_batch
+
+        return generate_images_batch
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+"""Asyncio client for the generateContent API.
+
+Requests are sent over plain asyncio streams, so many generations can be in
+flight on one event loop without a thread per request. Payload building and
+response parsing are shared with the blocking client in ``core.app``.
+"""
+import asyncio
+import http.client
+import io
+import ssl
+import time
+import urllib.error
+from urllib.parse import urlsplit
+
+from .app import (
+    CANCEL_POLL_INTERVAL,
+    CancelWatch,
+    DEFAULT_ASPECT,
+    DEFAULT_CANDIDATE_COUNT,
+    DEFAULT_FORMAT,
+    DEFAULT_HEDGE_MAX_RATIO,
+    DEFAULT_HEDGE_PERCENTILE,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_MODEL,
+    DEFAULT_OUTPUT_QUALITY,
+    DEFAULT_PROVIDER,
+    DEFAULT_RATE_LIMIT,
+    DEFAULT_RESOLUTION,
+    GenerationCancelled,
+    api_error_from,
+    build_generate_payload,
+    build_headers,
+    build_image_parts,
+    candidate_batches,
+    candidate_output_paths,
+    check_response_error,
+    collect_image_items,
+    commit_part_files,
+    decode_response,
+    decoded_indexes,
+    encode_payload,
+    flight_key,
+    generate_content_url,
+    generation_result,
+    missing_outputs,
+    normalize_candidate_count,
+    normalize_image_size,
+    part_file_sink,
+    part_path_for,
+    prepare_output_dir,
+    raise_if_cancelled,
+    remove_files,
+    resolve_api_settings,
+    restore_cached,
+    with_candidate_count,
+)
+from .cache import payload_cache_key
+from .hedging import get_hedger
+from .imaging import resolve_max_ref_pixels
+from .metrics import record_cache_lookup, track_exchange
+from .ratelimit import acall_with_retries, get_rate_limiter
+from .singleflight import get_async_single_flight, link_or_copy
+from .streaming import DEFAULT_CHUNK_SIZE, InlineImageScanner
+from .trace import NULL_TRACE, ExchangeTimer, TracedBody
+from .transcode import (
+    atranscode_output,
+    normalize_format,
+    normalize_quality,
+    with_format_extension,
+)
+
+_ssl_context = None
+
+
+def get_ssl_context():
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+async def read_with_timeout(awaitable, timeout):
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError as exc:
+        raise TimeoutError("timed out") from exc
+
+
+async def read_headers(reader, timeout):
+    headers = http.client.HTTPMessage()
+    while True:
+        line = await read_with_timeout(reader.readline(), timeout)
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip()] = value.strip()
+
+
+async def iter_body(reader, headers, timeout, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the response body in chunks (chunked, sized or read-to-EOF)."""
+    if "chunked" in (headers.get("Transfer-Encoding") or "").lower():
+        while True:
+            size_line = await read_with_timeout(reader.readline(), timeout)
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                await read_headers(reader, timeout)
+                return
+            while size > 0:
+                chunk = await read_with_timeout(reader.read(min(size, chunk_size)), timeout)
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", size)
+                size -= len(chunk)
+                yield chunk
+            await read_with_timeout(reader.readexactly(2), timeout)
+    length = headers.get("Content-Length")
+    remaining = int(length) if length is not None else None
+    while remaining is None or remaining > 0:
+        size = chunk_size if remaining is None else min(remaining, chunk_size)
+        chunk = await read_with_timeout(reader.read(size), timeout)
+        if not chunk:
+            if remaining:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            return
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
+
+
+async def aopen(method, url, headers, body=None, timeout=30):
+    """Send one HTTP/1.1 request and return (status, reason, headers, reader, writer).
+
+    The caller reads the body with iter_body and closes ``writer``.
+    """
+    parts = urlsplit(url)
+    secure = parts.scheme == "https"
+    host = parts.hostname
+    port = parts.port or (443 if secure else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path = f"{path}?{parts.query}"
+
+    reader, writer = await read_with_timeout(
+        asyncio.open_connection(
+            host,
+            port,
+            ssl=get_ssl_context() if secure else None,
+            server_hostname=host if secure else None,
+        ),
+        timeout,
+    )
+    try:
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {parts.netloc}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if isinstance(body, bytes):
+            writer.write(body)
+        elif body is not None:
+            # Streaming bodies read (and base64-encode) reference files: off the loop.
+            chunks = iter(body)
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(next, chunks, None)
+                    if chunk is None:
+                        break
+                    writer.write(chunk)
+                    await read_with_timeout(writer.drain(), timeout)
+            finally:
+                close = getattr(chunks, "close", None)
+                if close:
+                    close()
+        await read_with_timeout(writer.drain(), timeout)
+
+        status_line = await read_with_timeout(reader.readline(), timeout)
+        if not status_line:
+            raise http.client.RemoteDisconnected("Remote end closed connection")
+        _, status, reason = (status_line.decode("latin-1").strip().split(" ", 2) + [""])[:3]
+        resp_headers = await read_headers(reader, timeout)
+        return int(status), reason, resp_headers, reader, writer
+    except BaseException:
+        writer.close()
+        raise
+
+
+async def arequest(method, url, headers, body=None, timeout=30):
+    """Send one HTTP/1.1 request and return (status, reason, headers, body)."""
+    status, reason, resp_headers, reader, writer = await aopen(
+        method, url, headers, body, timeout
+    )
+    try:
+        chunks = [chunk async for chunk in iter_body(reader, resp_headers, timeout)]
+    finally:
+        writer.close()
+    return status, reason, resp_headers, b"".join(chunks)
+
+
+async def arequest_json(method, url, api_key, payload=None, timeout=30):
+    body = encode_payload(payload)
+    headers = build_headers(api_key, body)
+    timer = ExchangeTimer(body)
+    with track_exchange(url, payload, timer):
+        status, reason, resp_headers, data = await arequest(
+            method, url, headers, body, timeout
+        )
+        timer.response_started(status)
+        timer.received = len(data)
+        if status >= 400:
+            raise urllib.error.HTTPError(url, status, reason, resp_headers, io.BytesIO(data))
+    return decode_response(data)
+
+
+async def astream_image_response(
+    method, url, api_key, open_sink, payload=None, timeout=30, trace=NULL_TRACE
+):
+    """Async counterpart of core.app.stream_image_response."""
+    with trace.span("serialize") as span:
+        body = encode_payload(payload)
+        span["bytes"] = len(body)
+    if trace.enabled:
+        body = TracedBody(body)
+    timer = ExchangeTimer(body)
+    if trace.enabled:
+        open_sink = timer.sink(open_sink)
+    headers = build_headers(api_key, body)
+    scanner = InlineImageScanner(open_sink)
+    writer = None
+    with track_exchange(url, payload, timer):
+        try:
+            status, reason, resp_headers, reader, writer = await aopen(
+                method, url, headers, body, timeout
+            )
+            timer.response_started(status)
+            if status >= 400:
+                chunks = [chunk async for chunk in iter_body(reader, resp_headers, timeout)]
+                raise urllib.error.HTTPError(
+                    url, status, reason, resp_headers, io.BytesIO(b"".join(chunks))
+                )
+            async for chunk in iter_body(reader, resp_headers, timeout):
+                # The scanner writes decoded images to disk.
+                await asyncio.to_thread(timer.feed, scanner.feed, chunk)
+        finally:
+            scanner.close()
+            if writer is not None:
+                writer.close()
+            timer.record(trace)
+    response = scanner.finish()
+    check_response_error(response)
+    return response, scanner.images
+
+
+async def acreate_prediction(
+    api_base,
+    api_key,
+    prompt,
+    model,
+    aspect_ratio,
+    output_resolution=None,
+    timeout=120.0,
+    candidate_count=1,
+):
+    url = generate_content_url(api_base, model)
+    payload = build_generate_payload(
+        prompt, aspect_ratio, output_resolution, candidate_count=candidate_count
+    )
+    return await arequest_json("POST", url, api_key, payload=payload, timeout=timeout)
+
+
+async def acreate_edit_prediction(
+    api_base,
+    api_key,
+    prompt,
+    model,
+    image_parts,
+    aspect_ratio,
+    output_resolution=None,
+    timeout=120.0,
+    candidate_count=1,
+):
+    url = generate_content_url(api_base, model)
+    payload = build_generate_payload(
+        prompt, aspect_ratio, output_resolution, image_parts, candidate_count
+    )
+    return await arequest_json("POST", url, api_key, payload=payload, timeout=timeout)
+
+
+async def afetch_image_to_file(
+    url, api_key, payload, output_paths, timeout=120.0, on_status=None, trace=NULL_TRACE
+):
+    part_paths = [part_path_for(path) for path in output_paths]
+    try:
+        _, images = await astream_image_response(
+            "POST",
+            url,
+            api_key,
+            part_file_sink(part_paths, on_status),
+            payload=payload,
+            timeout=timeout,
+            trace=trace,
+        )
+        with trace.span("commit"):
+            return commit_part_files(images, part_paths, output_paths)
+    finally:
+        remove_files(part_paths)
+
+
+async def afetch_image_hedged(
+    url,
+    api_key,
+    payload,
+    output_paths,
+    timeout,
+    on_status,
+    hedger,
+    hedge_key,
+    trace=NULL_TRACE,
+    limiter=None,
+):
+    """Async counterpart of core.app.fetch_image_hedged; the loser is cancelled."""
+    delay = hedger.delay(hedge_key)
+    tasks = {}
+
+    async def attempt(part_paths, attempt_trace):
+        started = time.monotonic()
+        try:
+            _, images = await astream_image_response(
+                "POST",
+                url,
+                api_key,
+                part_file_sink(part_paths, on_status),
+                payload=payload,
+                timeout=timeout,
+                trace=attempt_trace,
+            )
+            if not decoded_indexes(images, len(part_paths)):
+                raise RuntimeError("No image data found in response")
+        except BaseException:
+            remove_files(part_paths)
+            raise
+        return time.monotonic() - started, images
+
+    def start(number):
+        part_paths = [part_path_for(path, number) for path in output_paths]
+        task = asyncio.ensure_future(attempt(part_paths, trace.bind(hedge=number)))
+        tasks[task] = part_paths
+        return task
+
+    errors = []
+    try:
+        done, pending = await asyncio.wait([start(0)], timeout=delay)
+        if pending and hedger.try_hedge() and (limiter is None or limiter.try_acquire()):
+            if on_status:
+                on_status(f"hedging request after {delay:.1f}s")
+            pending.add(start(1))
+        while True:
+            for task in done:
+                try:
+                    elapsed, images = task.result()
+                except Exception as exc:
+                    errors.append(exc)
+                    continue
+                hedger.record(hedge_key, elapsed)
+                try:
+                    with trace.span("commit"):
+                        return commit_part_files(images, tasks[task], output_paths)
+                finally:
+                    remove_files(tasks[task])
+            if not pending:
+                raise errors[0]
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def transcode_all(paths, output_format, output_quality, on_status, trace):
+    return await asyncio.gather(
+        *(
+            atranscode_output(path, output_format, output_quality, on_status, trace)
+            for path in paths
+        )
+    )
+
+
+async def run_cancellable(awaitable, cancel_event):
+    """Await ``awaitable``, cancelling it once the threading ``cancel_event`` is set."""
+    if cancel_event is None:
+        return await awaitable
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while not task.done():
+            await asyncio.wait([task], timeout=CANCEL_POLL_INTERVAL)
+            if not task.done() and cancel_event.is_set():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise GenerationCancelled("Generation cancelled")
+        try:
+            return task.result()
+        except Exception as exc:
+            # Aborted by the cancel watch before this loop saw the event.
+            if cancel_event.is_set():
+                raise GenerationCancelled("Generation cancelled") from exc
+            raise
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def agenerate_image(
+    *,
+    prompt,
+    provider=DEFAULT_PROVIDER,
+    model=DEFAULT_MODEL,
+    aspect=DEFAULT_ASPECT,
+    output_format=DEFAULT_FORMAT,
+    output_resolution=DEFAULT_RESOLUTION,
+    output_path="output.png",
+    image_path="",
+    image_urls=None,
+    poll_interval=2.0,
+    timeout=120.0,
+    api_base=None,
+    api_key=None,
+    on_status=None,
+    cancel_event=None,
+    cache=None,
+    max_ref_pixels=None,
+    url_cache=None,
+    max_retries=DEFAULT_MAX_RETRIES,
+    rate_limit=DEFAULT_RATE_LIMIT,
+    hedge_percentile=DEFAULT_HEDGE_PERCENTILE,
+    hedge_max_ratio=DEFAULT_HEDGE_MAX_RATIO,
+    trace=None,
+    output_quality=DEFAULT_OUTPUT_QUALITY,
+    candidate_count=DEFAULT_CANDIDATE_COUNT,
+    coalesce=False,
+):
+    """Async counterpart of generate_image with the same arguments.
+
+    Disk work (hashing references, cache copies, decoding to files) runs in
+    worker threads so it does not stall the event loop.
+    """
+    trace = trace or NULL_TRACE
+    api_base, api_key = resolve_api_settings(api_base, api_key)
+    if not str(prompt).strip():
+        raise RuntimeError("Prompt is required")
+    candidate_count = normalize_candidate_count(candidate_count)
+    output_quality = normalize_quality(output_quality)
+    # The saved bytes are re-encoded as output_format, so the name must say so.
+    output_path = with_format_extension(output_path, output_format)
+
+    prepare_output_dir(output_path)
+    output_paths = candidate_output_paths(output_path, candidate_count)
+    image_items = collect_image_items(image_path, image_urls)
+    image_size = normalize_image_size(output_resolution)
+
+    with trace.span("generate", model=model, resolution=image_size, candidates=candidate_count):
+        try:
+            raise_if_cancelled(cancel_event)
+            image_parts = []
+            max_pixels = resolve_max_ref_pixels(max_ref_pixels, image_size)
+            if image_items:
+                with trace.span("load_references", count=len(image_items)) as span:
+                    with CancelWatch(cancel_event) as watch:
+                        image_parts = await run_cancellable(
+                            asyncio.to_thread(
+                                build_image_parts,
+                                image_items,
+                                on_status,
+                                max_pixels,
+                                url_cache,
+                                cancel_event,
+                                trace,
+                                watch,
+                            ),
+                            cancel_event,
+                        )
+                    span["bytes"] = sum(
+                        part["inline_data"]["data"].size for part in image_parts
+                    )
+            payload = build_generate_payload(
+                prompt, aspect, output_resolution, image_parts, candidate_count
+            )
+            cache_key = None
+            if cache:
+                with trace.span("cache_lookup") as span:
+                    cache_key = await asyncio.to_thread(payload_cache_key, model, payload)
+                    span["hit"] = await asyncio.to_thread(
+                        restore_cached, cache, cache_key, output_paths, on_status
+                    )
+                record_cache_lookup(model, image_size, span["hit"])
+                if span["hit"]:
+                    return generation_result(
+                        await transcode_all(
+                            output_paths, output_format, output_quality, on_status, trace
+                        )
+                    )
+
+            raise_if_cancelled(cancel_event)
+            if on_status:
+                on_status("submitting request")
+            url = generate_content_url(api_base, model)
+            hedger = get_hedger(hedge_percentile, hedge_max_ratio)
+            limiter = get_rate_limiter(api_base, model, rate_limit)
+            attempts = 0
+
+            async def fetch(paths):
+                nonlocal attempts
+                attempts += 1
+                attempt_trace = trace.bind(attempt=attempts)
+                request = with_candidate_count(payload, len(paths))
+                with attempt_trace.span("attempt", candidates=len(paths)):
+                    if hedger:
+                        hedge_key = (model, image_size)
+                        if len(paths) > 1:
+                            hedge_key += (len(paths),)
+                        return await afetch_image_hedged(
+                            url,
+                            api_key,
+                            request,
+                            paths,
+                            timeout,
+                            on_status,
+                            hedger,
+                            hedge_key,
+                            attempt_trace,
+                            limiter,
+                        )
+                    return await afetch_image_to_file(
+                        url, api_key, request, paths, timeout, on_status, attempt_trace
+                    )
+
+            async def fetch_with_retries(paths):
+                try:
+                    return await acall_with_retries(
+                        lambda: fetch(paths),
+                        limiter,
+                        max_retries,
+                        on_status,
+                    )
+                except urllib.error.HTTPError as exc:
+                    raise api_error_from(exc) from exc
+
+            async def fetch_candidates():
+                saved = await fetch_with_retries(output_paths)
+                per_request = len(saved)
+                missing = missing_outputs(output_paths, saved)
+                while missing:
+                    if on_status:
+                        on_status(
+                            f"got {len(output_paths) - len(missing)}/{len(output_paths)} "
+                            f"images, requesting {len(missing)} more"
+                        )
+                    for paths in await asyncio.gather(
+                        *map(fetch_with_retries, candidate_batches(missing, per_request))
+                    ):
+                        saved.extend(paths)
+                    missing = missing_outputs(output_paths, saved)
+                return output_paths
+
+            async def produce():
+                paths = await fetch_candidates()
+                if cache:
+                    with trace.span("cache_store"):
+                        await asyncio.to_thread(cache.put, cache_key, paths)
+                return await transcode_all(paths, output_format, output_quality, on_status, trace)
+
+            if coalesce:
+                sources, shared = await run_cancellable(
+                    get_async_single_flight().run(
+                        (
+                            api_base,
+                            cache_key or flight_key(model, payload, image_items, max_pixels),
+                            normalize_format(output_format),
+                            output_quality,
+                        ),
+                        produce,
+                        on_join=on_status and (lambda: on_status("joining identical request")),
+                    ),
+                    cancel_event,
+                )
+            else:
+                sources, shared = await run_cancellable(produce(), cancel_event), False
+            if shared:
+                with trace.span("coalesced"):
+                    for source, path in zip(sources, output_paths):
+                        await asyncio.to_thread(link_or_copy, source, path, part_path_for(path))
+            return generation_result(output_paths)
+        except urllib.error.HTTPError as exc:
+            raise api_error_from(exc) from exc
@@ -1,42 +1,211 @@
 #!/usr/bin/env python3
 import base64
 import json
-import mimetypes
 import os
+import shutil
+import threading
+import time
 import urllib.error
-import urllib.request
 
 from .config import (
     DEFAULT_API_BASE,
     DEFAULT_ASPECT,
+    DEFAULT_CANDIDATE_COUNT,
     DEFAULT_FORMAT,
+    DEFAULT_HEDGE_MAX_RATIO,
+    DEFAULT_HEDGE_PERCENTILE,
+    DEFAULT_MAX_RETRIES,
     DEFAULT_MODEL,
+    DEFAULT_OUTPUT_QUALITY,
     DEFAULT_PROVIDER,
+    DEFAULT_RATE_LIMIT,
     DEFAULT_RESOLUTION,
 )
+from .cache import payload_cache_key, response_mime_type
+from .hedging import get_hedger
+from .imaging import downscale_reference, resolve_max_ref_pixels
+from .metrics import record_cache_lookup, track_exchange
+from .ratelimit import call_with_retries, get_rate_limiter, retry_after_seconds
+from .singleflight import get_single_flight, link_or_copy
+from .streaming import DEFAULT_CHUNK_SIZE, InlineBlob, InlineImageScanner, encode_json_body
+from .trace import NULL_TRACE, ExchangeTimer, TracedBody
+from .transcode import (
+    normalize_format,
+    normalize_quality,
+    transcode_output,
+    with_format_extension,
+)
+from .transport import AbortHandle, RequestAborted, get_transport
+
+MAX_IMAGE_PREFETCH = 4
+MAX_CANDIDATE_FANOUT = 4
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class ApiError(RuntimeError):
+    """An HTTP error returned by the API, with its status code."""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class GenerationCancelled(RuntimeError):
+    """Raised when a generation is stopped through its cancel_event."""
+
+
+def raise_if_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise GenerationCancelled("Generation cancelled")
+
+
+class CancelWatch:
+    """Abort in-flight requests as soon as ``cancel_event`` is set.
+
+    Requests take their AbortHandle from ``handle()``; a watcher thread runs
+    while the watch is open and aborts every handle on cancellation, so
+    blocked uploads and reads end at once instead of at the timeout.
+    """
+
+    def __init__(self, cancel_event=None):
+        self.cancel_event = cancel_event
+        self.handles = []
+        self._closed = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def handle(self):
+        abort = AbortHandle()
+        if self.cancel_event is None:
+            return abort
+        with self._lock:
+            self.handles.append(abort)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, daemon=True)
+                self._thread.start()
+        if self.cancel_event.is_set():
+            abort.abort()
+        return abort
+
+    def _watch(self):
+        while not self._closed.is_set():
+            if self.cancel_event.wait(CANCEL_POLL_INTERVAL):
+                with self._lock:
+                    handles = list(self.handles)
+                for abort in handles:
+                    abort.abort()
+                return
 
-def request_json(method, url, api_key, payload=None, timeout=30):
-    data_bytes = None
+    def close(self):
+        self._closed.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def build_headers(api_key, body=None):
     headers = {
         "Authorization": f"Bearer {api_key}",
         "User-Agent": "ai-draw/1.0",
         "Accept": "application/json",
     }
-    if payload is not None:
-        data_bytes = json.dumps(payload).encode("utf-8")
+    if body is not None:
         headers["Content-Type"] = "application/json"
+        headers["Content-Length"] = str(len(body))
+    return headers
 
-    req = urllib.request.Request(url, data=data_bytes, headers=headers, method=method)
-    with urllib.request.urlopen(req, timeout=timeout) as resp:
-        body = resp.read().decode("utf-8")
-        return json.loads(body)
 
+def encode_payload(payload):
+    if payload is None:
+        return None
+    return encode_json_body(payload)
 
-def extract_inline_image_data(response):
+
+def decode_response(body):
+    return json.loads(body.decode("utf-8"))
+
+
+def request_json(method, url, api_key, payload=None, timeout=30, transport=None):
+    body = encode_payload(payload)
+    headers = build_headers(api_key, body)
+    transport = transport or get_transport()
+    timer = ExchangeTimer(body)
+    with track_exchange(url, payload, timer), transport.open(
+        method, url, headers, body, timeout
+    ) as resp:
+        timer.response_started(resp.status)
+        data = resp.read()
+        timer.received = len(data)
+    return decode_response(data)
+
+
+def check_response_error(response):
     if "error" in response:
         error = response.get("error") or {}
         message = error.get("message") or str(error)
         raise RuntimeError(message)
+
+
+def stream_image_response(
+    method,
+    url,
+    api_key,
+    open_sink,
+    payload=None,
+    timeout=30,
+    transport=None,
+    abort=None,
+    trace=NULL_TRACE,
+):
+    """Send a request and decode inline images from the body as it arrives.
+
+    Returns the response with image data blanked out and the list of images
+    handed to ``open_sink`` (see InlineImageScanner). ``abort`` is an optional
+    AbortHandle; aborting it raises RequestAborted. With a ``trace``, the
+    serialize, upload, wait and download phases are recorded as spans.
+    """
+    with trace.span("serialize") as span:
+        body = encode_payload(payload)
+        span["bytes"] = len(body)
+    if trace.enabled:
+        body = TracedBody(body)
+    timer = ExchangeTimer(body)
+    if trace.enabled:
+        open_sink = timer.sink(open_sink)
+    headers = build_headers(api_key, body)
+    transport = transport or get_transport()
+    scanner = InlineImageScanner(open_sink)
+    with track_exchange(url, payload, timer):
+        try:
+            with transport.open(method, url, headers, body, timeout, abort=abort) as resp:
+                timer.response_started(resp.status)
+                while True:
+                    chunk = resp.read(DEFAULT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    timer.feed(scanner.feed, chunk)
+        except Exception as exc:
+            if isinstance(exc, urllib.error.HTTPError):
+                timer.response_started(exc.code)
+            if abort is not None and abort.aborted and not isinstance(exc, RequestAborted):
+                raise RequestAborted("Request aborted") from exc
+            raise
+        finally:
+            scanner.close()
+            timer.record(trace)
+    response = scanner.finish()
+    check_response_error(response)
+    return response, scanner.images
+
+
+def extract_inline_images(response):
+    """Return the base64 data of every inline image, across all candidates."""
+    check_response_error(response)
+    images = []
     candidates = response.get("candidates") or []
     for candidate in candidates:
         content = candidate.get("content") or {}
@@ -44,29 +213,54 @@ def extract_inline_image_data(response):
         for part in parts:
             inline = part.get("inlineData") or part.get("inline_data")
             if inline and inline.get("data"):
-                return inline.get("data")
-    return None
+                images.append(inline.get("data"))
+    return images
+
+
+def extract_inline_image_data(response):
+    images = extract_inline_images(response)
+    return images[0] if images else None
 
 
 def is_url(value):
     return value.startswith("http://") or value.startswith("https://")
 
 
-def load_image_bytes(image_item):
+IMAGE_REQUEST_HEADERS = {
+    "User-Agent": "ai-draw/1.0",
+    "Accept": "*/*",
+}
+
+
+def guess_mime_type(image_item):
+    import mimetypes
+
+    return mimetypes.guess_type(image_item)[0] or "application/octet-stream"
+
+
+def read_abortable(resp, abort=None):
+    """Read a whole response body, stopping between chunks once ``abort`` fires."""
+    chunks = []
+    while True:
+        if abort is not None:
+            abort.check()
+        chunk = resp.read(DEFAULT_CHUNK_SIZE)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def load_image_bytes(image_item, abort=None):
     if is_url(image_item):
-        headers = {
-            "User-Agent": "ai-draw/1.0",
-            "Accept": "*/*",
-        }
-        req = urllib.request.Request(image_item, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=60) as resp:
-            data = resp.read()
-        mime_type = mimetypes.guess_type(image_item)[0] or "application/octet-stream"
+        with get_transport().open(
+            "GET", image_item, IMAGE_REQUEST_HEADERS, timeout=60, abort=abort
+        ) as resp:
+            data = read_abortable(resp, abort)
+        mime_type = response_mime_type(resp.headers) or guess_mime_type(image_item)
         return data, mime_type
     with open(image_item, "rb") as f:
         data = f.read()
-    mime_type = mimetypes.guess_type(image_item)[0] or "application/octet-stream"
-    return data, mime_type
+    return data, guess_mime_type(image_item)
 
 
 def normalize_image_size(value):
@@ -87,16 +281,13 @@ def normalize_image_size(value):
     return mapping.get(lower, text)
 
 
-def create_prediction(
-    api_base,
-    api_key,
-    prompt,
-    model,
-    aspect_ratio,
-    output_resolution=None,
-    timeout=120.0,
+def generate_content_url(api_base, model):
+    return f"{api_base}/models/{model}:generateContent"
+
+
+def build_generate_payload(
+    prompt, aspect_ratio, output_resolution=None, image_parts=None, candidate_count=1
 ):
-    url = f"{api_base}/models/{model}:generateContent"
     image_size = normalize_image_size(output_resolution)
     image_config = {}
     if aspect_ratio:
@@ -104,12 +295,65 @@ def create_prediction(
     if image_size:
         image_config["imageSize"] = image_size
     payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
+        "contents": [
+            {
+                "parts": [{"text": prompt}, *(image_parts or [])],
+            }
+        ],
         "generationConfig": {
             "responseModalities": ["IMAGE"],
             "imageConfig": image_config,
         },
     }
+    return with_candidate_count(payload, candidate_count)
+
+
+def with_candidate_count(payload, candidate_count):
+    """Return ``payload`` asking for ``candidate_count`` candidates.
+
+    A single candidate is the API default, so the field is left out then and
+    single-image payloads (and their cache keys) stay as they were.
+    """
+    config = dict(payload["generationConfig"])
+    if candidate_count > 1:
+        config["candidateCount"] = candidate_count
+    else:
+        config.pop("candidateCount", None)
+    return {**payload, "generationConfig": config}
+
+
+def normalize_candidate_count(value):
+    try:
+        count = int(value or DEFAULT_CANDIDATE_COUNT)
+    except (TypeError, ValueError):
+        raise RuntimeError(f"Invalid candidate count: {value!r}") from None
+    if count < 1:
+        raise RuntimeError(f"Invalid candidate count: {value!r}")
+    return count
+
+
+def candidate_output_paths(output_path, candidate_count):
+    """Output files of a generation: ``output_path``, or output_1..N for several."""
+    if candidate_count <= 1:
+        return [output_path]
+    base, ext = os.path.splitext(output_path)
+    return [f"{base}_{number}{ext}" for number in range(1, candidate_count + 1)]
+
+
+def create_prediction(
+    api_base,
+    api_key,
+    prompt,
+    model,
+    aspect_ratio,
+    output_resolution=None,
+    timeout=120.0,
+    candidate_count=1,
+):
+    url = generate_content_url(api_base, model)
+    payload = build_generate_payload(
+        prompt, aspect_ratio, output_resolution, candidate_count=candidate_count
+    )
     return request_json("POST", url, api_key, payload=payload, timeout=timeout)
 
 
@@ -122,47 +366,383 @@ def create_edit_prediction(
     aspect_ratio,
     output_resolution=None,
     timeout=120.0,
+    candidate_count=1,
 ):
-    url = f"{api_base}/models/{model}:generateContent"
-    image_size = normalize_image_size(output_resolution)
-    image_config = {}
-    if aspect_ratio:
-        image_config["aspectRatio"] = aspect_ratio
-    if image_size:
-        image_config["imageSize"] = image_size
-    payload = {
-        "contents": [
-            {
-                "parts": [{"text": prompt}, *image_parts],
-            }
-        ],
-        "generationConfig": {
-            "responseModalities": ["IMAGE"],
-            "imageConfig": image_config,
-        },
-    }
+    url = generate_content_url(api_base, model)
+    payload = build_generate_payload(
+        prompt, aspect_ratio, output_resolution, image_parts, candidate_count
+    )
     return request_json("POST", url, api_key, payload=payload, timeout=timeout)
 
 
-def build_image_parts(image_items, on_status):
-    parts = []
+def load_image_blob(image_item, url_cache=None, on_status=None, abort=None):
+    if is_url(image_item):
+        if url_cache is None:
+            data, mime_type = load_image_bytes(image_item, abort)
+            return InlineBlob(data=data), mime_type
+        blob, mime_type = url_cache.fetch_blob(
+            image_item, IMAGE_REQUEST_HEADERS, timeout=60, on_status=on_status, abort=abort
+        )
+        return blob, mime_type or guess_mime_type(image_item)
+    return InlineBlob(path=image_item), guess_mime_type(image_item)
+
+
+def load_image_part(
+    item, on_status=None, max_pixels=None, url_cache=None, trace=NULL_TRACE, abort=None
+):
+    with trace.span("read_reference", url=is_url(item)) as span:
+        blob, mime_type = load_image_blob(item, url_cache, on_status, abort)
+        span["bytes"] = blob.size
+    if max_pixels:
+        with trace.span("downscale_reference") as span:
+            blob, mime_type = downscale_reference(blob, mime_type, max_pixels, on_status)
+            span["bytes"] = blob.size
+    return {
+        "inline_data": {
+            "mime_type": mime_type,
+            "data": blob,
+        }
+    }
+
+
+def build_image_parts(
+    image_items,
+    on_status,
+    max_pixels=None,
+    url_cache=None,
+    cancel_event=None,
+    trace=NULL_TRACE,
+    watch=None,
+):
+    """Load the reference images as inline parts, several at a time.
+
+    With a CancelWatch as ``watch``, downloads are aborted as soon as the
+    cancel event is set instead of running to their timeout.
+    """
+
+    def handle():
+        return watch.handle() if watch is not None else None
+
     for item in image_items:
         if not (is_url(item) or os.path.isfile(item)):
             raise RuntimeError(f"Image not found or invalid: {item}")
-        if on_status:
+    total = len(image_items)
+    if total <= 1:
+        if total and on_status:
             on_status("loading image")
-        data, mime_type = load_image_bytes(item)
-        parts.append(
-            {
-                "inline_data": {
-                    "mime_type": mime_type,
-                    "data": base64.b64encode(data).decode("ascii"),
-                }
-            }
-        )
+        return [
+            load_image_part(
+                item, on_status, max_pixels, url_cache, trace.bind(image=index), handle()
+            )
+            for index, item in enumerate(image_items)
+        ]
+
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    if on_status:
+        on_status(f"loading {total} images")
+    parts = [None] * total
+    pool = ThreadPoolExecutor(max_workers=min(total, MAX_IMAGE_PREFETCH))
+    futures = {
+        pool.submit(
+            load_image_part,
+            item,
+            on_status,
+            max_pixels,
+            url_cache,
+            trace.bind(image=index),
+            handle(),
+        ): index
+        for index, item in enumerate(image_items)
+    }
+    pending = set(futures)
+    loaded = 0
+    try:
+        while pending:
+            done, pending = wait(
+                pending, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED
+            )
+            raise_if_cancelled(cancel_event)
+            for future in done:
+                parts[futures[future]] = future.result()
+                loaded += 1
+                if on_status:
+                    on_status(f"loaded image {loaded}/{total}")
+    finally:
+        # On the first failure, drop queued loads instead of waiting for them.
+        pool.shutdown(wait=False, cancel_futures=True)
     return parts
 
 
+def resolve_api_settings(api_base, api_key):
+    if not api_base:
+        api_base = DEFAULT_API_BASE
+    if not api_key:
+        api_key = os.getenv("GPTSAPI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Missing GPTSAPI_API_KEY environment variable")
+    return api_base, api_key
+
+
+def collect_image_items(image_path, image_urls):
+    image_items = []
+    if image_path:
+        image_items.append(image_path)
+    if image_urls:
+        image_items.extend(image_urls)
+    return image_items
+
+
+def prepare_output_dir(output_path):
+    out_dir = os.path.dirname(output_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+
+def part_path_for(output_path, attempt=0):
+    if attempt:
+        return f"{output_path}.{attempt}.part"
+    return f"{output_path}.part"
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def part_file_sink(part_paths, on_status=None):
+    """Sink factory writing the Nth inline image to ``part_paths[N]``.
+
+    Images beyond the number of part files are skipped.
+    """
+
+    def open_sink(index):
+        if index >= len(part_paths):
+            return None
+        if on_status:
+            on_status("saving" if len(part_paths) == 1 else f"saving image {index + 1}")
+        return open(part_paths[index], "wb")
+
+    return open_sink
+
+
+def decoded_indexes(images, count):
+    """Indexes (below ``count``) of the images that were decoded to a file."""
+    return [image["index"] for image in images if image["index"] < count and image["size"]]
+
+
+def commit_part_files(images, part_paths, output_paths):
+    """Move every decoded image to its output path; return the paths written."""
+    indexes = decoded_indexes(images, len(part_paths))
+    if not indexes:
+        raise RuntimeError("No image data found in response")
+    for index in indexes:
+        os.replace(part_paths[index], output_paths[index])
+    return [output_paths[index] for index in indexes]
+
+
+def remove_files(paths):
+    for path in paths:
+        remove_file(path)
+
+
+def fetch_image_to_file(
+    url,
+    api_key,
+    payload,
+    output_paths,
+    timeout=120.0,
+    on_status=None,
+    abort=None,
+    trace=NULL_TRACE,
+):
+    """Send ``payload`` and save its images to ``output_paths``, in order.
+
+    Returns the paths that received an image; the response may hold fewer
+    images than there are paths.
+    """
+    part_paths = [part_path_for(path) for path in output_paths]
+    try:
+        _, images = stream_image_response(
+            "POST",
+            url,
+            api_key,
+            part_file_sink(part_paths, on_status),
+            payload=payload,
+            timeout=timeout,
+            abort=abort,
+            trace=trace,
+        )
+        with trace.span("commit"):
+            return commit_part_files(images, part_paths, output_paths)
+    finally:
+        remove_files(part_paths)
+
+
+def fetch_image_hedged(
+    url,
+    api_key,
+    payload,
+    output_paths,
+    timeout,
+    on_status,
+    hedger,
+    hedge_key,
+    watch=None,
+    trace=NULL_TRACE,
+    limiter=None,
+):
+    """Like fetch_image_to_file, but race a second request once the first is slow.
+
+    The hedge starts when the first request outlives the hedger's latency
+    percentile for ``hedge_key``, the hedge budget allows it and ``limiter``
+    (the rate limiter) has a token free right away. The first attempt to
+    produce an image wins; the other one is aborted.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    delay = hedger.delay(hedge_key)
+    attempts = {}
+    pool = ThreadPoolExecutor(max_workers=2)
+
+    def attempt(part_paths, abort, attempt_trace):
+        started = time.monotonic()
+        try:
+            _, images = stream_image_response(
+                "POST",
+                url,
+                api_key,
+                part_file_sink(part_paths, on_status),
+                payload=payload,
+                timeout=timeout,
+                abort=abort,
+                trace=attempt_trace,
+            )
+            if not decoded_indexes(images, len(part_paths)):
+                raise RuntimeError("No image data found in response")
+            abort.check()
+        except BaseException:
+            remove_files(part_paths)
+            raise
+        return time.monotonic() - started, images
+
+    def start(number):
+        abort = watch.handle() if watch else AbortHandle()
+        part_paths = [part_path_for(path, number) for path in output_paths]
+        future = pool.submit(attempt, part_paths, abort, trace.bind(hedge=number))
+        attempts[future] = (abort, part_paths)
+        return future
+
+    errors = []
+    winner = None
+    try:
+        done, pending = wait([start(0)], timeout=delay)
+        if pending and hedger.try_hedge() and (limiter is None or limiter.try_acquire()):
+            if on_status:
+                on_status(f"hedging request after {delay:.1f}s")
+            pending.add(start(1))
+        while True:
+            for future in done:
+                try:
+                    elapsed, images = future.result()
+                except Exception as exc:
+                    errors.append(exc)
+                    continue
+                winner = future
+                hedger.record(hedge_key, elapsed)
+                part_paths = attempts[future][1]
+                try:
+                    with trace.span("commit"):
+                        return commit_part_files(images, part_paths, output_paths)
+                finally:
+                    remove_files(part_paths)
+            if not pending:
+                raise errors[0]
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+    finally:
+        for future, (abort, part_paths) in attempts.items():
+            if future is not winner:
+                abort.abort()
+                if future.done():
+                    remove_files(part_paths)
+        pool.shutdown(wait=False)
+
+
+def save_response_image(response, output_path):
+    return save_response_images(response, [output_path])[0]
+
+
+def save_response_images(response, output_paths):
+    """Decode the inline images of ``response`` into ``output_paths``, in order."""
+    inline_images = extract_inline_images(response)[: len(output_paths)]
+    if not inline_images:
+        raise RuntimeError("No image data found in response")
+    for inline_data, output_path in zip(inline_images, output_paths):
+        with open(output_path, "wb") as f:
+            f.write(base64.b64decode(inline_data))
+    return output_paths[: len(inline_images)]
+
+
+def restore_cached(cache, cache_key, output_paths, on_status=None):
+    cached = cache.get(cache_key) if cache else None
+    if not cached or len(cached) < len(output_paths):
+        return False
+    try:
+        for source, output_path in zip(cached, output_paths):
+            shutil.copyfile(source, output_path)
+    except OSError:
+        # Evicted or unreadable since the lookup: generate as on a miss.
+        return False
+    if on_status:
+        on_status("cache hit")
+    return True
+
+
+def missing_outputs(output_paths, saved):
+    saved = set(saved)
+    return [path for path in output_paths if path not in saved]
+
+
+def candidate_batches(missing, per_request):
+    """Split the outputs still missing into requests of ``per_request`` images."""
+    per_request = max(1, per_request)
+    return [missing[start : start + per_request] for start in range(0, len(missing), per_request)]
+
+
+def reference_identity(item):
+    """Cheap stand-in for a reference's content: its URL, or path, mtime and size."""
+    if is_url(item):
+        return item
+    try:
+        stat = os.stat(item)
+    except OSError:
+        return item
+    return (os.path.abspath(item), stat.st_mtime_ns, stat.st_size)
+
+
+def flight_key(model, payload, image_items, max_pixels):
+    """Single-flight key of a request, without reading its reference images."""
+    prompt = payload["contents"][0]["parts"][0]["text"]
+    config = json.dumps(payload["generationConfig"], sort_keys=True)
+    references = tuple(reference_identity(item) for item in image_items)
+    return (model, prompt, config, max_pixels, references)
+
+
+def generation_result(output_paths):
+    return output_paths[0] if len(output_paths) == 1 else list(output_paths)
+
+
+def http_error_message(exc):
+    body = exc.read().decode("utf-8")
+    return f"HTTP {exc.code}: {body}"
+
+
+def api_error_from(exc):
+    return ApiError(http_error_message(exc), exc.code, retry_after_seconds(exc))
+
+
 def generate_image(
     *,
     prompt,
@@ -180,62 +760,210 @@ def generate_image(
     api_key=None,
     on_status=None,
     cancel_event=None,
+    cache=None,
+    max_ref_pixels=None,
+    url_cache=None,
+    max_retries=DEFAULT_MAX_RETRIES,
+    rate_limit=DEFAULT_RATE_LIMIT,
+    hedge_percentile=DEFAULT_HEDGE_PERCENTILE,
+    hedge_max_ratio=DEFAULT_HEDGE_MAX_RATIO,
+    trace=None,
+    output_quality=DEFAULT_OUTPUT_QUALITY,
+    candidate_count=DEFAULT_CANDIDATE_COUNT,
+    coalesce=False,
 ):
-    if not api_base:
-        api_base = DEFAULT_API_BASE
-    if not api_key:
-        api_key = os.getenv("GPTSAPI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing GPTSAPI_API_KEY environment variable")
+    """Generate one image and save it to ``output_path``.
+
+    The image is stored as ``output_format`` (png, jpg or webp), re-encoded
+    with ``output_quality`` (0-100) when the API returned another format. An
+    image extension on ``output_path`` is changed to match, and the returned
+    path is the one actually written.
+    Pass a core.trace.Trace as ``trace`` to record per-phase timings.
+
+    With ``candidate_count`` N > 1, one request asks for N candidates, which
+    are saved as output_1..output_N next to ``output_path`` and returned as a
+    list. If the model sends back fewer, the missing ones are requested again
+    in parallel, sized by how many the first response held.
+
+    With ``coalesce=True``, a call identical to one already in flight in this
+    process waits for it and gets a link to its output instead of calling the
+    API. Only opt in when every caller wants the same image.
+    """
+    trace = trace or NULL_TRACE
+    api_base, api_key = resolve_api_settings(api_base, api_key)
     if not str(prompt).strip():
         raise RuntimeError("Prompt is required")
+    candidate_count = normalize_candidate_count(candidate_count)
+    output_quality = normalize_quality(output_quality)
+    # The saved bytes are re-encoded as output_format, so the name must say so.
+    output_path = with_format_extension(output_path, output_format)
 
-    out_dir = os.path.dirname(output_path)
-    if out_dir:
-        os.makedirs(out_dir, exist_ok=True)
-
-    image_items = []
-    if image_path:
-        image_items.append(image_path)
-    if image_urls:
-        image_items.extend(image_urls)
+    prepare_output_dir(output_path)
+    output_paths = candidate_output_paths(output_path, candidate_count)
+    image_items = collect_image_items(image_path, image_urls)
+    image_size = normalize_image_size(output_resolution)
 
-    try:
-        image_parts = build_image_parts(image_items, on_status)
-        use_image_edit = len(image_parts) > 0
-        if on_status:
-            on_status("submitting request")
-        if use_image_edit:
-            create_resp = create_edit_prediction(
-                api_base,
-                api_key,
-                prompt,
-                model,
-                image_parts,
-                aspect,
-                output_resolution,
-                timeout,
+    with trace.span("generate", model=model, resolution=image_size, candidates=candidate_count):
+        try:
+            raise_if_cancelled(cancel_event)
+            max_pixels = resolve_max_ref_pixels(max_ref_pixels, image_size)
+            image_parts = []
+            if image_items:
+                with trace.span("load_references", count=len(image_items)) as span:
+                    with CancelWatch(cancel_event) as watch:
+                        image_parts = build_image_parts(
+                            image_items,
+                            on_status,
+                            max_pixels,
+                            url_cache,
+                            cancel_event,
+                            trace,
+                            watch,
+                        )
+                    span["bytes"] = sum(
+                        part["inline_data"]["data"].size for part in image_parts
+                    )
+            raise_if_cancelled(cancel_event)
+            payload = build_generate_payload(
+                prompt, aspect, output_resolution, image_parts, candidate_count
             )
-        else:
-            create_resp = create_prediction(
-                api_base,
-                api_key,
-                prompt,
-                model,
-                aspect,
-                output_resolution,
-                timeout,
-            )
-        inline_data = extract_inline_image_data(create_resp)
-        if not inline_data:
-            raise RuntimeError("No image data found in response")
+            cache_key = None
+            if cache:
+                with trace.span("cache_lookup") as span:
+                    cache_key = payload_cache_key(model, payload)
+                    span["hit"] = restore_cached(cache, cache_key, output_paths, on_status)
+                record_cache_lookup(model, image_size, span["hit"])
+                if span["hit"]:
+                    return generation_result(
+                        [
+                            transcode_output(path, output_format, output_quality, on_status, trace)
+                            for path in output_paths
+                        ]
+                    )
 
-        if on_status:
-            on_status("saving")
-        image_bytes = base64.b64decode(inline_data)
-        with open(output_path, "wb") as f:
-            f.write(image_bytes)
-        return output_path
-    except urllib.error.HTTPError as exc:
-        body = exc.read().decode("utf-8")
-        raise RuntimeError(f"HTTP {exc.code}: {body}") from exc
+            raise_if_cancelled(cancel_event)
+            if on_status:
+                on_status("submitting request")
+            url = generate_content_url(api_base, model)
+            hedger = get_hedger(hedge_percentile, hedge_max_ratio)
+            limiter = get_rate_limiter(api_base, model, rate_limit)
+            attempts = 0
+            attempts_lock = threading.Lock()
+
+            with CancelWatch(cancel_event) as watch:
+
+                def fetch(paths):
+                    nonlocal attempts
+                    with attempts_lock:
+                        attempts += 1
+                        attempt_trace = trace.bind(attempt=attempts)
+                    request = with_candidate_count(payload, len(paths))
+                    with attempt_trace.span("attempt", candidates=len(paths)):
+                        if hedger:
+                            # Several candidates take longer; keep their latencies apart.
+                            hedge_key = (model, image_size)
+                            if len(paths) > 1:
+                                hedge_key += (len(paths),)
+                            return fetch_image_hedged(
+                                url,
+                                api_key,
+                                request,
+                                paths,
+                                timeout,
+                                on_status,
+                                hedger,
+                                hedge_key,
+                                watch,
+                                attempt_trace,
+                                limiter,
+                            )
+                        return fetch_image_to_file(
+                            url,
+                            api_key,
+                            request,
+                            paths,
+                            timeout,
+                            on_status,
+                            watch.handle(),
+                            attempt_trace,
+                        )
+
+                def fetch_with_retries(paths):
+                    try:
+                        return call_with_retries(
+                            lambda: fetch(paths),
+                            limiter,
+                            max_retries,
+                            on_status,
+                            cancel_event,
+                        )
+                    except urllib.error.HTTPError as exc:
+                        # Converted here so that followers get the error body too.
+                        raise api_error_from(exc) from exc
+
+                def fetch_candidates():
+                    saved = fetch_with_retries(output_paths)
+                    per_request = len(saved)
+                    missing = missing_outputs(output_paths, saved)
+                    while missing:
+                        # The model capped the candidates: fan the rest out.
+                        batches = candidate_batches(missing, per_request)
+                        if on_status:
+                            on_status(
+                                f"got {len(output_paths) - len(missing)}/{len(output_paths)} "
+                                f"images, requesting {len(missing)} more"
+                            )
+                        if len(batches) == 1:
+                            saved.extend(fetch_with_retries(batches[0]))
+                        else:
+                            from concurrent.futures import ThreadPoolExecutor
+
+                            pool = ThreadPoolExecutor(
+                                max_workers=min(len(batches), MAX_CANDIDATE_FANOUT)
+                            )
+                            try:
+                                for paths in pool.map(fetch_with_retries, batches):
+                                    saved.extend(paths)
+                            finally:
+                                pool.shutdown(wait=False, cancel_futures=True)
+                        missing = missing_outputs(output_paths, saved)
+                    return output_paths
+
+                def produce():
+                    paths = fetch_candidates()
+                    if cache:
+                        with trace.span("cache_store"):
+                            cache.put(cache_key, paths)
+                    return [
+                        transcode_output(path, output_format, output_quality, on_status, trace)
+                        for path in paths
+                    ]
+
+                if coalesce:
+                    sources, shared = get_single_flight().run(
+                        (
+                            api_base,
+                            cache_key or flight_key(model, payload, image_items, max_pixels),
+                            normalize_format(output_format),
+                            output_quality,
+                        ),
+                        produce,
+                        check=lambda: raise_if_cancelled(cancel_event),
+                        abandon=(GenerationCancelled, RequestAborted),
+                        on_join=on_status and (lambda: on_status("joining identical request")),
+                    )
+                else:
+                    sources, shared = produce(), False
+            if shared:
+                with trace.span("coalesced"):
+                    for source, path in zip(sources, output_paths):
+                        link_or_copy(source, path, part_path_for(path))
+            return generation_result(output_paths)
+        except GenerationCancelled:
+            raise
+        except Exception as exc:
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelled("Generation cancelled") from exc
+            if isinstance(exc, urllib.error.HTTPError):
+                raise api_error_from(exc) from exc
+            raise
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""Batch generation on top of generate_image."""
+import json
+import math
+import os
+import time
+import urllib.error
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Event, Lock
+
+from .app import (
+    GenerationCancelled,
+    candidate_output_paths,
+    generate_image,
+    generation_result,
+    normalize_candidate_count,
+)
+from .config import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_FORMAT,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_MIN_CONCURRENCY,
+)
+from .journal import job_spec_hash
+from .ratelimit import THROTTLE_STATUSES
+from .trace import Trace
+from .transcode import with_format_extension
+
+OVERLOAD_STATUSES = THROTTLE_STATUSES + (408, 504)
+LATENCY_WINDOW = 20
+LATENCY_MIN_SAMPLES = 10
+# A window p95 this many times the baseline counts as congestion.
+LATENCY_TOLERANCE = 2.0
+OVERLOAD_DECREASE = 0.5
+LATENCY_DECREASE = 0.75
+
+
+JOB_FIELD_ALIASES = {
+    "out": "output_path",
+    "output": "output_path",
+    "resolution": "output_resolution",
+    "format": "output_format",
+    "quality": "output_quality",
+    "count": "candidate_count",
+    "image": "image_path",
+    "images": "image_urls",
+}
+
+JOB_FIELDS = {
+    "prompt",
+    "provider",
+    "model",
+    "aspect",
+    "output_format",
+    "output_quality",
+    "output_resolution",
+    "output_path",
+    "image_path",
+    "image_urls",
+    "timeout",
+    "candidate_count",
+}
+
+
+def read_jobs(path):
+    """Yield job specs from a JSON lines file.
+
+    Lines that fail to parse are yielded as RuntimeError instances so the
+    batch can report them without stopping the run.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, start=1):
+            text = line.strip()
+            if not text:
+                continue
+            try:
+                yield json.loads(text)
+            except ValueError as exc:
+                yield RuntimeError(f"{path}:{lineno}: invalid JSON: {exc}")
+
+
+def job_to_kwargs(job, defaults=None):
+    """Merge a job spec over the batch defaults into generate_image kwargs."""
+    if isinstance(job, str):
+        job = {"prompt": job}
+    if not isinstance(job, dict):
+        raise RuntimeError(f"Invalid job spec: {job!r}")
+    kwargs = dict(defaults or {})
+    for key, value in job.items():
+        name = JOB_FIELD_ALIASES.get(key, key)
+        if name not in JOB_FIELDS:
+            raise RuntimeError(f"Unknown job field: {key}")
+        kwargs[name] = value
+    image_urls = kwargs.get("image_urls")
+    if isinstance(image_urls, str):
+        kwargs["image_urls"] = [
+            item.strip() for item in image_urls.split(",") if item.strip()
+        ]
+    return kwargs
+
+
+def is_overload(exc):
+    """True for failures that mean the API is saturated: throttling or timeouts."""
+    status = getattr(exc, "status", None) or getattr(exc, "code", None)
+    if status in OVERLOAD_STATUSES:
+        return True
+    if isinstance(exc, urllib.error.URLError) and isinstance(exc.reason, TimeoutError):
+        return True
+    return isinstance(exc, TimeoutError)
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the number of batch jobs in flight.
+
+    The limit grows by one for every ``limit`` healthy completions while the
+    pool is saturated, and is cut multiplicatively on throttling, timeouts or
+    a window p95 latency well above the best one seen. Only jobs started after
+    the last cut can cause another one, so a burst of failures counts once.
+    ``record`` may be called from several worker threads.
+    """
+
+    def __init__(
+        self,
+        initial=DEFAULT_CONCURRENCY,
+        min_limit=DEFAULT_MIN_CONCURRENCY,
+        max_limit=DEFAULT_MAX_CONCURRENCY,
+        on_change=None,
+    ):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(self.max_limit, max(self.min_limit, int(initial))))
+        self.on_change = on_change
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.baseline = None
+        self.last_cut = float("-inf")
+        self._lock = Lock()
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    def p95(self):
+        if len(self.latencies) < LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+    def record(self, elapsed, overloaded=False, saturated=True):
+        """Feed one finished job into the controller."""
+        with self._lock:
+            before = self.current
+            reason = self._update(elapsed, overloaded, saturated)
+            after = self.current
+        if after != before and self.on_change:
+            self.on_change(after, reason)
+
+    def _update(self, elapsed, overloaded, saturated):
+        started = time.monotonic() - elapsed
+        reason = None
+        if overloaded:
+            reason = self._cut(started, OVERLOAD_DECREASE, "throttled or timed out")
+        else:
+            self.latencies.append(elapsed)
+            p95 = self.p95()
+            if p95 is not None and self.baseline and p95 > self.baseline * LATENCY_TOLERANCE:
+                reason = self._cut(started, LATENCY_DECREASE, f"p95 latency {p95:.1f}s")
+            else:
+                if p95 is not None:
+                    if self.baseline is None or p95 < self.baseline:
+                        self.baseline = p95
+                    else:
+                        # Let the baseline follow slow drifts in job size.
+                        self.baseline += (p95 - self.baseline) * 0.05
+                if saturated:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                    reason = "healthy"
+        return reason
+
+    def _cut(self, started, factor, reason):
+        if started < self.last_cut:
+            return None
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.last_cut = time.monotonic()
+        self.latencies.clear()
+        return reason
+
+
+def default_output_path(index, output_dir, output_format):
+    return os.path.join(output_dir, f"batch-{index:05d}.{output_format or DEFAULT_FORMAT}")
+
+
+def run_job(index, job, defaults, output_dir, on_status=None, on_span=None, journal=None):
+    started = time.monotonic()
+    result = {
+        "index": index,
+        "job": job,
+        "output_path": None,
+        "error": None,
+        "overloaded": False,
+        "cancelled": False,
+        "skipped": False,
+        "elapsed": 0.0,
+    }
+    spec_hash = None
+    try:
+        if isinstance(job, Exception):
+            raise job
+        kwargs = job_to_kwargs(job, defaults)
+        if kwargs.get("output_path"):
+            # An explicit path's image extension follows the job's format.
+            kwargs["output_path"] = with_format_extension(
+                kwargs["output_path"], kwargs.get("output_format")
+            )
+        else:
+            kwargs["output_path"] = default_output_path(
+                index, output_dir, kwargs.get("output_format")
+            )
+        if on_status:
+            kwargs["on_status"] = lambda message: on_status(f"[{index}] {message}")
+        if journal:
+            spec_hash = job_spec_hash(kwargs)
+            expected = generation_result(
+                candidate_output_paths(
+                    kwargs["output_path"], normalize_candidate_count(kwargs.get("candidate_count"))
+                )
+            )
+            if journal.completed(spec_hash, expected):
+                result["output_path"] = expected
+                result["skipped"] = True
+                return result
+            journal.record("started", spec_hash, index, kwargs["output_path"])
+        if on_span:
+            kwargs["trace"] = Trace(on_span, job=index)
+        result["output_path"] = generate_image(**kwargs)
+        if journal:
+            journal.record("done", spec_hash, index, result["output_path"])
+    except Exception as exc:
+        result["error"] = str(exc) or exc.__class__.__name__
+        result["overloaded"] = is_overload(exc)
+        result["cancelled"] = isinstance(exc, GenerationCancelled)
+        if spec_hash and not result["cancelled"]:
+            journal.record("failed", spec_hash, index, error=result["error"])
+    result["elapsed"] = time.monotonic() - started
+    return result
+
+
+def generate_images_batch(
+    jobs,
+    *,
+    concurrency=DEFAULT_CONCURRENCY,
+    min_concurrency=DEFAULT_MIN_CONCURRENCY,
+    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+    output_dir="output",
+    on_result=None,
+    on_status=None,
+    on_span=None,
+    cancel_event=None,
+    journal=None,
+    **defaults,
+):
+    """Run job specs on a bounded worker pool and return per-job results.
+
+    ``jobs`` may be any iterable (it is consumed lazily). Each job is a dict
+    with generate_image fields (or their CLI aliases ``out``, ``resolution``,
+    ``format``, ``image``, ``images``, ``count``); remaining generate_image kwargs are
+    taken from ``defaults``. A failing job is recorded in its result and
+    never stops the run. Results are returned in job order; ``on_result`` is
+    called in completion order.
+
+    Setting ``cancel_event`` stops queuing jobs and aborts those in flight;
+    they are reported with ``cancelled`` set. An exception in the calling
+    thread (such as KeyboardInterrupt) cancels the batch the same way.
+
+    ``on_span`` receives the trace spans of every job (see core.trace), each
+    tagged with the job index.
+
+    With a ``journal`` (see core.journal), jobs whose recorded output is
+    still on disk unchanged are not run again; their results have
+    ``skipped`` set. Every other job's outcome is appended to the journal.
+
+    ``concurrency="auto"`` lets an AdaptiveConcurrency controller pick the
+    number of jobs in flight between ``min_concurrency`` and
+    ``max_concurrency``; changes are reported through ``on_status``.
+    """
+    controller = None
+    if str(concurrency).lower() == "auto":
+        controller = AdaptiveConcurrency(
+            DEFAULT_CONCURRENCY,
+            min_concurrency,
+            max_concurrency,
+            on_change=(
+                (lambda limit, reason: on_status(f"concurrency {limit} ({reason})"))
+                if on_status
+                else None
+            ),
+        )
+        workers = controller.max_limit
+        if on_status:
+            on_status(
+                f"concurrency {controller.current} "
+                f"(adaptive, {controller.min_limit}-{controller.max_limit})"
+            )
+    else:
+        workers = max(1, int(concurrency))
+    if cancel_event is None:
+        cancel_event = Event()
+    defaults["cancel_event"] = cancel_event
+    results = []
+    pending = set()
+
+    def capacity():
+        return controller.current if controller else workers * 2
+
+    def drain(return_when):
+        nonlocal pending
+        in_flight = len(pending)
+        done, pending = wait(pending, return_when=return_when)
+        for future in done:
+            result = future.result()
+            if controller and not result["skipped"]:
+                controller.record(
+                    result["elapsed"],
+                    result["overloaded"],
+                    saturated=in_flight >= controller.current,
+                )
+            results.append(result)
+            if on_result:
+                on_result(result)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for index, job in enumerate(jobs):
+                if cancel_event.is_set():
+                    break
+                while len(pending) >= capacity():
+                    drain(FIRST_COMPLETED)
+                pending.add(
+                    pool.submit(
+                        run_job,
+                        index,
+                        job,
+                        defaults,
+                        output_dir,
+                        on_status,
+                        on_span,
+                        journal,
+                    )
+                )
+            while pending:
+                drain(FIRST_COMPLETED)
+        except BaseException:
+            cancel_event.set()
+            raise
+
+    results.sort(key=lambda item: item["index"])
+    return results
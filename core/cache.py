@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""Content-addressed on-disk cache for generated images."""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import weakref
+
+from .config import (
+    CACHE_MODES,
+    DEFAULT_CACHE_MAX_MB,
+    DEFAULT_CACHE_MODE,
+    DEFAULT_URL_CACHE_MAX_AGE,
+    get_cache_dir,
+    get_data_dir,
+)
+from .streaming import DEFAULT_CHUNK_SIZE, INLINE_KEYS, InlineBlob
+from .transport import get_transport
+
+
+URL_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def normalize_for_key(value):
+    """Replace inline image data with its content hash, recursively."""
+    if isinstance(value, dict):
+        normalized = {}
+        for key, item in value.items():
+            if key in INLINE_KEYS and isinstance(item, dict):
+                item = dict(item)
+                data = item.get("data") or ""
+                if isinstance(data, InlineBlob):
+                    item["data"] = "sha256:" + data.digest()
+                else:
+                    item["data"] = "sha256:" + hashlib.sha256(data.encode("ascii")).hexdigest()
+            normalized[key] = normalize_for_key(item)
+        return normalized
+    if isinstance(value, list):
+        return [normalize_for_key(item) for item in value]
+    return value
+
+
+def payload_cache_key(model, payload):
+    """Hash a generateContent request into a stable cache key."""
+    text = json.dumps(
+        {"model": model, "payload": normalize_for_key(payload)},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def entry_size(path):
+    """Total size of the files in the directory ``path``."""
+    try:
+        return sum(item.stat().st_size for item in os.scandir(path))
+    except OSError:
+        return 0
+
+
+class ResponseCache:
+    """Generated images keyed by request hash, evicted least-recently-used.
+
+    ``mode`` is one of ``on`` (read and write), ``readonly`` (never store new
+    results), ``refresh`` (skip lookups but store fresh results) or ``off``.
+
+    The size of the cache is measured once, on the first store, and then kept
+    as a running total; the tree is only walked again to evict.
+    """
+
+    def __init__(self, root=None, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024, mode="on"):
+        if mode not in CACHE_MODES:
+            raise RuntimeError(f"Unknown cache mode: {mode}")
+        self.root = str(root or get_cache_dir())
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self.size = None
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @property
+    def readable(self):
+        return self.mode in ("on", "readonly")
+
+    @property
+    def writable(self):
+        return self.mode in ("on", "refresh")
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        """Return the cached image paths for ``key``, or None on a miss."""
+        if not self.readable:
+            return None
+        entry = self.entry_dir(key)
+        try:
+            names = sorted(os.listdir(entry), key=lambda name: int(name.split(".")[0]))
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        if not names:
+            return None
+        return [os.path.join(entry, name) for name in names]
+
+    def put(self, key, paths):
+        """Store copies of ``paths`` under ``key`` and evict old entries."""
+        if not self.writable:
+            return
+        entry = self.entry_dir(key)
+        parent = os.path.dirname(entry)
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+        try:
+            for index, path in enumerate(paths):
+                shutil.copyfile(path, os.path.join(staging, str(index)))
+            added = entry_size(staging)
+            with self._lock:
+                if self.size is None:
+                    self.size = sum(size for _, size, _ in self.entries())
+                if os.path.isdir(entry):
+                    added -= entry_size(entry)
+                    shutil.rmtree(entry, ignore_errors=True)
+                os.replace(staging, entry)
+                self.size += added
+                full = self.size > self.max_bytes
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        if full:
+            self.evict()
+
+    def entries(self):
+        """Return (last use, size, path) for every entry in the cache."""
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith(".tmp-") or not entry.is_dir():
+                    continue
+                entries.append((entry.stat().st_mtime, entry_size(entry.path), entry.path))
+        return entries
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits ``max_bytes``."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        with self._lock:
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+            self.size = total
+
+
+# Files that are being read, by absolute path, with a use count.
+_pinned = {}
+_pinned_lock = threading.Lock()
+
+
+def pin_file(path, place=None):
+    """Keep prune_directory from deleting ``path`` until release_file(path).
+
+    ``place``, if given, is called first under the same lock to move the file
+    into position. Returns False (and pins nothing) if ``path`` is missing.
+    """
+    path = os.path.abspath(path)
+    with _pinned_lock:
+        if place is not None:
+            place()
+        if not os.path.exists(path):
+            return False
+        _pinned[path] = _pinned.get(path, 0) + 1
+        return True
+
+
+def release_file(path):
+    path = os.path.abspath(path)
+    with _pinned_lock:
+        count = _pinned.get(path, 0) - 1
+        if count > 0:
+            _pinned[path] = count
+        else:
+            _pinned.pop(path, None)
+
+
+def pinned_blob(path):
+    """Wrap the pinned file ``path`` in an InlineBlob that releases it when freed."""
+    try:
+        blob = InlineBlob(path=path)
+    except BaseException:
+        release_file(path)
+        raise
+    weakref.finalize(blob, release_file, path)
+    return blob
+
+
+def prune_directory(path, max_bytes):
+    """Delete the least recently used files in ``path`` until it fits ``max_bytes``.
+
+    Pinned files are counted but never deleted.
+    """
+    entries = []
+    total = 0
+    for entry in os.scandir(path):
+        if entry.name.startswith(".tmp-") or not entry.is_file():
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+    if total <= max_bytes:
+        return
+    entries.sort()
+    with _pinned_lock:
+        for _, size, file_path in entries:
+            if total <= max_bytes:
+                break
+            if os.path.abspath(file_path) in _pinned:
+                continue
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            total -= size
+
+
+def response_mime_type(headers):
+    """Return the media type from a Content-Type header, if it names an image."""
+    content_type = (headers.get("Content-Type") or "").split(";", 1)[0].strip().lower()
+    return content_type if content_type.startswith("image/") else None
+
+
+class UrlCache:
+    """Remote reference images stored with their validators.
+
+    Entries younger than ``max_age`` seconds are served straight from disk;
+    older ones are revalidated with If-None-Match / If-Modified-Since and only
+    downloaded again when the server reports a change.
+
+    Bodies are stored under the hash of their content and never rewritten in
+    place, so a file that is being sent keeps its size and bytes. Bodies
+    returned by fetch stay pinned (see pin_file) until they are released;
+    fetch_blob releases them with their InlineBlob.
+    """
+
+    def __init__(self, root=None, max_age=DEFAULT_URL_CACHE_MAX_AGE, max_bytes=URL_CACHE_MAX_BYTES):
+        self.root = str(root or get_data_dir("urls"))
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def meta_path(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, key + ".json")
+
+    def body_path(self, digest):
+        return os.path.join(self.root, digest + ".body")
+
+    def store(self, tmp_path, digest):
+        """Move a downloaded body into place under its digest and pin it."""
+        body_path = self.body_path(digest)
+
+        def place():
+            if os.path.exists(body_path):
+                os.remove(tmp_path)
+                os.utime(body_path)
+            else:
+                os.replace(tmp_path, body_path)
+
+        pin_file(body_path, place)
+        return body_path
+
+    def load_meta(self, meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_meta(self, meta_path, meta):
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=self.root)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def fetch(self, url, headers=None, timeout=60, on_status=None, abort=None):
+        """Return (body_path, content_type) for ``url``, downloading only if needed.
+
+        The body is pinned; call release_file(body_path) once it is no longer read.
+        ``abort`` is an optional AbortHandle that stops the download.
+        """
+        meta_path = self.meta_path(url)
+        meta = self.load_meta(meta_path)
+        body_path = self.body_path(meta["body"]) if meta and meta.get("body") else None
+        if body_path is None or not pin_file(body_path):
+            meta = body_path = None
+        if meta and time.time() - meta.get("fetched_at", 0) < self.max_age:
+            os.utime(body_path)
+            return body_path, meta.get("content_type")
+
+        try:
+            request_headers = dict(headers or {})
+            if meta and meta.get("etag"):
+                request_headers["If-None-Match"] = meta["etag"]
+            if meta and meta.get("last_modified"):
+                request_headers["If-Modified-Since"] = meta["last_modified"]
+            try:
+                resp = get_transport().open(
+                    "GET", url, request_headers, timeout=timeout, abort=abort
+                )
+            except urllib.error.HTTPError as exc:
+                if exc.code != 304 or not meta:
+                    raise
+                exc.close()
+                if on_status:
+                    on_status("reference image not modified")
+                meta["fetched_at"] = time.time()
+                self.save_meta(meta_path, meta)
+                os.utime(body_path)
+                # The pin taken above passes to the caller.
+                return body_path, meta.get("content_type")
+        except BaseException:
+            if body_path is not None:
+                release_file(body_path)
+            raise
+        if body_path is not None:
+            release_file(body_path)
+
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=self.root)
+        sha = hashlib.sha256()
+        try:
+            with resp, os.fdopen(fd, "wb") as f:
+                while True:
+                    if abort is not None:
+                        abort.check()
+                    chunk = resp.read(DEFAULT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    f.write(chunk)
+            body_path = self.store(tmp_path, sha.hexdigest())
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        meta = {
+            "url": url,
+            "body": sha.hexdigest(),
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "content_type": response_mime_type(resp.headers),
+            "fetched_at": time.time(),
+        }
+        self.save_meta(meta_path, meta)
+        prune_directory(self.root, self.max_bytes)
+        return body_path, meta["content_type"]
+
+    def fetch_blob(self, url, headers=None, timeout=60, on_status=None, abort=None):
+        """Like fetch, but return an InlineBlob that keeps the body pinned while alive."""
+        body_path, content_type = self.fetch(url, headers, timeout, on_status, abort)
+        return pinned_blob(body_path), content_type
+
+
+def open_url_cache(enabled=True, max_age=DEFAULT_URL_CACHE_MAX_AGE, root=None):
+    """Build a UrlCache from config values; returns None when disabled."""
+    if not enabled:
+        return None
+    return UrlCache(root, float(max_age or 0))
+
+
+def open_response_cache(mode=DEFAULT_CACHE_MODE, max_mb=DEFAULT_CACHE_MAX_MB, root=None):
+    """Build a ResponseCache from config values; returns None when disabled."""
+    if not mode or mode == "off":
+        return None
+    return ResponseCache(root, int(float(max_mb) * 1024 * 1024), mode)
@@ -10,8 +10,33 @@ DEFAULT_MODEL = "gemini-3-pro-image-preview"
 DEFAULT_ASPECT = "1:1"
 DEFAULT_FORMAT = "png"
 DEFAULT_RESOLUTION = "1k"
+DEFAULT_OUTPUT_QUALITY = 90
+DEFAULT_CANDIDATE_COUNT = 1
 DEFAULT_POLL_INTERVAL = 2.0
 DEFAULT_TIMEOUT = 120.0
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_GUI_CONCURRENCY = 2
+DEFAULT_TRANSPORT = "pooled"
+TRANSPORT_NAMES = ("pooled", "urllib")
+DEFAULT_CACHE_MODE = "off"
+CACHE_MODES = ("off", "on", "readonly", "refresh")
+DEFAULT_CACHE_MAX_MB = 1024
+DEFAULT_MAX_REF_PIXELS = None
+DEFAULT_URL_CACHE = True
+DEFAULT_URL_CACHE_MAX_AGE = 0.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RATE_LIMIT = 5.0
+DEFAULT_HEDGE_PERCENTILE = None
+DEFAULT_HEDGE_MAX_RATIO = 0.05
+DEFAULT_METRICS_PORT = None
+DEFAULT_METRICS_FILE = None
+DEFAULT_METRICS_INTERVAL = 15.0
+DEFAULT_SERVE_HOST = "127.0.0.1"
+DEFAULT_SERVE_PORT = 8760
+DEFAULT_SERVE_TOKEN = None
+DEFAULT_SERVE_IMAGE_ROOT = None
 
 
 def get_config_path():
@@ -21,6 +46,23 @@ def get_config_path():
     return config_dir / "config.json"
 
 
+def get_data_dir(name):
+    """Get (and create) a named data directory next to the config file."""
+    data_dir = get_config_path().parent / name
+    data_dir.mkdir(exist_ok=True)
+    return data_dir
+
+
+def get_cache_dir():
+    """Get the directory for cached generation results."""
+    return get_data_dir("cache")
+
+
+def get_queue_path():
+    """Get the path of the job service's SQLite queue."""
+    return get_config_path().parent / "queue.sqlite3"
+
+
 def load_config():
     """Load configuration from disk, returning defaults if not found."""
     config_path = get_config_path()
@@ -51,8 +93,31 @@ def get_default_config():
         "aspect": DEFAULT_ASPECT,
         "format": DEFAULT_FORMAT,
         "resolution": DEFAULT_RESOLUTION,
+        "quality": DEFAULT_OUTPUT_QUALITY,
+        "count": DEFAULT_CANDIDATE_COUNT,
         "poll_interval": DEFAULT_POLL_INTERVAL,
         "timeout": DEFAULT_TIMEOUT,
+        "concurrency": DEFAULT_CONCURRENCY,
+        "min_concurrency": DEFAULT_MIN_CONCURRENCY,
+        "max_concurrency": DEFAULT_MAX_CONCURRENCY,
+        "gui_concurrency": DEFAULT_GUI_CONCURRENCY,
+        "transport": DEFAULT_TRANSPORT,
+        "cache": DEFAULT_CACHE_MODE,
+        "cache_max_mb": DEFAULT_CACHE_MAX_MB,
+        "max_ref_pixels": DEFAULT_MAX_REF_PIXELS,
+        "url_cache": DEFAULT_URL_CACHE,
+        "url_cache_max_age": DEFAULT_URL_CACHE_MAX_AGE,
+        "max_retries": DEFAULT_MAX_RETRIES,
+        "rate_limit": DEFAULT_RATE_LIMIT,
+        "hedge_percentile": DEFAULT_HEDGE_PERCENTILE,
+        "hedge_max_ratio": DEFAULT_HEDGE_MAX_RATIO,
+        "metrics_port": DEFAULT_METRICS_PORT,
+        "metrics_file": DEFAULT_METRICS_FILE,
+        "metrics_interval": DEFAULT_METRICS_INTERVAL,
+        "serve_host": DEFAULT_SERVE_HOST,
+        "serve_port": DEFAULT_SERVE_PORT,
+        "serve_token": DEFAULT_SERVE_TOKEN,
+        "serve_image_root": DEFAULT_SERVE_IMAGE_ROOT,
     }
 
 
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Latency tracking and budgeting for hedged generateContent requests.
+
+A request that is still running after the configured latency percentile for
+its model and resolution gets a second, identical request; whichever finishes
+first wins and the other is aborted. A token budget bounds the share of
+requests that may be hedged.
+"""
+import math
+import threading
+from collections import deque
+
+from .config import DEFAULT_HEDGE_MAX_RATIO
+
+LATENCY_SAMPLES = 200
+MIN_LATENCY_SAMPLES = 20
+# Unused hedge credit is capped so a long quiet spell cannot fund a burst.
+MAX_HEDGE_CREDIT = 5.0
+
+
+class LatencyTracker:
+    """Recent request latencies for one model and resolution."""
+
+    def __init__(self, size=LATENCY_SAMPLES):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percentile):
+        """Return the latency at ``percentile`` (0-100), or None without enough samples."""
+        with self._lock:
+            if len(self.samples) < MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        rank = math.ceil(percentile / 100 * len(ordered)) - 1
+        return ordered[min(len(ordered) - 1, max(0, rank))]
+
+
+class Hedger:
+    """Decides when to hedge and keeps hedges under ``max_ratio`` of requests."""
+
+    def __init__(self, percentile, max_ratio=DEFAULT_HEDGE_MAX_RATIO):
+        self.percentile = float(percentile)
+        self.max_ratio = float(max_ratio)
+        self.credit = 0.0
+        self.trackers = {}
+        self._lock = threading.Lock()
+
+    def tracker(self, key):
+        with self._lock:
+            tracker = self.trackers.get(key)
+            if tracker is None:
+                tracker = self.trackers[key] = LatencyTracker()
+            return tracker
+
+    def delay(self, key):
+        """Seconds to wait before hedging a request for ``key`` (None: do not hedge)."""
+        with self._lock:
+            self.credit = min(MAX_HEDGE_CREDIT, self.credit + self.max_ratio)
+        return self.tracker(key).percentile(self.percentile)
+
+    def record(self, key, seconds):
+        self.tracker(key).record(seconds)
+
+    def try_hedge(self):
+        """Spend one hedge from the budget; False when the cap is reached."""
+        with self._lock:
+            if self.credit < 1.0:
+                return False
+            self.credit -= 1.0
+            return True
+
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(percentile, max_ratio=DEFAULT_HEDGE_MAX_RATIO):
+    """Return the process-wide Hedger for these settings (None if hedging is off)."""
+    if not percentile or not max_ratio:
+        return None
+    key = (float(percentile), float(max_ratio))
+    with _hedgers_lock:
+        hedger = _hedgers.get(key)
+        if hedger is None:
+            hedger = _hedgers[key] = Hedger(percentile, max_ratio)
+        return hedger
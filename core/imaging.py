@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Image preprocessing built on Qt's image codecs.
+
+PySide6 is imported lazily so that the CLI only pays for it when a reference
+image actually needs to be resized.
+"""
+import hashlib
+import math
+import os
+import tempfile
+
+from .config import get_data_dir
+
+RESOLUTION_SIDES = {"1K": 1024, "2K": 2048, "4K": 4096}
+# References keep twice the pixels of the requested output, which leaves the
+# model some detail to work with while cutting camera-sized uploads down.
+REF_PIXEL_FACTOR = 2
+REF_CACHE_MAX_BYTES = 512 * 1024 * 1024
+JPEG_QUALITY = 90
+THUMB_SIZE = 256
+THUMB_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def resolve_max_ref_pixels(max_ref_pixels, image_size):
+    """Turn a max_ref_pixels setting (None, "auto" or a number) into a pixel budget."""
+    if not max_ref_pixels:
+        return None
+    if str(max_ref_pixels).lower() == "auto":
+        side = RESOLUTION_SIDES.get(image_size or "")
+        return side * side * REF_PIXEL_FACTOR if side else None
+    return int(max_ref_pixels)
+
+
+def open_reader(blob):
+    from PySide6 import QtCore, QtGui
+
+    buffer = None
+    if blob.path is not None:
+        reader = QtGui.QImageReader(blob.path)
+    else:
+        buffer = QtCore.QBuffer()
+        buffer.setData(QtCore.QByteArray(bytes(blob.data)))
+        buffer.open(QtCore.QIODevice.OpenModeFlag.ReadOnly)
+        reader = QtGui.QImageReader(buffer)
+    reader.setAutoTransform(True)
+    # The buffer must outlive the reader, so hand both back to the caller.
+    return reader, buffer
+
+
+def downscale_to_file(blob, max_pixels, output_base):
+    """Resize ``blob`` to fit ``max_pixels`` and write it next to ``output_base``.
+
+    Returns (path, mime_type), or None when the image already fits or cannot
+    be decoded.
+    """
+    from PySide6 import QtCore
+
+    reader, _buffer = open_reader(blob)
+    size = reader.size()
+    width, height = size.width(), size.height()
+    if width <= 0 or height <= 0 or width * height <= max_pixels:
+        return None
+    scale = math.sqrt(max_pixels / (width * height))
+    reader.setScaledSize(
+        QtCore.QSize(max(1, int(width * scale)), max(1, int(height * scale)))
+    )
+    image = reader.read()
+    if image.isNull():
+        return None
+    if image.hasAlphaChannel():
+        fmt, ext, mime_type, quality = "PNG", ".png", "image/png", -1
+    else:
+        fmt, ext, mime_type, quality = "JPEG", ".jpg", "image/jpeg", JPEG_QUALITY
+    directory = os.path.dirname(output_base)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=ext, dir=directory)
+    os.close(fd)
+    if not image.save(tmp_path, fmt, quality):
+        os.remove(tmp_path)
+        return None
+    path = output_base + ext
+    os.replace(tmp_path, path)
+    return path, mime_type
+
+
+def downscale_reference(blob, mime_type, max_pixels, on_status=None):
+    """Return a (blob, mime_type) pair that fits within ``max_pixels``.
+
+    Results are cached under ~/.ai-draw/refs by source hash and budget, so
+    repeated edits with the same reference skip decoding entirely. The file
+    behind a returned blob is pinned, so pruning the cache cannot delete it
+    while a request is still sending it.
+    """
+    from .cache import pin_file, pinned_blob, prune_directory
+
+    cache_dir = str(get_data_dir("refs"))
+    base = os.path.join(cache_dir, f"{blob.digest()}-{max_pixels}")
+    for ext, cached_mime in ((".jpg", "image/jpeg"), (".png", "image/png")):
+        if pin_file(base + ext):
+            os.utime(base + ext)
+            return pinned_blob(base + ext), cached_mime
+    if os.path.exists(base + ".keep"):
+        return blob, mime_type
+
+    try:
+        result = downscale_to_file(blob, max_pixels, base)
+    except ImportError:
+        if on_status:
+            on_status("PySide6 not available, sending reference unscaled")
+        return blob, mime_type
+    if result is None:
+        open(base + ".keep", "wb").close()
+        return blob, mime_type
+
+    path, new_mime = result
+    if not pin_file(path):
+        # Pruned by another request before it could be pinned.
+        return blob, mime_type
+    if on_status:
+        on_status("downscaled reference image")
+    prune_directory(cache_dir, REF_CACHE_MAX_BYTES)
+    return pinned_blob(path), new_mime
+
+
+def thumbnail_key(path, mtime_ns, size, side=THUMB_SIZE):
+    """Cache key for a thumbnail; it changes whenever the file is rewritten."""
+    text = f"{os.path.abspath(path)}\0{mtime_ns}\0{size}\0{side}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def load_thumbnail(path, mtime_ns, size, side=THUMB_SIZE):
+    """Return a QImage no larger than ``side`` for the image at ``path``.
+
+    Thumbnails are cached under ~/.ai-draw/thumbs, so each image is decoded
+    once. Returns a null QImage for files that cannot be decoded.
+    """
+    from PySide6 import QtCore, QtGui
+
+    base = os.path.join(str(get_data_dir("thumbs")), thumbnail_key(path, mtime_ns, size, side))
+    for ext in (".jpg", ".png"):
+        if os.path.exists(base + ext):
+            image = QtGui.QImage(base + ext)
+            if not image.isNull():
+                os.utime(base + ext)
+                return image
+    if os.path.exists(base + ".keep"):
+        return QtGui.QImage()
+
+    reader = QtGui.QImageReader(path)
+    reader.setAutoTransform(True)
+    source_size = reader.size()
+    bound = QtCore.QSize(side, side)
+    if source_size.isValid() and (source_size.width() > side or source_size.height() > side):
+        reader.setScaledSize(source_size.scaled(bound, QtCore.Qt.AspectRatioMode.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        open(base + ".keep", "wb").close()
+        return image
+    if image.hasAlphaChannel():
+        fmt, ext, quality = "PNG", ".png", -1
+    else:
+        fmt, ext, quality = "JPEG", ".jpg", JPEG_QUALITY
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=ext, dir=os.path.dirname(base))
+    os.close(fd)
+    if image.save(tmp_path, fmt, quality):
+        os.replace(tmp_path, base + ext)
+    else:
+        os.remove(tmp_path)
+    return image
+
+
+def prune_thumbnails():
+    from .cache import prune_directory
+
+    prune_directory(str(get_data_dir("thumbs")), THUMB_CACHE_MAX_BYTES)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Completion journal that lets an interrupted batch resume.
+
+The journal is an append-only JSON lines file. Every job gets a ``started``
+line and then a ``done`` or ``failed`` line, keyed by a hash of its
+generate_image spec. ``done`` lines record the output's size and sha256 (or,
+for jobs with several candidates, those of every output), so a rerun can skip
+jobs whose output is still on disk unchanged. Jobs that only have a
+``started`` line were in flight when the run stopped and are retried.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .config import DEFAULT_CANDIDATE_COUNT
+from .streaming import DEFAULT_CHUNK_SIZE
+
+# The generate_image arguments that decide what a job produces.
+SPEC_FIELDS = (
+    "prompt",
+    "provider",
+    "model",
+    "aspect",
+    "output_format",
+    "output_quality",
+    "output_resolution",
+    "output_path",
+    "image_path",
+    "image_urls",
+)
+# Hashed only when they differ from these defaults, so older journals stay valid.
+OPTIONAL_SPEC_FIELDS = {"candidate_count": DEFAULT_CANDIDATE_COUNT}
+
+
+def job_spec_hash(kwargs):
+    """Hash the fields of generate_image ``kwargs`` that define the output."""
+    spec = {name: kwargs.get(name) for name in SPEC_FIELDS}
+    for name, default in OPTIONAL_SPEC_FIELDS.items():
+        if kwargs.get(name) not in (None, default):
+            spec[name] = kwargs[name]
+    text = json.dumps(spec, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_digest(path):
+    """Return (size, sha256 hex digest) of the file at ``path``."""
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(DEFAULT_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha.update(chunk)
+            size += len(chunk)
+    return size, sha.hexdigest()
+
+
+def unchanged(path, size, sha256):
+    """True if the file at ``path`` still has this size and sha256."""
+    try:
+        if os.path.getsize(path) != size:
+            return False
+        return file_digest(path) == (size, sha256)
+    except OSError:
+        return False
+
+
+class BatchJournal:
+    """Append-only record of batch job outcomes."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.entries = {}
+        self._lock = threading.Lock()
+        partial = self.load()
+        self._file = open(self.path, "a", encoding="utf-8")
+        if partial:
+            # Start on a fresh line instead of extending the broken one.
+            self._file.write("\n")
+
+    def load(self):
+        """Read earlier entries; True if the last line was left unterminated."""
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return False
+        line = ""
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self.entries[entry["spec"]] = entry
+                except (ValueError, KeyError, TypeError):
+                    # A run killed mid-write can leave a partial last line.
+                    continue
+        return bool(line) and not line.endswith("\n")
+
+    def completed(self, spec_hash, output_path):
+        """True if the job finished earlier and its output is still unchanged.
+
+        ``output_path`` is a path, or the list of paths of a job with several
+        candidates.
+        """
+        entry = self.entries.get(spec_hash)
+        if not entry or entry.get("status") != "done":
+            return False
+        if isinstance(output_path, str):
+            if os.path.abspath(output_path) != entry.get("output_path"):
+                return False
+            return unchanged(output_path, entry.get("size"), entry.get("sha256"))
+        if [os.path.abspath(path) for path in output_path] != entry.get("output_paths"):
+            return False
+        digests = entry.get("digests") or []
+        return len(digests) == len(output_path) and all(
+            unchanged(path, size, sha256) for path, (size, sha256) in zip(output_path, digests)
+        )
+
+    def record(self, status, spec_hash, index, output_path=None, error=None):
+        entry = {"status": status, "spec": spec_hash, "index": index, "time": time.time()}
+        if isinstance(output_path, str):
+            entry["output_path"] = os.path.abspath(output_path)
+            if status == "done":
+                entry["size"], entry["sha256"] = file_digest(output_path)
+        elif output_path:
+            entry["output_paths"] = [os.path.abspath(path) for path in output_path]
+            if status == "done":
+                entry["digests"] = [list(file_digest(path)) for path in output_path]
+        if error:
+            entry["error"] = error
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self.entries[spec_hash] = entry
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""Optional Prometheus metrics for long-running generation processes.
+
+Metrics are off until ``enable_metrics()`` creates the process-wide registry.
+While it is off, instrumented code only pays for one global lookup per call.
+The registry can be served over HTTP (``HttpExporter``) or written to a
+node_exporter textfile-collector file (``TextfileExporter``), both in the
+Prometheus text exposition format.
+"""
+import contextlib
+import math
+import os
+import re
+import threading
+import time
+
+from .transport import RequestAborted
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Image generation takes seconds to minutes, so the buckets start at 0.5s.
+LATENCY_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 180.0, 300.0)
+MODEL_PATTERN = re.compile(r"/models/([^/:?]+)")
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self.values.items())
+        for labels, value in items:
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, [list(e[0]), e[1], e[2]]) for labels, e in self.values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = format_labels(self.labelnames, labels, f'le="{format_value(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            plain = format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{plain} {format_value(total)}"
+            yield f"{self.name}_count{plain} {count}"
+
+
+class MetricsRegistry:
+    """The metrics ai-draw records about its API traffic."""
+
+    def __init__(self):
+        self.metrics = []
+        labels = ("model", "resolution")
+        self.requests = self.add(
+            Counter("ai_draw_requests_total", "HTTP requests sent to the API.", labels)
+        )
+        self.errors = self.add(
+            Counter(
+                "ai_draw_request_errors_total",
+                "Failed API requests by HTTP status (or network/error).",
+                labels + ("status",),
+            )
+        )
+        self.aborted = self.add(
+            Counter(
+                "ai_draw_requests_aborted_total",
+                "API requests aborted by cancellation or a winning hedge.",
+                labels,
+            )
+        )
+        self.in_flight = self.add(
+            Gauge("ai_draw_requests_in_flight", "API requests currently in flight.", labels)
+        )
+        self.bytes_sent = self.add(
+            Counter("ai_draw_request_bytes_total", "Request body bytes sent.", labels)
+        )
+        self.bytes_received = self.add(
+            Counter("ai_draw_response_bytes_total", "Response body bytes received.", labels)
+        )
+        self.latency = self.add(
+            Histogram(
+                "ai_draw_request_duration_seconds",
+                "Latency of successful API requests.",
+                labels,
+            )
+        )
+        self.cache_hits = self.add(
+            Counter("ai_draw_cache_hits_total", "Response cache hits.", labels)
+        )
+        self.cache_misses = self.add(
+            Counter("ai_draw_cache_misses_total", "Response cache misses.", labels)
+        )
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    @contextlib.contextmanager
+    def exchange(self, url, payload, timer):
+        """Count one HTTP exchange measured by ``timer`` (a trace.ExchangeTimer)."""
+        labels = exchange_labels(url, payload)
+        self.in_flight.inc(labels)
+        error = None
+        try:
+            yield timer
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            self.in_flight.dec(labels)
+            self.record_exchange(labels, timer, error)
+
+    def record_exchange(self, labels, timer, error):
+        status = timer.status or getattr(error, "code", None)
+        self.requests.inc(labels)
+        if status is not None:
+            self.bytes_sent.inc(labels, len(timer.body) if timer.body is not None else 0)
+        self.bytes_received.inc(labels, timer.received)
+        if isinstance(status, int) and status >= 400:
+            self.errors.inc(labels + (str(status),))
+        elif error is None:
+            self.latency.observe(labels, time.monotonic() - timer.started)
+        elif isinstance(error, RequestAborted) or not isinstance(error, Exception):
+            self.aborted.inc(labels)
+        else:
+            self.errors.inc(labels + ("network" if isinstance(error, OSError) else "error",))
+
+    def record_cache_lookup(self, model, resolution, hit):
+        counter = self.cache_hits if hit else self.cache_misses
+        counter.inc((model, resolution or ""))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+def exchange_labels(url, payload):
+    match = MODEL_PATTERN.search(url)
+    image_config = ((payload or {}).get("generationConfig") or {}).get("imageConfig") or {}
+    return (match.group(1) if match else "", image_config.get("imageSize") or "")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def enable_metrics():
+    """Create (once) and return the process-wide MetricsRegistry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+def get_metrics():
+    """Return the registry, or None while metrics are disabled."""
+    return _registry
+
+
+def track_exchange(url, payload, timer):
+    """Context manager recording one HTTP exchange; a no-op while disabled."""
+    registry = _registry
+    if registry is None:
+        return contextlib.nullcontext(timer)
+    return registry.exchange(url, payload, timer)
+
+
+def record_cache_lookup(model, resolution, hit):
+    registry = _registry
+    if registry is not None:
+        registry.record_cache_lookup(model, resolution, hit)
+
+
+def make_metrics_handler(handler_registry):
+    """Build the /metrics request handler; http.server is only imported here."""
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        registry = handler_registry
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = self.registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return MetricsHandler
+
+
+class HttpExporter:
+    """Serves ``/metrics`` from a daemon thread until ``close()``."""
+
+    def __init__(self, port, host="127.0.0.1", registry=None):
+        from http.server import ThreadingHTTPServer
+
+        handler = make_metrics_handler(registry or enable_metrics())
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="metrics-http", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TextfileExporter:
+    """Rewrites a textfile-collector file every ``interval`` seconds.
+
+    The file is replaced atomically so the collector never reads a partial
+    file. ``close()`` writes a final snapshot.
+    """
+
+    def __init__(self, path, interval=15.0, registry=None):
+        self.path = os.fspath(path)
+        self.interval = interval
+        self.registry = registry or enable_metrics()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-textfile", daemon=True)
+        self._thread.start()
+
+    def write(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.registry.render())
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while True:
+            try:
+                self.write()
+            except OSError:
+                pass
+            if self._stop.wait(self.interval):
+                return
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""Shared client-side rate limiting and retries for API calls."""
+import email.utils
+import http.client
+import random
+import socket
+import threading
+import time
+import urllib.error
+
+from .config import DEFAULT_MAX_RETRIES, DEFAULT_RATE_LIMIT
+from .transport import RequestAborted
+
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_AFTER_MAX = 300.0
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose rate halves on throttling and creeps back on success.
+
+    Callers reserve a token with ``reserve()`` and wait for the returned delay,
+    so the same limiter serves threads and asyncio tasks alike. Only requests
+    started after the last cut can cut the rate again, so a burst of 429s
+    from requests that were already in flight halves it once.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, burst=None, min_rate=0.05, increase=None):
+        self.rate = float(rate)
+        self.min_rate_setting = min_rate
+        self.burst_setting = burst
+        self.increase_setting = increase
+        self._configure(rate)
+        self.tokens = self.burst
+        self.blocked_until = 0.0
+        self.last_cut = float("-inf")
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_max_rate(self, rate):
+        """Change the configured rate, keeping what was learned from throttling."""
+        with self._lock:
+            self._configure(rate)
+
+    def _configure(self, rate):
+        self.max_rate = float(rate)
+        self.rate = min(self.rate, self.max_rate)
+        self.min_rate = min(self.min_rate_setting, self.max_rate)
+        self.burst = float(self.burst_setting or max(1.0, self.max_rate))
+        self.increase = (
+            self.increase_setting if self.increase_setting is not None else self.max_rate / 20
+        )
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+
+    def reserve(self):
+        """Take a token and return how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(delay, self.blocked_until - now)
+
+    def try_acquire(self):
+        """Take a token only if one is available right now; for optional requests."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens < 1 or self.blocked_until > now:
+                return False
+            self.tokens -= 1
+            return True
+
+    def acquire(self, cancel_event=None):
+        delay = self.reserve()
+        if delay > 0:
+            sleep(delay, cancel_event)
+
+    async def aacquire(self):
+        import asyncio
+
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after=None, started=None):
+        """Record a throttled request that was sent at ``started`` (monotonic)."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if started is None or started >= self.last_cut:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.last_cut = now
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_base, model, rate=DEFAULT_RATE_LIMIT):
+    """Return the process-wide limiter for an api_base/model pair (None if disabled)."""
+    if not rate:
+        return None
+    key = (api_base, model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = AdaptiveRateLimiter(rate)
+        elif limiter.max_rate != float(rate):
+            limiter.set_max_rate(rate)
+        return limiter
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        seconds = when.timestamp() - time.time()
+    return min(max(seconds, 0.0), RETRY_AFTER_MAX)
+
+
+def retry_after_seconds(exc):
+    headers = getattr(exc, "headers", None)
+    if isinstance(exc, urllib.error.HTTPError) and headers is not None:
+        return parse_retry_after(headers.get("Retry-After"))
+    return None
+
+
+def is_transient(exc):
+    """True for failures worth retrying: 429/5xx, timeouts and dropped connections.
+
+    A host that does not resolve or refuses the connection points at a wrong
+    api_base or a stopped server, so those fail at once.
+    """
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code in RETRY_STATUSES
+    if isinstance(exc, urllib.error.URLError):
+        exc = exc.reason
+    if isinstance(exc, (socket.gaierror, ConnectionRefusedError)):
+        return False
+    return isinstance(exc, (ConnectionError, TimeoutError, http.client.IncompleteRead))
+
+
+def is_throttle(exc):
+    return isinstance(exc, urllib.error.HTTPError) and exc.code in THROTTLE_STATUSES
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, never shorter than Retry-After."""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def describe_error(exc):
+    if isinstance(exc, urllib.error.HTTPError):
+        return f"HTTP {exc.code}"
+    return str(exc) or exc.__class__.__name__
+
+
+def sleep(seconds, cancel_event=None):
+    """Sleep, waking early and raising RequestAborted if ``cancel_event`` is set."""
+    if cancel_event is None:
+        time.sleep(seconds)
+    elif cancel_event.wait(seconds):
+        raise RequestAborted("Request cancelled")
+
+
+def handle_failure(exc, attempt, max_retries, limiter, on_status, started=None):
+    """Record a failed attempt; return the delay before retrying, or None to give up."""
+    retry_after = retry_after_seconds(exc)
+    if limiter and is_throttle(exc):
+        limiter.on_throttle(retry_after, started)
+    if attempt >= max_retries or not is_transient(exc):
+        return None
+    if isinstance(exc, urllib.error.HTTPError):
+        exc.close()
+    delay = backoff_delay(attempt, retry_after)
+    if on_status:
+        on_status(
+            f"retrying in {delay:.1f}s after {describe_error(exc)} "
+            f"(attempt {attempt + 2}/{max_retries + 1})"
+        )
+    return delay
+
+
+def call_with_retries(
+    fn, limiter=None, max_retries=DEFAULT_MAX_RETRIES, on_status=None, cancel_event=None
+):
+    """Call ``fn`` under ``limiter``, retrying transient failures with backoff.
+
+    Waits for the limiter or a backoff end early with RequestAborted once
+    ``cancel_event`` is set.
+    """
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire(cancel_event)
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception as exc:
+            delay = handle_failure(exc, attempt, max_retries, limiter, on_status, started)
+            if delay is None:
+                raise
+            sleep(delay, cancel_event)
+            attempt += 1
+            continue
+        if limiter:
+            limiter.on_success()
+        return result
+
+
+async def acall_with_retries(fn, limiter=None, max_retries=DEFAULT_MAX_RETRIES, on_status=None):
+    """Async counterpart of call_with_retries; ``fn`` returns an awaitable."""
+    import asyncio
+
+    attempt = 0
+    while True:
+        if limiter:
+            await limiter.aacquire()
+        started = time.monotonic()
+        try:
+            result = await fn()
+        except Exception as exc:
+            delay = handle_failure(exc, attempt, max_retries, limiter, on_status, started)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        if limiter:
+            limiter.on_success()
+        return result
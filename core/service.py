@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+"""Local job-queue service shared by several clients.
+
+Jobs are persisted in a SQLite priority queue and run by one worker pool that
+calls generate_image, so every client shares the same rate limiter and
+concurrency limit. A small HTTP API (see ``make_server``) accepts jobs and
+lets clients poll or long-poll for results. Jobs that were queued or running
+when the process stopped are picked up again on the next start.
+
+The HTTP API only takes ``application/json`` bodies, so a web page cannot
+submit jobs with a simple cross-site form post. Output paths must stay inside
+the output directory and local reference images inside ``image_root``. On
+anything but a loopback address, a bearer token is required.
+"""
+import hmac
+import ipaddress
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .app import GenerationCancelled, generate_image, is_url
+from .batch import AdaptiveConcurrency, is_overload, job_to_kwargs
+from .config import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_FORMAT,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_MIN_CONCURRENCY,
+)
+from .transcode import with_format_extension
+
+JOB_STATES = ("queued", "running", "succeeded", "failed", "cancelled")
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+MAX_LONG_POLL = 60.0
+MAX_LIST_LIMIT = 1000
+MAX_REQUEST_BYTES = 1024 * 1024
+# Jobs interrupted this many times (stops or crashes) are failed, not requeued.
+MAX_JOB_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    output_path TEXT,
+    output_paths TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, seq);
+"""
+COLUMNS = (
+    "id",
+    "priority",
+    "status",
+    "spec",
+    "output_path",
+    "output_paths",
+    "error",
+    "attempts",
+    "created_at",
+    "started_at",
+    "finished_at",
+)
+
+
+class JobQueue:
+    """Persistent priority queue of generation jobs.
+
+    Higher ``priority`` runs first; equal priorities run in submission order.
+    ``changed`` is notified on every state change so waiters can long-poll.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        if "output_paths" not in columns:
+            # Queues created before jobs could have several candidates.
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN output_paths TEXT")
+        self.changed = threading.Condition()
+
+    def close(self):
+        with self.changed:
+            self.conn.close()
+
+    def _row(self, where, params):
+        row = self.conn.execute(
+            f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE {where}", params
+        ).fetchone()
+        return job_from_row(row) if row else None
+
+    def _give_up(self, where, params):
+        self.conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+            f"WHERE status = 'running' AND attempts >= ? AND {where}",
+            (
+                f"Gave up after {MAX_JOB_ATTEMPTS} interrupted attempts",
+                time.time(),
+                MAX_JOB_ATTEMPTS,
+                *params,
+            ),
+        )
+
+    def recover(self):
+        """Put jobs left running by a previous process back in the queue.
+
+        Jobs that already ran MAX_JOB_ATTEMPTS times are failed instead, so
+        a job that takes the process down cannot loop forever.
+        """
+        with self.changed:
+            self._give_up("1", ())
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+            )
+            self.changed.notify_all()
+            return cursor.rowcount
+
+    def submit(self, spec, priority=0):
+        job_id = uuid.uuid4().hex
+        with self.changed:
+            self.conn.execute(
+                "INSERT INTO jobs (id, priority, status, spec, created_at) "
+                "VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, int(priority), json.dumps(spec, ensure_ascii=False), time.time()),
+            )
+            self.changed.notify_all()
+            return self._row("id = ?", (job_id,))
+
+    def claim(self, timeout=None):
+        """Mark the next queued job running and return it (None on timeout)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.changed:
+            while True:
+                row = self.conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' "
+                    "ORDER BY priority DESC, seq LIMIT 1"
+                ).fetchone()
+                if row:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, "
+                        "attempts = attempts + 1 WHERE id = ?",
+                        (time.time(), row[0]),
+                    )
+                    self.changed.notify_all()
+                    return self._row("id = ?", (row[0],))
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.changed.wait(remaining)
+
+    def finish(self, job_id, status, output_paths=None, error=None):
+        """Record the outcome of a running job; ``output_paths`` lists its images."""
+        with self.changed:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, output_path = ?, output_paths = ?, error = ?, "
+                "finished_at = ? WHERE id = ? AND status = 'running'",
+                (
+                    status,
+                    output_paths[0] if output_paths else None,
+                    json.dumps(output_paths, ensure_ascii=False) if output_paths else None,
+                    error,
+                    time.time(),
+                    job_id,
+                ),
+            )
+            self.changed.notify_all()
+
+    def requeue(self, job_id):
+        with self.changed:
+            self._give_up("id = ?", (job_id,))
+            self.conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL "
+                "WHERE id = ? AND status = 'running'",
+                (job_id,),
+            )
+            self.changed.notify_all()
+
+    def cancel(self, job_id):
+        """Cancel a queued job; running jobs are left to the service to abort."""
+        with self.changed:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            )
+            self.changed.notify_all()
+            return self._row("id = ?", (job_id,))
+
+    def get(self, job_id):
+        with self.changed:
+            return self._row("id = ?", (job_id,))
+
+    def wait(self, job_id, timeout):
+        """Return the job once it has finished, or as it is after ``timeout``."""
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while True:
+                job = self._row("id = ?", (job_id,))
+                remaining = deadline - time.monotonic()
+                if job is None or job["status"] in FINISHED_STATES or remaining <= 0:
+                    return job
+                self.changed.wait(remaining)
+
+    def list(self, status=None, limit=100):
+        query = f"SELECT {', '.join(COLUMNS)} FROM jobs"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY seq DESC LIMIT ?"
+        params.append(int(limit))
+        with self.changed:
+            return [job_from_row(row) for row in self.conn.execute(query, params)]
+
+    def counts(self):
+        with self.changed:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            counts = dict.fromkeys(JOB_STATES, 0)
+            counts.update(dict(rows.fetchall()))
+            return counts
+
+
+def job_from_row(row):
+    job = dict(zip(COLUMNS, row))
+    job["spec"] = json.loads(job["spec"])
+    if job["output_paths"]:
+        job["output_paths"] = json.loads(job["output_paths"])
+    elif job["output_path"]:
+        job["output_paths"] = [job["output_path"]]
+    return job
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def resolve_under(root, path, what):
+    """Resolve the relative ``path`` inside ``root``; refuse anything that escapes it."""
+    text = str(path)
+    if os.path.isabs(text) or os.path.splitdrive(text)[0] or ".." in re.split(r"[\\/]", text):
+        raise RuntimeError(f"{what} must be a relative path without '..': {text}")
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, text))
+    if os.path.commonpath([root, resolved]) != root:
+        raise RuntimeError(f"{what} is outside {root}: {text}")
+    return resolved
+
+
+class JobService:
+    """Runs queued jobs through generate_image on a shared worker pool.
+
+    ``concurrency`` is a number of workers, or ``"auto"`` to let an
+    AdaptiveConcurrency controller size it between ``min_concurrency`` and
+    ``max_concurrency`` as in batch mode.
+    """
+
+    def __init__(
+        self,
+        queue,
+        *,
+        concurrency=DEFAULT_CONCURRENCY,
+        min_concurrency=DEFAULT_MIN_CONCURRENCY,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        output_dir="output",
+        image_root=None,
+        on_status=None,
+        **defaults,
+    ):
+        self.queue = queue
+        self.output_dir = os.path.abspath(output_dir)
+        self.image_root = os.path.abspath(image_root) if image_root else None
+        self.on_status = on_status
+        self.defaults = defaults
+        self.controller = None
+        if str(concurrency).lower() == "auto":
+            self.controller = AdaptiveConcurrency(
+                DEFAULT_CONCURRENCY,
+                min_concurrency,
+                max_concurrency,
+                on_change=lambda limit, reason: self.status(f"concurrency {limit} ({reason})"),
+            )
+            self.workers = self.controller.max_limit
+        else:
+            self.workers = max(1, int(concurrency))
+        self.in_flight = 0
+        self.running = {}
+        self.cancel_requests = set()
+        self.stopping = threading.Event()
+        self._slots = threading.Condition()
+        self._threads = []
+
+    def status(self, message):
+        if self.on_status:
+            self.on_status(message)
+
+    def job_kwargs(self, spec, job_id=None):
+        """generate_image kwargs for a submitted ``spec``, with its paths confined.
+
+        ``out`` is taken relative to the output directory. Local reference
+        images are only accepted inside ``image_root``; URLs pass through.
+        Defaults set by whoever started the service are trusted as they are.
+        """
+        requested = job_to_kwargs(spec)
+        if requested.get("output_path"):
+            requested["output_path"] = resolve_under(
+                self.output_dir, requested["output_path"], "out"
+            )
+        elif job_id:
+            output_format = (
+                requested.get("output_format")
+                or self.defaults.get("output_format")
+                or DEFAULT_FORMAT
+            )
+            requested["output_path"] = os.path.join(
+                self.output_dir, f"job-{job_id}.{output_format}"
+            )
+        if requested.get("image_path"):
+            requested["image_path"] = self.local_image(requested["image_path"])
+        if requested.get("image_urls"):
+            requested["image_urls"] = [self.local_image(item) for item in requested["image_urls"]]
+        # Jobs from different clients must never share one generation.
+        kwargs = {**self.defaults, **requested, "coalesce": False}
+        if kwargs.get("output_path"):
+            kwargs["output_path"] = with_format_extension(
+                kwargs["output_path"], kwargs.get("output_format")
+            )
+        return kwargs
+
+    def local_image(self, item):
+        if is_url(item):
+            return item
+        if self.image_root is None:
+            raise RuntimeError("Local image paths are not accepted; send an http(s) URL")
+        return resolve_under(self.image_root, item, "image")
+
+    def limit(self):
+        return self.controller.current if self.controller else self.workers
+
+    def start(self):
+        recovered = self.queue.recover()
+        if recovered:
+            self.status(f"requeued {recovered} interrupted job(s)")
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Stop the workers; jobs in flight are aborted and queued again."""
+        self.stopping.set()
+        with self._slots:
+            for cancel_event in self.running.values():
+                cancel_event.set()
+            self._slots.notify_all()
+        with self.queue.changed:
+            self.queue.changed.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def cancel(self, job_id):
+        job = self.queue.cancel(job_id)
+        if job and job["status"] == "running":
+            with self._slots:
+                cancel_event = self.running.get(job_id)
+                if cancel_event:
+                    cancel_event.set()
+                else:
+                    # Claimed but not started yet; run() picks this up.
+                    self.cancel_requests.add(job_id)
+        return job
+
+    def _acquire_slot(self):
+        with self._slots:
+            while self.in_flight >= self.limit() and not self.stopping.is_set():
+                self._slots.wait(1.0)
+            if self.stopping.is_set():
+                return False
+            self.in_flight += 1
+            return True
+
+    def _release_slot(self):
+        with self._slots:
+            self.in_flight -= 1
+            self._slots.notify()
+
+    def _work(self):
+        while self._acquire_slot():
+            try:
+                job = self.queue.claim(timeout=1.0)
+                if job is not None:
+                    self.run(job)
+            finally:
+                self._release_slot()
+
+    def run(self, job):
+        job_id = job["id"]
+        cancel_event = threading.Event()
+        with self._slots:
+            self.running[job_id] = cancel_event
+            if job_id in self.cancel_requests or self.stopping.is_set():
+                self.cancel_requests.discard(job_id)
+                cancel_event.set()
+            saturated = self.in_flight >= self.limit()
+        started = time.monotonic()
+        try:
+            kwargs = self.job_kwargs(job["spec"], job_id)
+            kwargs["cancel_event"] = cancel_event
+            if self.on_status:
+                kwargs["on_status"] = lambda message: self.status(f"[{job_id[:8]}] {message}")
+            output_paths = generate_image(**kwargs)
+            if isinstance(output_paths, str):
+                output_paths = [output_paths]
+        except GenerationCancelled:
+            if self.stopping.is_set():
+                self.queue.requeue(job_id)
+            else:
+                self.queue.finish(job_id, "cancelled", error="Generation cancelled")
+        except Exception as exc:
+            if self.controller:
+                self.controller.record(time.monotonic() - started, is_overload(exc), saturated)
+            self.queue.finish(job_id, "failed", error=str(exc) or exc.__class__.__name__)
+        else:
+            if self.controller:
+                self.controller.record(time.monotonic() - started, False, saturated)
+            self.queue.finish(
+                job_id, "succeeded", output_paths=[os.path.abspath(path) for path in output_paths]
+            )
+        finally:
+            with self._slots:
+                self.running.pop(job_id, None)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """HTTP API of the job service.
+
+    POST /jobs             submit a job spec (batch-mode fields plus ``priority``)
+    GET /jobs              list jobs (``?status=`` and ``?limit=``)
+    GET /jobs/ID           job state; ``?wait=SECONDS`` long-polls until it finishes
+    GET /jobs/ID/image     the generated image of a succeeded job; ``?index=N``
+                           picks candidate N (from 1) of a job with a ``count``
+    DELETE /jobs/ID        cancel a queued or running job
+    GET /health            job counts by status
+
+    With a ``token``, every request needs ``Authorization: Bearer TOKEN``.
+    """
+
+    protocol_version = "HTTP/1.1"
+    service = None
+    token = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json(status, {"error": {"code": status, "message": message}})
+
+    def route(self):
+        parts = urlsplit(self.path)
+        segments = [segment for segment in parts.path.split("/") if segment]
+        return segments, parse_qs(parts.query)
+
+    def authorized(self):
+        if not self.token:
+            return True
+        sent = self.headers.get("Authorization") or ""
+        if hmac.compare_digest(sent.encode("utf-8"), f"Bearer {self.token}".encode("utf-8")):
+            return True
+        self.send_error_json(401, "Missing or invalid token")
+        self.close_connection = True
+        return False
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        segments, query = self.route()
+        queue = self.service.queue
+        if segments == ["health"]:
+            self.send_json(
+                200,
+                {
+                    "counts": queue.counts(),
+                    "in_flight": self.service.in_flight,
+                    "concurrency": self.service.limit(),
+                },
+            )
+            return
+        if segments == ["jobs"]:
+            status = query.get("status", [None])[0]
+            if status and status not in JOB_STATES:
+                self.send_error_json(400, f"Unknown status: {status}")
+                return
+            try:
+                limit = min(MAX_LIST_LIMIT, int(query.get("limit", [100])[0]))
+            except ValueError:
+                self.send_error_json(400, "limit must be a number")
+                return
+            self.send_json(200, {"jobs": queue.list(status, limit)})
+            return
+        if len(segments) in (2, 3) and segments[0] == "jobs":
+            try:
+                wait = min(MAX_LONG_POLL, float(query.get("wait", [0])[0]))
+            except ValueError:
+                self.send_error_json(400, "wait must be a number")
+                return
+            if len(segments) == 2 and wait > 0:
+                job = queue.wait(segments[1], wait)
+            else:
+                job = queue.get(segments[1])
+            if job is None:
+                self.send_error_json(404, "Job not found")
+            elif len(segments) == 2:
+                self.send_json(200, job)
+            elif segments[2] == "image":
+                self.send_image(job, query.get("index", ["1"])[0])
+            else:
+                self.send_error_json(404, "Not found")
+            return
+        self.send_error_json(404, "Not found")
+
+    def send_image(self, job, index="1"):
+        if job["status"] != "succeeded":
+            self.send_error_json(409, f"Job is {job['status']}")
+            return
+        paths = job["output_paths"] or []
+        try:
+            path = paths[int(index) - 1] if int(index) >= 1 else None
+        except (ValueError, IndexError):
+            path = None
+        if path is None:
+            self.send_error_json(404, f"No image {index}; the job has {len(paths)}")
+            return
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error_json(410, "Output file is gone")
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            while True:
+                chunk = f.read(256 * 1024)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        segments, _ = self.route()
+        if segments != ["jobs"]:
+            self.send_error_json(404, "Not found")
+            return
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            # Browsers send text/plain or form posts cross-site without a preflight.
+            self.send_error_json(415, "Content-Type must be application/json")
+            self.close_connection = True
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_REQUEST_BYTES:
+            self.send_error_json(413, "Request too large")
+            self.close_connection = True
+            return
+        try:
+            spec = json.loads(self.rfile.read(length) or b"null")
+            if not isinstance(spec, dict):
+                raise RuntimeError("Job must be a JSON object")
+            priority = int(spec.pop("priority", 0))
+            kwargs = self.service.job_kwargs(spec)
+            if not str(kwargs.get("prompt") or "").strip():
+                raise RuntimeError("Prompt is required")
+        except (ValueError, RuntimeError) as exc:
+            self.send_error_json(400, str(exc))
+            return
+        self.send_json(202, self.service.queue.submit(spec, priority))
+
+    def do_DELETE(self):
+        if not self.authorized():
+            return
+        segments, _ = self.route()
+        if len(segments) != 2 or segments[0] != "jobs":
+            self.send_error_json(404, "Not found")
+            return
+        job = self.service.cancel(segments[1])
+        if job is None:
+            self.send_error_json(404, "Job not found")
+        else:
+            self.send_json(200, job)
+
+
+def make_server(service, host="127.0.0.1", port=0, token=None):
+    """Create (but do not start) the HTTP server for ``service``.
+
+    Listening on a non-loopback ``host`` requires a ``token``.
+    """
+    if not token and not is_loopback(host):
+        raise RuntimeError(f"A token is required to serve on {host} (use --token)")
+    handler = type(
+        "JobServiceHandler", (ServiceHandler,), {"service": service, "token": token or None}
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
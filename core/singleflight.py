@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Coalescing of identical concurrent requests.
+
+When several callers in one process send the same request while it is still
+in flight, only the first (the leader) calls the API. The others wait for its
+result instead of paying for their own round trip.
+"""
+import os
+import shutil
+import threading
+
+JOIN_POLL_INTERVAL = 0.1
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time and shares its outcome with latecomers."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, check=None, abandon=(), on_join=None):
+        """Call ``fn`` unless a call for ``key`` is in flight; return (result, shared).
+
+        Followers call ``check`` while they wait so they can bail out (e.g. on
+        cancellation). If the leader fails with one of the ``abandon``
+        exception types, for instance because its own caller cancelled it, a
+        waiting follower takes over as the new leader instead of failing.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight()
+            if leader:
+                try:
+                    flight.result = fn()
+                    return flight.result, False
+                except BaseException as exc:
+                    flight.error = exc
+                    raise
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+            if on_join:
+                on_join()
+            while not flight.done.wait(JOIN_POLL_INTERVAL):
+                if check:
+                    check()
+            if flight.error is None:
+                return flight.result, True
+            if not isinstance(flight.error, abandon):
+                raise flight.error
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight; flights are kept per event loop."""
+
+    def __init__(self):
+        self._flights = {}
+
+    async def run(self, key, fn, abandon=(), on_join=None):
+        import asyncio
+
+        loop_key = (id(asyncio.get_running_loop()), key)
+        while True:
+            future = self._flights.get(loop_key)
+            if future is None:
+                future = self._flights[loop_key] = asyncio.get_running_loop().create_future()
+                try:
+                    result = await fn()
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except BaseException as exc:
+                    future.set_exception(exc)
+                    # Mark the exception retrieved when nobody was waiting.
+                    future.exception()
+                    raise
+                else:
+                    future.set_result(result)
+                    return result, False
+                finally:
+                    del self._flights[loop_key]
+            if on_join:
+                on_join()
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                # The leader's task was cancelled, not this one: take over.
+                if not future.cancelled():
+                    raise
+            except abandon:
+                pass
+
+
+def link_or_copy(source, destination, part_path):
+    """Give ``destination`` the content of ``source``: a hard link if possible."""
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return destination
+    try:
+        os.link(source, part_path)
+    except OSError:
+        shutil.copyfile(source, part_path)
+    os.replace(part_path, destination)
+    return destination
+
+
+_flights = SingleFlight()
+_async_flights = AsyncSingleFlight()
+
+
+def get_single_flight():
+    return _flights
+
+
+def get_async_single_flight():
+    return _async_flights
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""Incremental encoding of requests and decoding of generateContent responses.
+
+The scanner walks the JSON response as it arrives. Every ``inlineData.data``
+string is base64-decoded in small pieces straight into a sink instead of being
+held in memory; the rest of the document (a few hundred bytes) is kept as a
+skeleton and parsed once the body is complete.
+
+On the request side, reference images are carried as InlineBlobs and
+base64-encoded chunk by chunk while the body is written to the socket.
+"""
+import binascii
+import hashlib
+import json
+import mmap
+import os
+import re
+import uuid
+
+INLINE_KEYS = ("inline_data", "inlineData")
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# A multiple of 3 so that base64 pieces concatenate without padding.
+UPLOAD_CHUNK_SIZE = 3 * 64 * 1024
+
+_STRING_STOP = re.compile(rb'["\\]')
+_WHITESPACE = b" \t\r\n"
+_SIMPLE_ESCAPES = {
+    ord("/"): b"/",
+    ord("\\"): b"\\",
+    ord('"'): b'"',
+    ord("b"): b"",
+    ord("f"): b"",
+    ord("n"): b"",
+    ord("r"): b"",
+    ord("t"): b"",
+}
+
+VALUE, KEY, STRING, STREAM = range(4)
+
+
+class Base64Sink:
+    """Decode base64 text written in arbitrary pieces into a binary file."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.pending = b""
+        self.size = 0
+
+    def write(self, text):
+        if self.pending:
+            text = self.pending + text
+        cut = len(text) - len(text) % 4
+        if cut:
+            data = binascii.a2b_base64(text[:cut])
+            self.fileobj.write(data)
+            self.size += len(data)
+        self.pending = text[cut:]
+
+    def finish(self):
+        if self.pending.strip(b"="):
+            padded = self.pending + b"=" * (-len(self.pending) % 4)
+            data = binascii.a2b_base64(padded)
+            self.fileobj.write(data)
+            self.size += len(data)
+        self.pending = b""
+        self.fileobj.close()
+
+
+class InlineImageScanner:
+    """Stream inline image data out of a JSON response fed in chunks.
+
+    ``open_sink(index)`` is called when the ``index``-th inline image starts and
+    returns a writable binary file (closed by the scanner once the image ends),
+    or None to discard that image.
+    """
+
+    def __init__(self, open_sink):
+        self.open_sink = open_sink
+        self.images = []
+        self._skeleton = bytearray()
+        self._stack = []
+        self._mode = VALUE
+        self._key = bytearray()
+        self._escape = None
+        self._sink = None
+
+    def feed(self, chunk):
+        i = 0
+        n = len(chunk)
+        while i < n:
+            if self._escape is not None:
+                i = self._finish_escape(chunk, i)
+                continue
+            mode = self._mode
+            if mode == VALUE:
+                i = self._scan_value(chunk, i, n)
+                continue
+            match = _STRING_STOP.search(chunk, i)
+            end = match.start() if match else n
+            if end > i:
+                self._emit(chunk[i:end])
+            if not match:
+                return
+            if chunk[end] == 0x22:
+                self._end_string()
+                i = end + 1
+            else:
+                self._escape = b""
+                i = end + 1
+
+    def finish(self):
+        """Return the parsed response with streamed image data blanked out."""
+        if self._mode != VALUE or self._stack:
+            self.close()
+            raise RuntimeError("Incomplete response from server")
+        try:
+            return json.loads(bytes(self._skeleton).decode("utf-8"))
+        except ValueError as exc:
+            raise RuntimeError(f"Invalid response from server: {exc}") from exc
+
+    def close(self):
+        sink, self._sink = self._sink, None
+        if sink is not None:
+            sink.fileobj.close()
+
+    def _emit(self, text):
+        if self._mode == STREAM:
+            if self._sink is not None:
+                self._sink.write(text)
+        elif self._mode == KEY:
+            self._key += text
+        else:
+            self._skeleton += text
+
+    def _finish_escape(self, chunk, i):
+        self._escape += chunk[i : i + 1]
+        i += 1
+        code = self._escape[0]
+        if self._mode != STREAM:
+            if code == ord("u") and len(self._escape) < 5:
+                return i
+            self._emit(b"\\" + self._escape)
+        elif code == ord("u"):
+            if len(self._escape) < 5:
+                return i
+            self._emit(chr(int(self._escape[1:5], 16)).encode("ascii", "ignore"))
+        else:
+            self._emit(_SIMPLE_ESCAPES.get(code, b""))
+        self._escape = None
+        return i
+
+    def _scan_value(self, chunk, i, n):
+        stack = self._stack
+        skeleton = self._skeleton
+        while i < n:
+            c = chunk[i]
+            i += 1
+            if c in _WHITESPACE:
+                continue
+            if c == 0x22:
+                self._start_string()
+                return i
+            skeleton.append(c)
+            if c == 0x7B:
+                stack.append([True, None, True])
+            elif c == 0x5B:
+                stack.append([False, None, False])
+            elif c in (0x7D, 0x5D):
+                stack.pop()
+            elif c == 0x2C and stack and stack[-1][0]:
+                stack[-1][2] = True
+        return i
+
+    def _start_string(self):
+        stack = self._stack
+        frame = stack[-1] if stack else None
+        if frame and frame[0] and frame[2]:
+            self._mode = KEY
+            self._key = bytearray()
+            return
+        self._skeleton += b'"'
+        if (
+            frame
+            and frame[1] == "data"
+            and len(stack) > 1
+            and stack[-2][1] in INLINE_KEYS
+        ):
+            self._mode = STREAM
+            index = len(self.images)
+            self.images.append({"index": index, "size": 0})
+            fileobj = self.open_sink(index)
+            self._sink = Base64Sink(fileobj) if fileobj is not None else None
+        else:
+            self._mode = STRING
+
+    def _end_string(self):
+        mode = self._mode
+        self._mode = VALUE
+        if mode == KEY:
+            frame = self._stack[-1]
+            frame[1] = json.loads(b'"' + bytes(self._key) + b'"')
+            frame[2] = False
+            self._skeleton += b'"' + self._key + b'"'
+            return
+        if mode == STREAM:
+            sink, self._sink = self._sink, None
+            if sink is not None:
+                sink.finish()
+                self.images[-1]["size"] = sink.size
+        self._skeleton += b'"'
+
+
+def iter_inline_parts(response):
+    """Yield the inline data objects of a (skeleton) response in order."""
+    for candidate in response.get("candidates") or []:
+        content = candidate.get("content") or {}
+        for part in content.get("parts") or []:
+            for key in INLINE_KEYS:
+                inline = part.get(key)
+                if isinstance(inline, dict):
+                    yield inline
+                    break
+
+
+class InlineBlob:
+    """Binary content that is base64-encoded only while the request is sent.
+
+    Backed either by bytes or by a local file, which is memory-mapped and
+    encoded chunk by chunk instead of being read into memory.
+    """
+
+    def __init__(self, data=None, path=None):
+        if (data is None) == (path is None):
+            raise ValueError("InlineBlob needs exactly one of data or path")
+        self.data = data
+        self.path = path
+        self.size = len(data) if data is not None else os.path.getsize(path)
+        self._digest = None
+
+    @property
+    def encoded_size(self):
+        return 4 * ((self.size + 2) // 3)
+
+    def iter_chunks(self, chunk_size=UPLOAD_CHUNK_SIZE):
+        """Yield the raw content in slices of at most ``chunk_size`` bytes."""
+        if self.data is not None:
+            view = memoryview(self.data)
+            for start in range(0, self.size, chunk_size):
+                yield view[start : start + chunk_size]
+            return
+        if not self.size:
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            for start in range(0, self.size, chunk_size):
+                yield m[start : start + chunk_size]
+
+    def iter_base64(self):
+        for chunk in self.iter_chunks():
+            yield binascii.b2a_base64(chunk, newline=False)
+
+    def digest(self):
+        if self._digest is None:
+            sha = hashlib.sha256()
+            for chunk in self.iter_chunks():
+                sha.update(chunk)
+            self._digest = sha.hexdigest()
+        return self._digest
+
+
+class StreamingBody:
+    """A JSON request body whose InlineBlobs are base64-encoded on the fly.
+
+    ``len()`` is known up front so the request can carry a Content-Length, and
+    the body can be iterated again if a request has to be resent.
+    """
+
+    replayable = True
+
+    def __init__(self, segments, blobs):
+        self.segments = segments
+        self.blobs = blobs
+        self.length = sum(len(segment) for segment in segments) + sum(
+            blob.encoded_size for blob in blobs
+        )
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for segment, blob in zip(self.segments, self.blobs):
+            if segment:
+                yield segment
+            yield from blob.iter_base64()
+        if self.segments[-1]:
+            yield self.segments[-1]
+
+
+def encode_json_body(payload):
+    """Serialize ``payload``; returns bytes, or a StreamingBody if it holds InlineBlobs."""
+    blobs = []
+    marker = f"ai-draw-blob-{uuid.uuid4().hex}"
+
+    def default(value):
+        if isinstance(value, InlineBlob):
+            blobs.append(value)
+            return marker
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    text = json.dumps(payload, default=default)
+    if not blobs:
+        return text.encode("utf-8")
+    segments = [segment.encode("utf-8") for segment in text.split(marker)]
+    return StreamingBody(segments, blobs)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Per-phase timing traces for generations.
+
+A Trace collects spans: named phases with monotonic start/end times relative
+to the trace start, plus attributes such as byte counts. Finished spans are
+handed to ``on_span`` as they complete, so they can be streamed out as JSON
+lines. Code paths take ``NULL_TRACE`` when tracing is off.
+"""
+import contextlib
+import json
+import threading
+import time
+import uuid
+
+
+class Trace:
+    """Timed spans for one generation."""
+
+    enabled = True
+
+    def __init__(self, on_span=None, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.attrs = attrs
+        self.on_span = on_span
+        self.origin = time.monotonic()
+        self.started_at = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def bind(self, **attrs):
+        """Return a view of this trace that adds ``attrs`` to every span."""
+        return BoundTrace(self, attrs)
+
+    def record(self, name, start, end, **attrs):
+        span = {
+            "trace_id": self.trace_id,
+            "name": name,
+            "start": round(start - self.origin, 6),
+            "end": round(end - self.origin, 6),
+            "duration": round(end - start, 6),
+        }
+        span.update(self.attrs)
+        span.update(attrs)
+        with self._lock:
+            self.spans.append(span)
+        if self.on_span:
+            self.on_span(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Time the enclosed block; the yielded dict takes extra attributes."""
+        start = time.monotonic()
+        try:
+            yield attrs
+        except BaseException as exc:
+            attrs["error"] = str(exc) or exc.__class__.__name__
+            raise
+        finally:
+            self.record(name, start, time.monotonic(), **attrs)
+
+    def totals(self):
+        """Return the summed duration of each span name."""
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span["name"]] = totals.get(span["name"], 0.0) + span["duration"]
+        return totals
+
+
+class BoundTrace:
+    enabled = True
+
+    def __init__(self, trace, attrs):
+        self.trace = trace
+        self.attrs = attrs
+
+    def bind(self, **attrs):
+        return BoundTrace(self.trace, {**self.attrs, **attrs})
+
+    def record(self, name, start, end, **attrs):
+        return self.trace.record(name, start, end, **{**self.attrs, **attrs})
+
+    def span(self, name, **attrs):
+        return self.trace.span(name, **{**self.attrs, **attrs})
+
+
+class NullTrace:
+    """Stand-in used when tracing is off; every call is a no-op."""
+
+    enabled = False
+
+    def bind(self, **attrs):
+        return self
+
+    def record(self, name, start, end, **attrs):
+        return None
+
+    def span(self, name, **attrs):
+        return contextlib.nullcontext({})
+
+
+NULL_TRACE = NullTrace()
+
+
+class TracedBody:
+    """Request body wrapper that times chunk production and notes when sending ends.
+
+    Chunks are produced lazily (InlineBlobs are base64-encoded on the fly), so
+    the time spent in ``next()`` is encoding time; ``sent_at`` is set once the
+    transport has consumed the last chunk.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.length = len(body)
+        self.replayable = isinstance(body, bytes) or getattr(body, "replayable", False)
+        self.encode_s = 0.0
+        self.sent_at = None
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        if isinstance(self.body, bytes):
+            yield self.body
+        else:
+            chunks = iter(self.body)
+            while True:
+                started = time.monotonic()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                finally:
+                    self.encode_s += time.monotonic() - started
+                yield chunk
+        self.sent_at = time.monotonic()
+
+
+class TimedWriter:
+    """Binary file wrapper that counts bytes written and time spent writing."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+        self.write_s = 0.0
+
+    def write(self, data):
+        started = time.monotonic()
+        count = self.fileobj.write(data)
+        self.write_s += time.monotonic() - started
+        self.size += len(data)
+        return count
+
+    def close(self):
+        self.fileobj.close()
+
+
+class ExchangeTimer:
+    """Splits one HTTP exchange into upload, server wait and download spans."""
+
+    def __init__(self, body=None):
+        self.body = body
+        self.started = time.monotonic()
+        self.headers_at = None
+        self.status = None
+        self.received = 0
+        self.network_s = 0.0
+        self.parse_s = 0.0
+        self._mark = self.started
+        self.writers = []
+
+    def response_started(self, status=None):
+        if self.headers_at is None:
+            self.headers_at = self._mark = time.monotonic()
+            self.status = status
+
+    def feed(self, consume, chunk):
+        """Account for ``chunk`` having arrived and pass it to ``consume``."""
+        arrived = time.monotonic()
+        self.network_s += arrived - self._mark
+        self.received += len(chunk)
+        consume(chunk)
+        self._mark = time.monotonic()
+        self.parse_s += self._mark - arrived
+
+    def sink(self, open_sink):
+        """Wrap an InlineImageScanner sink factory so every file is a TimedWriter."""
+
+        def open_timed(index):
+            fileobj = open_sink(index)
+            if fileobj is None:
+                return None
+            writer = TimedWriter(fileobj)
+            self.writers.append(writer)
+            return writer
+
+        return open_timed
+
+    def record(self, trace):
+        if not trace.enabled:
+            return
+        now = time.monotonic()
+        body = self.body
+        sent_at = getattr(body, "sent_at", None) or self.headers_at or now
+        trace.record(
+            "upload",
+            self.started,
+            sent_at,
+            bytes=len(body) if body is not None else 0,
+            encode_s=round(getattr(body, "encode_s", 0.0), 6),
+        )
+        if self.headers_at is None:
+            return
+        trace.record("wait", sent_at, self.headers_at, status=self.status)
+        if self.received:
+            self.network_s += now - self._mark
+            write_s = sum(writer.write_s for writer in self.writers)
+            trace.record(
+                "download",
+                self.headers_at,
+                now,
+                bytes=self.received,
+                network_s=round(self.network_s, 6),
+                decode_s=round(self.parse_s - write_s, 6),
+                write_s=round(write_s, 6),
+                image_bytes=sum(writer.size for writer in self.writers),
+            )
+
+
+def jsonl_span_writer(stream):
+    """Return an on_span callback writing spans to ``stream`` as JSON lines."""
+    lock = threading.Lock()
+
+    def on_span(span):
+        line = json.dumps(span, ensure_ascii=False, default=str)
+        with lock:
+            stream.write(line + "\n")
+            stream.flush()
+
+    return on_span
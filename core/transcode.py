@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Converting generated images to the requested output format.
+
+The API decides the encoding of the image it returns. When that differs from
+``output_format``, the file is re-encoded with Qt's codecs in a process pool,
+so that encoding a 4K image neither holds the GIL against the network workers
+nor stalls the GUI thread. Files already in the requested format are left
+untouched.
+"""
+import os
+import tempfile
+import threading
+
+from .config import DEFAULT_OUTPUT_QUALITY
+from .trace import NULL_TRACE
+
+FORMAT_ALIASES = {"jpeg": "jpg", "jfif": "jpg"}
+QT_FORMATS = {"png": b"PNG", "jpg": b"JPEG", "webp": b"WEBP"}
+MAX_TRANSCODE_WORKERS = 4
+
+
+def normalize_format(value):
+    """Return "png", "jpg" or "webp" for a format name (None if unsupported)."""
+    name = str(value or "").strip().lower().lstrip(".")
+    name = FORMAT_ALIASES.get(name, name)
+    return name if name in QT_FORMATS else None
+
+
+def format_from_path(path):
+    return normalize_format(os.path.splitext(str(path))[1])
+
+
+def normalize_quality(value):
+    """Return an encoder quality in 0-100, rejecting anything else."""
+    try:
+        quality = int(value)
+    except (TypeError, ValueError):
+        quality = -1
+    if not 0 <= quality <= 100:
+        raise RuntimeError(f"Invalid quality: {value!r} (expected 0-100)")
+    return quality
+
+
+def with_format_extension(path, output_format):
+    """Swap an image extension on ``path`` for the one matching ``output_format``."""
+    target = normalize_format(output_format)
+    base, ext = os.path.splitext(str(path))
+    if target is None or normalize_format(ext) in (None, target):
+        return path
+    return f"{base}.{target}"
+
+
+def sniff_format(path):
+    """Detect the format of an image file from its first bytes."""
+    with open(path, "rb") as f:
+        head = f.read(12)
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def transcode_file(source, destination, output_format, quality=DEFAULT_OUTPUT_QUALITY):
+    """Re-encode ``source`` as ``output_format`` into ``destination`` (atomically).
+
+    Runs in a pool process; the PySide6 import happens there.
+    """
+    from PySide6 import QtCore, QtGui
+
+    reader = QtGui.QImageReader(source)
+    reader.setAutoTransform(True)
+    image = reader.read()
+    if image.isNull():
+        raise RuntimeError(f"Cannot decode generated image: {reader.errorString()}")
+    if output_format == "jpg" and image.hasAlphaChannel():
+        # JPEG has no alpha channel; flatten onto white rather than black.
+        flat = QtGui.QImage(image.size(), QtGui.QImage.Format.Format_RGB32)
+        flat.fill(QtCore.Qt.GlobalColor.white)
+        painter = QtGui.QPainter(flat)
+        painter.drawImage(0, 0, image)
+        painter.end()
+        image = flat
+    directory = os.path.dirname(os.path.abspath(destination))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    os.close(fd)
+    try:
+        writer = QtGui.QImageWriter(tmp_path, QtCore.QByteArray(QT_FORMATS[output_format]))
+        writer.setQuality(int(quality))
+        if not writer.write(image):
+            raise RuntimeError(f"Cannot encode {output_format}: {writer.errorString()}")
+        os.replace(tmp_path, destination)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return destination
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_transcode_pool():
+    """Return the shared process pool, starting it on first use."""
+    global _pool
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=min(MAX_TRANSCODE_WORKERS, os.cpu_count() or 1),
+                # Forking a process that runs network threads is unsafe.
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def reset_transcode_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def plan_transcode(path, output_format):
+    """Return (source_format, target_format); target is None when nothing is to do."""
+    target = normalize_format(output_format)
+    source = sniff_format(path)
+    if target is None or source == target:
+        return source, None
+    return source, target
+
+
+def keep_source(path, source, on_status=None):
+    if on_status:
+        on_status(f"PySide6 not available, keeping the {source or 'original'} image")
+    return path
+
+
+def transcode_output(
+    path, output_format, quality=DEFAULT_OUTPUT_QUALITY, on_status=None, trace=NULL_TRACE
+):
+    """Make the image at ``path`` match ``output_format``, re-encoding it if needed."""
+    source, target = plan_transcode(path, output_format)
+    if target is None:
+        return path
+    from concurrent.futures.process import BrokenProcessPool
+
+    with trace.span("transcode", source=source, format=target):
+        if on_status:
+            on_status(f"converting {source or 'image'} to {target}")
+        try:
+            return get_transcode_pool().submit(
+                transcode_file, path, path, target, quality
+            ).result()
+        except BrokenProcessPool:
+            reset_transcode_pool()
+            return transcode_file(path, path, target, quality)
+        except ImportError:
+            return keep_source(path, source, on_status)
+
+
+async def atranscode_output(
+    path, output_format, quality=DEFAULT_OUTPUT_QUALITY, on_status=None, trace=NULL_TRACE
+):
+    """Async counterpart of transcode_output."""
+    import asyncio
+
+    source, target = plan_transcode(path, output_format)
+    if target is None:
+        return path
+    from concurrent.futures.process import BrokenProcessPool
+
+    with trace.span("transcode", source=source, format=target):
+        if on_status:
+            on_status(f"converting {source or 'image'} to {target}")
+        try:
+            return await asyncio.wrap_future(
+                get_transcode_pool().submit(transcode_file, path, path, target, quality)
+            )
+        except BrokenProcessPool:
+            reset_transcode_pool()
+            return await asyncio.to_thread(transcode_file, path, path, target, quality)
+        except ImportError:
+            return keep_source(path, source, on_status)
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""HTTP transports used by request_json and reference image downloads.
+
+``PooledTransport`` keeps persistent keep-alive connections per host, reuses
+TLS sessions and caches DNS lookups. ``UrllibTransport`` is the original
+one-connection-per-request behavior and stays available as a fallback.
+"""
+import http.client
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urljoin, urlsplit
+
+from .config import DEFAULT_TRANSPORT, TRANSPORT_NAMES
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_IDLE_TIMEOUT = 60.0
+DEFAULT_DNS_TTL = 300.0
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class RequestAborted(RuntimeError):
+    """Raised when a request is cut off through its AbortHandle."""
+
+
+class AbortHandle:
+    """Lets another thread abort a request that is blocked on its socket.
+
+    The transport attaches the connection's socket while the request is in
+    flight; ``abort()`` shuts it down so that pending reads and writes fail
+    at once instead of waiting for the timeout.
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def attach(self, sock):
+        with self._lock:
+            self._sock = sock
+            aborted = self.aborted
+        if aborted:
+            shutdown_socket(sock)
+
+    def detach(self):
+        with self._lock:
+            self._sock = None
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            shutdown_socket(sock)
+
+    def check(self):
+        if self.aborted:
+            raise RequestAborted("Request aborted")
+
+
+def shutdown_socket(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def abortable_connection(base, abort):
+    """Subclass an http.client connection class to attach its socket to ``abort``."""
+
+    class AbortableConnection(base):
+        def connect(self):
+            abort.check()
+            super().connect()
+            abort.attach(self.sock)
+
+    return AbortableConnection
+
+
+class AbortableHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, abort):
+        super().__init__()
+        self.abort = abort
+
+    def http_open(self, req):
+        return self.do_open(abortable_connection(http.client.HTTPConnection, self.abort), req)
+
+
+class AbortableHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, abort):
+        super().__init__()
+        self.abort = abort
+
+    def https_open(self, req):
+        return self.do_open(
+            abortable_connection(http.client.HTTPSConnection, self.abort),
+            req,
+            context=self._context,
+        )
+
+
+class UrllibTransport:
+    """Open a fresh connection for every request through urllib."""
+
+    def open(self, method, url, headers=None, body=None, timeout=30, abort=None):
+        req = urllib.request.Request(url, data=body, headers=headers or {}, method=method)
+        if abort is None:
+            return urllib.request.urlopen(req, timeout=timeout)
+        opener = urllib.request.build_opener(
+            AbortableHTTPHandler(abort), AbortableHTTPSHandler(abort)
+        )
+        return opener.open(req, timeout=timeout)
+
+    def close(self):
+        pass
+
+
+class DnsCache:
+    """Cache getaddrinfo results for a fixed time-to-live."""
+
+    def __init__(self, ttl=DEFAULT_DNS_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        with self._lock:
+            self._entries[key] = (now + self.ttl, infos)
+        return infos
+
+    def forget(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+def connect_cached(dns_cache, host, port, timeout):
+    last_error = None
+    for family, socktype, proto, _, address in dns_cache.resolve(host, port):
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(address)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except OSError as exc:
+            last_error = exc
+            sock.close()
+    dns_cache.forget(host, port)
+    raise last_error or OSError(f"Could not resolve {host}")
+
+
+class PooledHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, host, port, timeout, dns_cache):
+        super().__init__(host, port, timeout=timeout)
+        self.dns_cache = dns_cache
+        self.idle_since = time.monotonic()
+
+    def connect(self):
+        self.sock = connect_cached(self.dns_cache, self.host, self.port, self.timeout)
+
+
+class PooledHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, host, port, timeout, dns_cache, context, tls_sessions):
+        super().__init__(host, port, timeout=timeout, context=context)
+        self.dns_cache = dns_cache
+        self.tls_sessions = tls_sessions
+        self.idle_since = time.monotonic()
+
+    def connect(self):
+        sock = connect_cached(self.dns_cache, self.host, self.port, self.timeout)
+        session = self.tls_sessions.get((self.host, self.port))
+        try:
+            self.sock = self._context.wrap_socket(
+                sock, server_hostname=self.host, session=session
+            )
+        except ssl.SSLError:
+            if session is None:
+                sock.close()
+                raise
+            # A stale session is not fatal; handshake again without it.
+            self.tls_sessions.pop((self.host, self.port), None)
+            sock.close()
+            sock = connect_cached(self.dns_cache, self.host, self.port, self.timeout)
+            self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+    def remember_session(self):
+        session = getattr(self.sock, "session", None)
+        if session is not None:
+            self.tls_sessions[(self.host, self.port)] = session
+
+
+class ConnectionPool:
+    """Idle keep-alive connections for one scheme/host/port."""
+
+    def __init__(self, factory, max_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if now - candidate.idle_since > self.idle_timeout:
+                    stale.append(candidate)
+                    continue
+                conn = candidate
+                break
+        for candidate in stale:
+            candidate.close()
+        if conn is None:
+            return self.factory(), False
+        return conn, True
+
+    def release(self, conn):
+        conn.idle_since = time.monotonic()
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class PooledResponse:
+    """File-like response that hands its connection back to the pool when done."""
+
+    def __init__(self, pool, conn, response, url, abort=None):
+        self._pool = pool
+        self._conn = conn
+        self._response = response
+        self._abort = abort
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    def readinto(self, buffer):
+        count = self._response.readinto(buffer)
+        if self._response.isclosed():
+            self._release()
+        return count
+
+    def _release(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._abort is not None:
+            self._abort.detach()
+        if self._response.will_close:
+            conn.close()
+        else:
+            self._pool.release(conn)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            if self._abort is not None:
+                self._abort.detach()
+            # Unread body left on the wire: the connection cannot be reused.
+            self._response.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PooledTransport:
+    """Keep-alive connection pools per host with TLS session reuse and DNS caching."""
+
+    def __init__(
+        self,
+        max_size=DEFAULT_POOL_SIZE,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+        dns_ttl=DEFAULT_DNS_TTL,
+        ssl_context=None,
+    ):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.dns_cache = DnsCache(dns_ttl)
+        self.ssl_context = ssl_context or ssl.create_default_context()
+        self.tls_sessions = {}
+        self.fallback = UrllibTransport()
+        self._proxies = urllib.request.getproxies()
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool_for(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                if scheme == "https":
+                    def factory():
+                        return PooledHTTPSConnection(
+                            host, port, None, self.dns_cache, self.ssl_context, self.tls_sessions
+                        )
+                else:
+                    def factory():
+                        return PooledHTTPConnection(host, port, None, self.dns_cache)
+                pool = ConnectionPool(factory, self.max_size, self.idle_timeout)
+                self._pools[key] = pool
+            return pool
+
+    def _uses_proxy(self, scheme, host):
+        return scheme in self._proxies and not urllib.request.proxy_bypass(host)
+
+    def _connect(self, conn, timeout, abort):
+        conn.timeout = timeout
+        if abort is None:
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return
+        abort.check()
+        if conn.sock is None:
+            conn.connect()
+        conn.sock.settimeout(timeout)
+        abort.attach(conn.sock)
+
+    def _send(self, pool, method, path, headers, body, timeout, abort=None):
+        conn, reused = pool.acquire()
+        try:
+            self._connect(conn, timeout, abort)
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            if abort is not None:
+                abort.detach()
+            conn.close()
+            # A reused keep-alive connection may have been closed by the server
+            # while idle; retry once on a fresh one if the body can be resent.
+            replayable = (
+                body is None or isinstance(body, bytes) or getattr(body, "replayable", False)
+            )
+            if not reused or not replayable:
+                raise
+            conn = pool.factory()
+            try:
+                self._connect(conn, timeout, abort)
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+            except BaseException:
+                if abort is not None:
+                    abort.detach()
+                conn.close()
+                raise
+        except BaseException:
+            if abort is not None:
+                abort.detach()
+            conn.close()
+            raise
+        if isinstance(conn, PooledHTTPSConnection):
+            conn.remember_session()
+        return conn, response
+
+    def open(self, method, url, headers=None, body=None, timeout=30, abort=None):
+        headers = dict(headers or {})
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            scheme = parts.scheme.lower()
+            if scheme not in ("http", "https") or self._uses_proxy(scheme, parts.hostname):
+                return self.fallback.open(method, url, headers, body, timeout, abort)
+            port = parts.port or (443 if scheme == "https" else 80)
+            path = parts.path or "/"
+            if parts.query:
+                path = f"{path}?{parts.query}"
+
+            pool = self._pool_for(scheme, parts.hostname, port)
+            conn, response = self._send(pool, method, path, headers, body, timeout, abort)
+            wrapped = PooledResponse(pool, conn, response, url, abort)
+            location = response.headers.get("Location")
+            if response.status in REDIRECT_CODES and location and method in ("GET", "HEAD"):
+                wrapped.read()
+                wrapped.close()
+                url = urljoin(url, location)
+                continue
+            if not 200 <= response.status < 300:
+                raise urllib.error.HTTPError(
+                    url, response.status, response.reason, response.headers, wrapped
+                )
+            return wrapped
+        raise urllib.error.HTTPError(
+            url, response.status, "Too many redirects", response.headers, None
+        )
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+
+def create_transport(name=DEFAULT_TRANSPORT):
+    if name == "urllib":
+        return UrllibTransport()
+    if name == "pooled":
+        return PooledTransport()
+    raise RuntimeError(f"Unknown transport: {name}")
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = create_transport()
+    return _transport
+
+
+def set_transport(transport):
+    """Replace the process-wide transport; accepts an instance or a name."""
+    global _transport
+    if isinstance(transport, str):
+        transport = create_transport(transport)
+    with _transport_lock:
+        previous, _transport = _transport, transport
+    if previous is not None and previous is not transport:
+        previous.close()
+    return transport
@@ -1,24 +1,36 @@
 #!/usr/bin/env python3
 import os
+import sys
+import threading
+from collections import OrderedDict
 from threading import Event
 
 from PySide6 import QtCore, QtGui, QtWidgets
 
-from core.app import (
+from core.config import (
     DEFAULT_ASPECT,
+    DEFAULT_CACHE_MAX_MB,
+    DEFAULT_CACHE_MODE,
     DEFAULT_FORMAT,
+    DEFAULT_GUI_CONCURRENCY,
     DEFAULT_MODEL,
+    DEFAULT_OUTPUT_QUALITY,
     DEFAULT_PROVIDER,
     DEFAULT_RESOLUTION,
-    generate_image,
+    DEFAULT_TRANSPORT,
+    get_api_key,
+    load_config,
+    save_config,
 )
-from core.config import get_api_key, load_config, save_config
+from core.imaging import load_thumbnail, prune_thumbnails, thumbnail_key
+from core.transcode import with_format_extension
 
 
 class GenerateWorker(QtCore.QThread):
     status = QtCore.Signal(str)
     finished = QtCore.Signal(str)
     error = QtCore.Signal(str)
+    cancelled = QtCore.Signal()
 
     def __init__(
         self,
@@ -34,6 +46,8 @@ class GenerateWorker(QtCore.QThread):
         timeout,
         api_base,
         api_key,
+        cache=None,
+        output_quality=DEFAULT_OUTPUT_QUALITY,
     ):
         super().__init__()
         self.prompt = prompt
@@ -48,12 +62,17 @@ class GenerateWorker(QtCore.QThread):
         self.timeout = timeout
         self.api_base = api_base
         self.api_key = api_key
+        self.cache = cache
+        self.output_quality = output_quality
         self.cancel_event = Event()
 
     def cancel(self):
         self.cancel_event.set()
 
     def run(self):
+        # The HTTP client is imported with the first job, not at startup.
+        from core.app import GenerationCancelled, generate_image
+
         try:
             output_path = generate_image(
                 prompt=self.prompt,
@@ -70,12 +89,295 @@ class GenerateWorker(QtCore.QThread):
                 api_key=self.api_key,
                 on_status=lambda s: self.status.emit(s),
                 cancel_event=self.cancel_event,
+                cache=self.cache,
+                output_quality=self.output_quality,
             )
             self.finished.emit(output_path)
+        except GenerationCancelled:
+            self.cancelled.emit()
         except Exception as exc:
             self.error.emit(str(exc))
 
 
+class QueuedJob:
+    """One entry of the GUI job queue."""
+
+    def __init__(self, job_id, kwargs):
+        self.id = job_id
+        self.kwargs = kwargs
+        self.state = "queued"
+        self.status = "queued"
+        self.worker = None
+
+    @property
+    def output_path(self):
+        return self.kwargs["output_path"]
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+
+class PreviewWorker(QtCore.QThread):
+    """Decodes an image at preview size off the UI thread."""
+
+    loaded = QtCore.Signal(int, str, QtGui.QImage, QtCore.QSize)
+
+    def __init__(self, token, path, target_size):
+        super().__init__()
+        self.token = token
+        self.path = path
+        self.target_size = target_size
+
+    def run(self):
+        reader = QtGui.QImageReader(self.path)
+        reader.setAutoTransform(True)
+        source_size = reader.size()
+        if source_size.isValid() and (
+            source_size.width() > self.target_size.width()
+            or source_size.height() > self.target_size.height()
+        ):
+            # Lets JPEG decode straight at the reduced size.
+            reader.setScaledSize(
+                source_size.scaled(self.target_size, QtCore.Qt.AspectRatioMode.KeepAspectRatio)
+            )
+        self.loaded.emit(self.token, self.path, reader.read(), source_size)
+
+
+class PreviewLabel(QtWidgets.QLabel):
+    resized = QtCore.Signal()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.resized.emit()
+
+
+HISTORY_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+HISTORY_ICON_SIZE = 128
+
+
+def scan_history(directory):
+    """List the images in ``directory`` as (path, mtime_ns, size), oldest first."""
+    entries = []
+    try:
+        scanner = os.scandir(directory)
+    except OSError:
+        return entries
+    with scanner:
+        for entry in scanner:
+            if entry.name.startswith(".") or not entry.name.lower().endswith(HISTORY_EXTENSIONS):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((entry.path, stat.st_mtime_ns, stat.st_size))
+    entries.sort(key=lambda item: item[1])
+    return entries
+
+
+class HistoryScanner(QtCore.QThread):
+    scanned = QtCore.Signal(str, list)
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+
+    def run(self):
+        self.scanned.emit(self.directory, scan_history(self.directory))
+        prune_thumbnails()
+
+
+class ThumbnailLoader(QtCore.QObject):
+    """Background thumbnail decoding, most recently requested first.
+
+    While the gallery scrolls, requests for rows that went off screen pile up
+    behind the visible ones; only the newest ``max_pending`` are kept.
+    """
+
+    ready = QtCore.Signal(str, QtGui.QImage)
+
+    def __init__(self, workers=2, max_pending=256, parent=None):
+        super().__init__(parent)
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.running = set()
+        self.stopping = False
+        self.condition = threading.Condition()
+        self.workers = workers
+        self.threads = []
+
+    def request(self, key, path, mtime_ns, size):
+        with self.condition:
+            if not self.threads:
+                self.threads = [
+                    threading.Thread(target=self.work, name=f"thumbnails-{i}", daemon=True)
+                    for i in range(self.workers)
+                ]
+                for thread in self.threads:
+                    thread.start()
+            if key in self.running:
+                return
+            if key in self.pending:
+                self.pending.move_to_end(key)
+                return
+            self.pending[key] = (path, mtime_ns, size)
+            if len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+            self.condition.notify()
+
+    def forget(self, key):
+        with self.condition:
+            self.pending.pop(key, None)
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                key, args = self.pending.popitem(last=True)
+                self.running.add(key)
+            try:
+                image = load_thumbnail(*args)
+            except Exception:
+                image = QtGui.QImage()
+            with self.condition:
+                self.running.discard(key)
+            self.ready.emit(key, image)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.pending.clear()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+
+class HistoryModel(QtCore.QAbstractListModel):
+    """Past outputs, newest first, with thumbnails loaded as rows get painted.
+
+    Rows are handed to the view in batches through fetchMore, and a thumbnail
+    is only requested when the view asks for a row's icon, i.e. when it is on
+    screen. Decoded icons live in QPixmapCache.
+    """
+
+    FETCH_BATCH = 500
+
+    def __init__(self, loader, icon_size, device_pixel_ratio=1.0, parent=None):
+        super().__init__(parent)
+        self.loader = loader
+        self.icon_size = icon_size
+        self.device_pixel_ratio = device_pixel_ratio
+        # Oldest first, so new outputs append without shifting positions.
+        self.entries = []
+        self.positions = {}
+        self.loaded = 0
+        self.requested = {}
+        self.placeholder = QtGui.QPixmap(icon_size * device_pixel_ratio)
+        self.placeholder.fill(QtGui.QColor("#161a22"))
+        self.placeholder.setDevicePixelRatio(device_pixel_ratio)
+        loader.ready.connect(self.on_thumbnail)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.loaded < len(self.entries)
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        count = min(self.FETCH_BATCH, len(self.entries) - self.loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def entry(self, row):
+        return self.entries[len(self.entries) - 1 - row]
+
+    def row_of(self, path):
+        position = self.positions.get(path)
+        if position is None:
+            return None
+        row = len(self.entries) - 1 - position
+        return row if row < self.loaded else None
+
+    def data(self, index, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or index.row() >= self.loaded:
+            return None
+        path, mtime_ns, size = self.entry(index.row())
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            return os.path.basename(path)
+        if role in (QtCore.Qt.ItemDataRole.ToolTipRole, QtCore.Qt.ItemDataRole.UserRole):
+            return path
+        if role == QtCore.Qt.ItemDataRole.DecorationRole:
+            key = thumbnail_key(path, mtime_ns, size)
+            pixmap = QtGui.QPixmapCache.find(key)
+            if pixmap is not None:
+                return pixmap
+            self.requested[key] = path
+            self.loader.request(key, path, mtime_ns, size)
+            return self.placeholder
+        return None
+
+    def on_thumbnail(self, key, image):
+        path = self.requested.pop(key, None)
+        if path is None:
+            return
+        if image.isNull():
+            pixmap = self.placeholder
+        else:
+            # Scale once to the icon size, so painting never has to.
+            pixmap = QtGui.QPixmap.fromImage(
+                image.scaled(
+                    self.icon_size * self.device_pixel_ratio,
+                    QtCore.Qt.AspectRatioMode.KeepAspectRatio,
+                    QtCore.Qt.TransformationMode.SmoothTransformation,
+                )
+            )
+            pixmap.setDevicePixelRatio(self.device_pixel_ratio)
+        QtGui.QPixmapCache.insert(key, pixmap)
+        row = self.row_of(path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [QtCore.Qt.ItemDataRole.DecorationRole])
+
+    def set_entries(self, entries):
+        self.beginResetModel()
+        self.entries = list(entries)
+        self.positions = {path: i for i, (path, _, _) in enumerate(self.entries)}
+        self.loaded = min(self.FETCH_BATCH, len(self.entries))
+        self.requested.clear()
+        self.endResetModel()
+
+    def add_path(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        entry = (path, stat.st_mtime_ns, stat.st_size)
+        position = self.positions.get(path)
+        if position is not None:
+            self.entries[position] = entry
+            row = self.row_of(path)
+            if row is not None:
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), 0, 0)
+        self.positions[path] = len(self.entries)
+        self.entries.append(entry)
+        self.loaded += 1
+        self.endInsertRows()
+
+
 class SettingsDialog(QtWidgets.QDialog):
     def __init__(self, config, parent=None):
         super().__init__(parent)
@@ -132,7 +434,21 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setMinimumSize(900, 600)
 
         self.config = load_config()
-        self.worker = None
+        self.transport_ready = False
+        self.jobs = []
+        self.next_job_id = 1
+        self.preview_workers = set()
+        self.preview_token = 0
+        self.preview_path = None
+        self.preview_image = None
+        self.preview_source_size = QtCore.QSize()
+        self.preview_expected = None
+        self.preview_timer = QtCore.QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(150)
+        self.preview_timer.timeout.connect(self.reload_preview)
+        self.history_scanner = None
+        self.history_dir = None
 
         menubar = self.menuBar()
         settings_menu = menubar.addMenu("Settings")
@@ -217,7 +533,7 @@ class MainWindow(QtWidgets.QMainWindow):
         buttons = QtWidgets.QHBoxLayout()
         self.generate_btn = QtWidgets.QPushButton("Generate")
         self.generate_btn.clicked.connect(self.on_generate)
-        self.cancel_btn = QtWidgets.QPushButton("Cancel")
+        self.cancel_btn = QtWidgets.QPushButton("Cancel all")
         self.cancel_btn.setEnabled(False)
         self.cancel_btn.clicked.connect(self.on_cancel)
         buttons.addWidget(self.generate_btn)
@@ -225,9 +541,14 @@ class MainWindow(QtWidgets.QMainWindow):
         left_layout.addLayout(buttons)
         left_layout.addStretch(1)
 
-        self.preview = QtWidgets.QLabel("Preview")
+        self.preview = PreviewLabel("Preview")
         self.preview.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
         self.preview.setMinimumHeight(260)
+        # Keep the pixmap from driving the layout, or every rescale could grow it.
+        self.preview.setSizePolicy(
+            QtWidgets.QSizePolicy.Policy.Ignored, QtWidgets.QSizePolicy.Policy.Ignored
+        )
+        self.preview.resized.connect(self.on_preview_resized)
         self.preview.setStyleSheet("border: 1px solid #2a2a2a; color: #777;")
 
         self.status_label = QtWidgets.QLabel("idle")
@@ -237,10 +558,61 @@ class MainWindow(QtWidgets.QMainWindow):
         self.log_view.setReadOnly(True)
         self.log_view.setMaximumBlockCount(200)
 
-        right_layout.addWidget(self.preview)
+        # The gallery is built the first time the History tab is opened.
+        self.thumbnail_loader = None
+        self.history_model = None
+        self.history_tab = QtWidgets.QWidget()
+        QtWidgets.QVBoxLayout(self.history_tab).setContentsMargins(0, 6, 0, 0)
+
+        self.queue_table = QtWidgets.QTableWidget(0, 3)
+        self.queue_table.setHorizontalHeaderLabels(["#", "Prompt", "Status"])
+        self.queue_table.verticalHeader().setVisible(False)
+        self.queue_table.horizontalHeader().setSectionResizeMode(
+            1, QtWidgets.QHeaderView.ResizeMode.Stretch
+        )
+        self.queue_table.setSelectionBehavior(
+            QtWidgets.QAbstractItemView.SelectionBehavior.SelectRows
+        )
+        self.queue_table.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+
+        self.parallel_input = QtWidgets.QSpinBox()
+        self.parallel_input.setRange(1, 16)
+        try:
+            self.parallel_input.setValue(
+                int(self.config.get("gui_concurrency", DEFAULT_GUI_CONCURRENCY))
+            )
+        except (TypeError, ValueError):
+            self.parallel_input.setValue(DEFAULT_GUI_CONCURRENCY)
+        self.parallel_input.valueChanged.connect(self.on_parallel_changed)
+
+        queue = QtWidgets.QWidget()
+        queue_layout = QtWidgets.QVBoxLayout(queue)
+        queue_layout.setContentsMargins(0, 6, 0, 0)
+        queue_row = QtWidgets.QHBoxLayout()
+        queue_row.addWidget(QtWidgets.QLabel("Parallel"))
+        queue_row.addWidget(self.parallel_input)
+        queue_row.addStretch(1)
+        for label, slot in (
+            ("Up", self.move_jobs_up),
+            ("Down", self.move_jobs_down),
+            ("Cancel", self.cancel_selected_jobs),
+            ("Clear finished", self.clear_finished_jobs),
+        ):
+            button = QtWidgets.QPushButton(label)
+            button.clicked.connect(slot)
+            queue_row.addWidget(button)
+        queue_layout.addLayout(queue_row)
+        queue_layout.addWidget(self.queue_table)
+
+        self.tabs = QtWidgets.QTabWidget()
+        self.tabs.addTab(queue, "Queue")
+        self.tabs.addTab(self.log_view, "Log")
+        self.tabs.addTab(self.history_tab, "History")
+        self.tabs.currentChanged.connect(self.on_tab_changed)
+
+        right_layout.addWidget(self.preview, 2)
         right_layout.addWidget(self.status_label)
-        right_layout.addWidget(QtWidgets.QLabel("Log"))
-        right_layout.addWidget(self.log_view)
+        right_layout.addWidget(self.tabs, 1)
 
         layout.addWidget(left, 2)
         layout.addWidget(right, 3)
@@ -273,80 +645,356 @@ class MainWindow(QtWidgets.QMainWindow):
             self.output_path.setText(path)
 
     def on_generate(self):
-        if self.worker and self.worker.isRunning():
-            return
-        self.log_view.clear()
-        self.status_label.setText("starting")
-        self.generate_btn.setEnabled(False)
-        self.cancel_btn.setEnabled(True)
+        from core.cache import open_response_cache
 
         api_key = get_api_key(self.config)
-        self.worker = GenerateWorker(
-            prompt=self.prompt_input.toPlainText(),
-            provider=self.provider_input.text().strip() or self.config.get("provider", DEFAULT_PROVIDER),
-            model=self.model_box.currentText().strip() or self.config.get("model", DEFAULT_MODEL),
-            aspect=self.aspect_box.currentText().strip() or self.config.get("aspect", DEFAULT_ASPECT),
-            output_format=self.format_box.currentText().strip() or self.config.get("format", DEFAULT_FORMAT),
-            output_resolution=(
-                self.resolution_box.currentText().strip()
-                or self.config.get("resolution", DEFAULT_RESOLUTION)
+        output_format = (
+            self.format_box.currentText().strip() or self.config.get("format", DEFAULT_FORMAT)
+        )
+        output_path = with_format_extension(
+            self.output_path.text().strip() or "./output/output.png", output_format
+        )
+        job = QueuedJob(
+            self.next_job_id,
+            dict(
+                prompt=self.prompt_input.toPlainText(),
+                provider=self.provider_input.text().strip() or self.config.get("provider", DEFAULT_PROVIDER),
+                model=self.model_box.currentText().strip() or self.config.get("model", DEFAULT_MODEL),
+                aspect=self.aspect_box.currentText().strip() or self.config.get("aspect", DEFAULT_ASPECT),
+                output_format=output_format,
+                output_resolution=(
+                    self.resolution_box.currentText().strip()
+                    or self.config.get("resolution", DEFAULT_RESOLUTION)
+                ),
+                output_path=self.reserve_output_path(output_path),
+                image_path=self.image_path.text().strip(),
+                poll_interval=self.config.get("poll_interval", 2.0),
+                timeout=self.config.get("timeout", 120.0),
+                api_base=self.config.get("api_base"),
+                api_key=api_key,
+                cache=open_response_cache(
+                    self.config.get("cache") or DEFAULT_CACHE_MODE,
+                    self.config.get("cache_max_mb") or DEFAULT_CACHE_MAX_MB,
+                ),
+                output_quality=self.config.get("quality", DEFAULT_OUTPUT_QUALITY),
             ),
-            output_path=self.output_path.text().strip() or "./output/output.png",
-            image_path=self.image_path.text().strip(),
-            poll_interval=self.config.get("poll_interval", 2.0),
-            timeout=self.config.get("timeout", 120.0),
-            api_base=self.config.get("api_base"),
-            api_key=api_key,
         )
-        self.worker.status.connect(self.on_status)
-        self.worker.error.connect(self.on_error)
-        self.worker.finished.connect(self.on_finished)
-        self.worker.start()
+        self.next_job_id += 1
+        self.jobs.append(job)
+        self.log_view.appendPlainText(f"[#{job.id}] queued: {job.output_path}")
+        self.render_jobs(self.selected_jobs())
+        self.schedule_jobs()
+
+    def reserve_output_path(self, path):
+        """Number ``path`` so queued jobs never write over each other or past outputs."""
+        taken = {os.path.abspath(job.output_path) for job in self.jobs if job.active}
+        base, ext = os.path.splitext(path)
+        candidate = path
+        n = 2
+        while os.path.abspath(candidate) in taken or os.path.exists(candidate):
+            candidate = f"{base}-{n}{ext}"
+            n += 1
+        return candidate
+
+    def schedule_jobs(self):
+        running = sum(1 for job in self.jobs if job.state == "running")
+        for job in self.jobs:
+            if running >= self.parallel_input.value():
+                break
+            if job.state == "queued":
+                self.start_job(job)
+                running += 1
+        self.cancel_btn.setEnabled(any(job.active for job in self.jobs))
+
+    def start_job(self, job):
+        if not self.transport_ready:
+            from core.transport import set_transport
+
+            set_transport(self.config.get("transport") or DEFAULT_TRANSPORT)
+            self.transport_ready = True
+        job.worker = GenerateWorker(**job.kwargs)
+        job.worker.status.connect(self.on_status)
+        job.worker.error.connect(self.on_error)
+        job.worker.finished.connect(self.on_finished)
+        job.worker.cancelled.connect(self.on_cancelled)
+        self.set_job_state(job, "running", "starting")
+        job.worker.start()
+
+    def job_for_sender(self):
+        worker = self.sender()
+        for job in self.jobs:
+            if job.worker is worker:
+                return job
+        return None
+
+    def set_job_state(self, job, state, status=None):
+        job.state = state
+        job.status = status or state
+        self.status_label.setText(f"#{job.id}: {job.status}")
+        if job in self.jobs:
+            self.queue_table.item(self.jobs.index(job), 2).setText(job.status)
+
+    def render_jobs(self, selected=()):
+        self.queue_table.setRowCount(len(self.jobs))
+        for row, job in enumerate(self.jobs):
+            prompt = " ".join(job.kwargs["prompt"].split())
+            for column, text in enumerate((f"#{job.id}", prompt, job.status)):
+                item = QtWidgets.QTableWidgetItem(text)
+                if column == 1:
+                    item.setToolTip(job.kwargs["prompt"])
+                self.queue_table.setItem(row, column, item)
+        self.queue_table.resizeColumnToContents(0)
+        self.queue_table.clearSelection()
+        selection = self.queue_table.selectionModel()
+        flags = (
+            QtCore.QItemSelectionModel.SelectionFlag.Select
+            | QtCore.QItemSelectionModel.SelectionFlag.Rows
+        )
+        for job in selected:
+            if job in self.jobs:
+                selection.select(self.queue_table.model().index(self.jobs.index(job), 0), flags)
+
+    def selected_jobs(self):
+        rows = sorted({index.row() for index in self.queue_table.selectionModel().selectedRows()})
+        return [self.jobs[row] for row in rows if row < len(self.jobs)]
+
+    def move_selected_jobs(self, step):
+        selected = self.selected_jobs()
+        if not selected:
+            return
+        order = selected if step < 0 else list(reversed(selected))
+        for job in order:
+            row = self.jobs.index(job)
+            target = row + step
+            if 0 <= target < len(self.jobs) and self.jobs[target] not in selected:
+                self.jobs[row], self.jobs[target] = self.jobs[target], self.jobs[row]
+        self.render_jobs(selected)
+
+    def move_jobs_up(self):
+        self.move_selected_jobs(-1)
+
+    def move_jobs_down(self):
+        self.move_selected_jobs(1)
+
+    def cancel_job(self, job):
+        if job.state == "queued":
+            self.set_job_state(job, "cancelled")
+            self.log_view.appendPlainText(f"[#{job.id}] cancelled")
+        elif job.state == "running":
+            job.worker.cancel()
+            self.set_job_state(job, "running", "canceling")
+
+    def cancel_selected_jobs(self):
+        for job in self.selected_jobs():
+            self.cancel_job(job)
+        self.schedule_jobs()
+
+    def clear_finished_jobs(self):
+        for job in self.jobs:
+            if not job.active and job.worker:
+                job.worker.wait()
+        selected = self.selected_jobs()
+        self.jobs = [job for job in self.jobs if job.active]
+        self.render_jobs(selected)
+
+    def on_parallel_changed(self, value):
+        self.config["gui_concurrency"] = value
+        save_config(self.config)
+        self.schedule_jobs()
 
     def on_cancel(self):
-        if self.worker:
-            self.worker.cancel()
-            self.status_label.setText("canceling")
+        for job in self.jobs:
+            self.cancel_job(job)
+        self.schedule_jobs()
 
     def on_status(self, message):
-        self.status_label.setText(message)
-        self.log_view.appendPlainText(message)
+        job = self.job_for_sender()
+        if job is None:
+            return
+        self.set_job_state(job, job.state, message)
+        self.log_view.appendPlainText(f"[#{job.id}] {message}")
 
     def on_error(self, message):
-        self.status_label.setText("error")
-        self.log_view.appendPlainText(f"error: {message}")
-        self.generate_btn.setEnabled(True)
-        self.cancel_btn.setEnabled(False)
+        job = self.job_for_sender()
+        if job is None:
+            return
+        self.set_job_state(job, "failed", f"error: {message}")
+        self.log_view.appendPlainText(f"[#{job.id}] error: {message}")
+        self.schedule_jobs()
+
+    def on_cancelled(self):
+        job = self.job_for_sender()
+        if job is None:
+            return
+        self.set_job_state(job, "cancelled")
+        self.log_view.appendPlainText(f"[#{job.id}] cancelled")
+        self.schedule_jobs()
 
     def on_finished(self, output_path):
-        self.status_label.setText("done")
-        self.log_view.appendPlainText(f"saved: {output_path}")
-        pixmap = QtGui.QPixmap(output_path)
-        if not pixmap.isNull():
-            requested = (
-                self.resolution_box.currentText().strip()
-                or self.config.get("resolution", DEFAULT_RESOLUTION)
+        job = self.job_for_sender()
+        if job is None:
+            return
+        self.set_job_state(job, "done")
+        self.log_view.appendPlainText(f"[#{job.id}] saved: {output_path}")
+        self.preview_path = output_path
+        self.preview_image = None
+        self.preview_expected = job.kwargs["output_resolution"]
+        self.load_preview()
+        if self.history_dir and os.path.dirname(os.path.abspath(output_path)) == self.history_dir:
+            self.history_model.add_path(
+                os.path.join(self.history_dir, os.path.basename(output_path))
             )
-            expected = {
-                "1k": 1024,
-                "2k": 2048,
-                "4k": 4096,
-            }.get(str(requested).lower())
-            if expected:
-                size = pixmap.size()
-                if size.width() != expected or size.height() != expected:
-                    self.log_view.appendPlainText(
-                        f"warning: requested {requested} but got {size.width()}x{size.height()}"
-                    )
-            self.preview.setPixmap(
-                pixmap.scaled(
-                    self.preview.size(),
-                    QtCore.Qt.AspectRatioMode.KeepAspectRatio,
-                    QtCore.Qt.TransformationMode.SmoothTransformation,
+        self.schedule_jobs()
+
+    def preview_pixel_size(self):
+        ratio = self.preview.devicePixelRatioF()
+        size = self.preview.size()
+        return QtCore.QSize(round(size.width() * ratio), round(size.height() * ratio))
+
+    def load_preview(self):
+        self.preview_timer.stop()
+        self.preview_token += 1
+        worker = PreviewWorker(self.preview_token, self.preview_path, self.preview_pixel_size())
+        worker.loaded.connect(self.on_preview_loaded)
+        worker.finished.connect(self.on_preview_worker_done)
+        self.preview_workers.add(worker)
+        worker.start()
+
+    def on_preview_worker_done(self):
+        self.preview_workers.discard(self.sender())
+
+    def reload_preview(self):
+        if self.preview_path:
+            self.load_preview()
+
+    def on_preview_loaded(self, token, path, image, source_size):
+        if token != self.preview_token:
+            return
+        if image.isNull():
+            self.log_view.appendPlainText(f"warning: cannot preview {path}")
+            return
+        self.preview_image = image
+        self.preview_source_size = source_size
+        expected = {
+            "1k": 1024,
+            "2k": 2048,
+            "4k": 4096,
+        }.get(str(self.preview_expected).lower())
+        if expected and source_size.isValid():
+            if source_size.width() != expected or source_size.height() != expected:
+                self.log_view.appendPlainText(
+                    f"warning: requested {self.preview_expected} but got "
+                    f"{source_size.width()}x{source_size.height()}"
                 )
+        self.preview_expected = None
+        self.show_preview()
+
+    def show_preview(self):
+        if self.preview_image is None:
+            return
+        ratio = self.preview.devicePixelRatioF()
+        pixmap = QtGui.QPixmap.fromImage(
+            self.preview_image.scaled(
+                self.preview_pixel_size(),
+                QtCore.Qt.AspectRatioMode.KeepAspectRatio,
+                QtCore.Qt.TransformationMode.SmoothTransformation,
             )
-        self.generate_btn.setEnabled(True)
-        self.cancel_btn.setEnabled(False)
+        )
+        pixmap.setDevicePixelRatio(ratio)
+        self.preview.setPixmap(pixmap)
+
+    def on_preview_resized(self):
+        if self.preview_image is None:
+            return
+        self.show_preview()
+        # Growing past the cached decode needs a sharper one; shrinking never does.
+        wanted = self.preview_image.size().scaled(
+            self.preview_pixel_size(), QtCore.Qt.AspectRatioMode.KeepAspectRatio
+        )
+        cached = self.preview_image.size()
+        if wanted.width() > cached.width() and cached.width() < self.preview_source_size.width():
+            self.preview_timer.start()
+
+    def on_tab_changed(self, index):
+        # The output folder is only listed once someone looks at it.
+        if self.tabs.widget(index) is self.history_tab and self.history_dir is None:
+            if self.history_model is None:
+                self.build_history()
+            self.scan_history()
+
+    def build_history(self):
+        QtGui.QPixmapCache.setCacheLimit(64 * 1024)
+        self.thumbnail_loader = ThumbnailLoader(parent=self)
+        icon_size = QtCore.QSize(HISTORY_ICON_SIZE, HISTORY_ICON_SIZE)
+        self.history_model = HistoryModel(
+            self.thumbnail_loader, icon_size, self.devicePixelRatioF(), self
+        )
+        self.history_view = QtWidgets.QListView()
+        self.history_view.setViewMode(QtWidgets.QListView.ViewMode.IconMode)
+        self.history_view.setMovement(QtWidgets.QListView.Movement.Static)
+        self.history_view.setResizeMode(QtWidgets.QListView.ResizeMode.Adjust)
+        self.history_view.setLayoutMode(QtWidgets.QListView.LayoutMode.Batched)
+        self.history_view.setBatchSize(200)
+        self.history_view.setUniformItemSizes(True)
+        self.history_view.setIconSize(icon_size)
+        self.history_view.setGridSize(
+            QtCore.QSize(HISTORY_ICON_SIZE + 24, HISTORY_ICON_SIZE + 32)
+        )
+        self.history_view.setTextElideMode(QtCore.Qt.TextElideMode.ElideMiddle)
+        self.history_view.setModel(self.history_model)
+        self.history_view.clicked.connect(self.on_history_selected)
+
+        history_layout = self.history_tab.layout()
+        history_row = QtWidgets.QHBoxLayout()
+        self.history_label = QtWidgets.QLabel("")
+        history_row.addWidget(self.history_label, 1)
+        refresh_btn = QtWidgets.QPushButton("Refresh")
+        refresh_btn.clicked.connect(self.scan_history)
+        history_row.addWidget(refresh_btn)
+        history_layout.addLayout(history_row)
+        history_layout.addWidget(self.history_view)
+
+    def scan_history(self):
+        if self.history_scanner and self.history_scanner.isRunning():
+            return
+        self.history_dir = os.path.abspath(
+            os.path.dirname(self.output_path.text().strip() or "./output/output.png") or "."
+        )
+        self.history_label.setText(f"{self.history_dir} (scanning)")
+        self.history_scanner = HistoryScanner(self.history_dir)
+        self.history_scanner.scanned.connect(self.on_history_scanned)
+        self.history_scanner.start()
+
+    def on_history_scanned(self, directory, entries):
+        if directory != self.history_dir:
+            return
+        self.history_model.set_entries(entries)
+        self.history_label.setText(f"{directory} ({len(entries)} images)")
+
+    def on_history_selected(self, index):
+        path = index.data(QtCore.Qt.ItemDataRole.UserRole)
+        if not path:
+            return
+        self.status_label.setText(path)
+        self.preview_path = path
+        self.preview_image = None
+        self.preview_expected = None
+        self.load_preview()
+
+    def closeEvent(self, event):
+        for job in self.jobs:
+            if job.state == "running":
+                job.worker.cancel()
+        for job in self.jobs:
+            if job.worker:
+                job.worker.wait()
+        if self.thumbnail_loader:
+            self.thumbnail_loader.stop()
+        if self.history_scanner:
+            self.history_scanner.wait()
+        for worker in list(self.preview_workers):
+            worker.wait()
+        super().closeEvent(event)
 
 
 def apply_style(app):
@@ -458,7 +1106,7 @@ def apply_style(app):
         }
         
         /* Spin box styling */
-        QDoubleSpinBox {
+        QSpinBox, QDoubleSpinBox {
             background: #161a22;
             border: 1px solid #272b36;
             border-radius: 6px;
@@ -466,10 +1114,11 @@ def apply_style(app):
             color: #e5e7eb;
         }
         
-        QDoubleSpinBox:focus {
+        QSpinBox:focus, QDoubleSpinBox:focus {
             border: 1px solid #3b82f6;
         }
         
+        QSpinBox::up-button, QSpinBox::down-button,
         QDoubleSpinBox::up-button, QDoubleSpinBox::down-button {
             background: #1e293b;
             border: none;
@@ -477,6 +1126,7 @@ def apply_style(app):
             width: 16px;
         }
         
+        QSpinBox::up-button:hover, QSpinBox::down-button:hover,
         QDoubleSpinBox::up-button:hover, QDoubleSpinBox::down-button:hover {
             background: #2d6cdf;
         }
@@ -516,4 +1166,9 @@ def main():
 
 
 if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        # Needed by the transcoding process pool in frozen builds.
+        import multiprocessing
+
+        multiprocessing.freeze_support()
     main()
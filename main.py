@@ -2,24 +2,80 @@
 import argparse
 import sys
 
-from core.app import (
+# Only config is imported up front: --help and argument errors must not pay for
+# the transport, cache and tracing stack that generating needs.
+from core.config import (
+    CACHE_MODES,
     DEFAULT_ASPECT,
+    DEFAULT_CACHE_MAX_MB,
+    DEFAULT_CACHE_MODE,
+    DEFAULT_CANDIDATE_COUNT,
+    DEFAULT_CONCURRENCY,
     DEFAULT_FORMAT,
+    DEFAULT_HEDGE_MAX_RATIO,
+    DEFAULT_HEDGE_PERCENTILE,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_MAX_REF_PIXELS,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_METRICS_FILE,
+    DEFAULT_METRICS_INTERVAL,
+    DEFAULT_METRICS_PORT,
+    DEFAULT_MIN_CONCURRENCY,
     DEFAULT_MODEL,
+    DEFAULT_OUTPUT_QUALITY,
     DEFAULT_PROVIDER,
+    DEFAULT_RATE_LIMIT,
     DEFAULT_RESOLUTION,
-    generate_image,
+    DEFAULT_SERVE_HOST,
+    DEFAULT_SERVE_IMAGE_ROOT,
+    DEFAULT_SERVE_PORT,
+    DEFAULT_SERVE_TOKEN,
+    DEFAULT_TRANSPORT,
+    DEFAULT_URL_CACHE,
+    DEFAULT_URL_CACHE_MAX_AGE,
+    TRANSPORT_NAMES,
+    get_api_key,
+    get_queue_path,
+    load_config,
 )
-from core.config import get_api_key, load_config
+
+
+def first_set(*values):
+    for value in values:
+        if value is not None:
+            return value
+    return None
+
+
+def concurrency_arg(value):
+    if value.lower() == "auto":
+        return "auto"
+    try:
+        return int(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError("expected a number or 'auto'") from exc
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Text-to-image and image-edit demo")
-    parser.add_argument("prompt", help="Text prompt for image generation")
+    argv = sys.argv[1:]
+    serve = bool(argv) and argv[0] == "serve"
+    if serve:
+        argv = argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Text-to-image and image-edit demo",
+        usage="%(prog)s [options] prompt | --batch FILE | serve [options]",
+    )
+    parser.add_argument("prompt", nargs="?", help="Text prompt for image generation")
     parser.add_argument("--model", default=None)
     parser.add_argument("--provider", default=None)
     parser.add_argument("--aspect", default=None)
     parser.add_argument("--format", default=None)
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=None,
+        help="Encoder quality (0-100) when converting to jpg or webp (default 90)",
+    )
     parser.add_argument(
         "--resolution",
         choices=["1k", "2k", "4k"],
@@ -37,15 +93,197 @@ def main():
         default="",
         help="Comma-separated image URLs or local paths for image-edit",
     )
-    parser.add_argument("--out", default="output.png")
+    parser.add_argument(
+        "--max-ref-pixels",
+        default=None,
+        help="Downscale reference images to at most this many pixels before upload "
+        "(a number, or 'auto' to derive it from --resolution)",
+    )
+    parser.add_argument(
+        "--out",
+        default=None,
+        help="Output file (default output.<format>); its extension picks the format "
+        "when --format is not given",
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=None,
+        help="Images to generate in one request; with N > 1 they are saved as "
+        "<out>_1 .. <out>_N (default 1)",
+    )
     parser.add_argument("--poll-interval", type=float, default=None)
     parser.add_argument("--timeout", type=float, default=None)
     parser.add_argument("--api-base", default=None, help="Override API base URL")
     parser.add_argument("--api-key", default=None, help="Override API key")
+    parser.add_argument(
+        "--batch",
+        default=None,
+        help="Run every job in a JSON lines file instead of a single prompt",
+    )
+    parser.add_argument(
+        "--journal",
+        default=None,
+        help="Completion journal for --batch; finished jobs are skipped on rerun "
+        "(default: the jobs file name plus .journal)",
+    )
+    parser.add_argument(
+        "--no-journal",
+        dest="journal",
+        action="store_const",
+        const="",
+        help="Run every batch job without reading or writing a journal",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=concurrency_arg,
+        default=None,
+        help="Number of batch jobs generated in parallel, or 'auto' to adapt it "
+        "to the API's latency and throttling",
+    )
+    parser.add_argument(
+        "--min-concurrency",
+        type=int,
+        default=None,
+        help="Lower bound for --concurrency auto",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=None,
+        help="Upper bound for --concurrency auto",
+    )
+    parser.add_argument(
+        "--transport",
+        choices=TRANSPORT_NAMES,
+        default=None,
+        help="HTTP transport: pooled keep-alive connections or plain urllib",
+    )
+    parser.add_argument(
+        "--cache",
+        choices=CACHE_MODES,
+        default=None,
+        help="Response cache: off (bypass), on, readonly, or refresh",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        action="store_const",
+        const="off",
+        help="Bypass the response cache (same as --cache off)",
+    )
+    parser.add_argument(
+        "--url-cache-max-age",
+        type=float,
+        default=None,
+        help="Seconds a downloaded reference URL is reused without revalidation",
+    )
+    parser.add_argument(
+        "--no-url-cache",
+        dest="url_cache",
+        action="store_false",
+        default=None,
+        help="Download reference URLs on every run instead of caching them",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=None,
+        help="Retries for throttled or transient API errors",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=None,
+        help="Maximum requests per second per API base and model (0 disables)",
+    )
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        default=None,
+        help="Send a second request when the first is slower than this latency "
+        "percentile for its model and resolution (e.g. 95)",
+    )
+    parser.add_argument(
+        "--hedge-max-ratio",
+        type=float,
+        default=None,
+        help="Largest share of requests that may be hedged (default 0.05)",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Write per-phase timing spans to stderr as JSON lines",
+    )
+    parser.add_argument(
+        "--trace-file",
+        default=None,
+        help="Append per-phase timing spans to this file as JSON lines",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Periodically write Prometheus metrics to this textfile-collector file",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=None,
+        help="Seconds between --metrics-file rewrites (default 15)",
+    )
+    parser.add_argument(
+        "--host",
+        default=None,
+        help="Address the job service listens on (serve, default 127.0.0.1)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=None,
+        help=f"Port of the job service (serve, default {DEFAULT_SERVE_PORT})",
+    )
+    parser.add_argument(
+        "--queue-db",
+        default=None,
+        help="SQLite file holding the job queue (serve, default ~/.ai-draw/queue.sqlite3)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Directory for job outputs; job `out` paths are relative to it (serve)",
+    )
+    parser.add_argument(
+        "--image-root",
+        default=None,
+        help="Directory jobs may reference local images from; without it only URLs "
+        "are accepted (serve)",
+    )
+    parser.add_argument(
+        "--token",
+        default=None,
+        help="Require 'Authorization: Bearer TOKEN' on every request; mandatory when "
+        "--host is not a loopback address (serve)",
+    )
     parser.add_argument("--verbose", action="store_true")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if serve and (args.prompt or args.batch):
+        parser.error("serve does not take a prompt or --batch")
+    if not serve and not args.prompt and not args.batch:
+        parser.error("a prompt or --batch is required")
+
+    from core.cache import open_response_cache, open_url_cache
+    from core.trace import jsonl_span_writer
+    from core.transcode import format_from_path
+    from core.transport import set_transport
 
     config = load_config()
+    set_transport(args.transport or config.get("transport") or DEFAULT_TRANSPORT)
 
     images = list(args.image)
     if args.images:
@@ -55,29 +293,223 @@ def main():
         if args.verbose:
             print(message)
 
+    common = dict(
+        provider=args.provider or config.get("provider") or DEFAULT_PROVIDER,
+        model=args.model or config.get("model") or DEFAULT_MODEL,
+        aspect=args.aspect or config.get("aspect") or DEFAULT_ASPECT,
+        output_format=(
+            args.format
+            or format_from_path(args.out or "")
+            or config.get("format")
+            or DEFAULT_FORMAT
+        ),
+        output_quality=first_set(
+            args.quality, config.get("quality"), DEFAULT_OUTPUT_QUALITY
+        ),
+        candidate_count=first_set(args.count, config.get("count"), DEFAULT_CANDIDATE_COUNT),
+        output_resolution=(
+            args.resolution or config.get("resolution") or DEFAULT_RESOLUTION
+        ),
+        poll_interval=args.poll_interval or config.get("poll_interval") or 2.0,
+        timeout=args.timeout or config.get("timeout") or 120.0,
+        api_base=args.api_base or config.get("api_base"),
+        api_key=args.api_key or get_api_key(config),
+        on_status=on_status,
+        max_ref_pixels=(
+            args.max_ref_pixels or config.get("max_ref_pixels") or DEFAULT_MAX_REF_PIXELS
+        ),
+        max_retries=first_set(
+            args.max_retries, config.get("max_retries"), DEFAULT_MAX_RETRIES
+        ),
+        rate_limit=first_set(args.rate_limit, config.get("rate_limit"), DEFAULT_RATE_LIMIT),
+        hedge_percentile=first_set(
+            args.hedge_percentile, config.get("hedge_percentile"), DEFAULT_HEDGE_PERCENTILE
+        ),
+        hedge_max_ratio=first_set(
+            args.hedge_max_ratio, config.get("hedge_max_ratio"), DEFAULT_HEDGE_MAX_RATIO
+        ),
+        url_cache=open_url_cache(
+            first_set(args.url_cache, config.get("url_cache"), DEFAULT_URL_CACHE),
+            first_set(
+                args.url_cache_max_age,
+                config.get("url_cache_max_age"),
+                DEFAULT_URL_CACHE_MAX_AGE,
+            ),
+        ),
+        cache=open_response_cache(
+            args.cache or config.get("cache") or DEFAULT_CACHE_MODE,
+            config.get("cache_max_mb") or DEFAULT_CACHE_MAX_MB,
+        ),
+    )
+
+    metrics_exporters = start_metrics(args, config)
+    trace_file = open(args.trace_file, "a", encoding="utf-8") if args.trace_file else None
     try:
+        on_span = None
+        if trace_file:
+            on_span = jsonl_span_writer(trace_file)
+        elif args.trace:
+            on_span = jsonl_span_writer(sys.stderr)
+        if serve:
+            run_serve(args, config, common)
+        elif args.batch:
+            run_batch(args, config, common, images, on_span)
+        else:
+            run_single(args, common, images, on_span)
+    finally:
+        if trace_file:
+            trace_file.close()
+        for exporter in metrics_exporters:
+            exporter.close()
+
+
+def start_metrics(args, config):
+    """Start the metrics exporters requested on the command line or in config."""
+    port = first_set(args.metrics_port, config.get("metrics_port"), DEFAULT_METRICS_PORT)
+    path = args.metrics_file or config.get("metrics_file") or DEFAULT_METRICS_FILE
+    if port is None and not path:
+        return []
+    from core.metrics import HttpExporter, TextfileExporter
+
+    exporters = []
+    if port is not None:
+        exporter = HttpExporter(port)
+        exporters.append(exporter)
+        print(f"Serving metrics on {exporter.url}")
+    if path:
+        interval = first_set(
+            args.metrics_interval, config.get("metrics_interval"), DEFAULT_METRICS_INTERVAL
+        )
+        exporters.append(TextfileExporter(path, interval))
+    return exporters
+
+
+def run_single(args, common, images, on_span=None):
+    from core.app import generate_image
+    from core.trace import Trace
+
+    try:
+        # generate_image gives output_path the extension of output_format.
         output_path = generate_image(
             prompt=args.prompt,
-            provider=args.provider or config.get("provider") or DEFAULT_PROVIDER,
-            model=args.model or config.get("model") or DEFAULT_MODEL,
-            aspect=args.aspect or config.get("aspect") or DEFAULT_ASPECT,
-            output_format=args.format or config.get("format") or DEFAULT_FORMAT,
-            output_resolution=(
-                args.resolution or config.get("resolution") or DEFAULT_RESOLUTION
-            ),
-            output_path=args.out,
+            output_path=args.out or "output.png",
             image_urls=images,
-            poll_interval=args.poll_interval or config.get("poll_interval") or 2.0,
-            timeout=args.timeout or config.get("timeout") or 120.0,
-            api_base=args.api_base or config.get("api_base"),
-            api_key=args.api_key or get_api_key(config),
-            on_status=on_status,
+            trace=Trace(on_span) if on_span else None,
+            **common,
         )
-        print(f"Saved image to {output_path}")
+        if isinstance(output_path, str):
+            print(f"Saved image to {output_path}")
+        else:
+            print(f"Saved {len(output_path)} images: {', '.join(output_path)}")
     except Exception as exc:
         print(str(exc), file=sys.stderr)
         raise SystemExit(1) from exc
 
 
+def outputs_text(output_path):
+    return output_path if isinstance(output_path, str) else ", ".join(output_path)
+
+
+def run_batch(args, config, common, images, on_span=None):
+    from core.batch import generate_images_batch, read_jobs
+    from core.journal import BatchJournal
+
+    if images:
+        common["image_urls"] = images
+    concurrency = args.concurrency or config.get("concurrency") or DEFAULT_CONCURRENCY
+
+    def on_result(result):
+        if result["error"]:
+            print(f"[{result['index']}] failed: {result['error']}", file=sys.stderr)
+        elif result["skipped"]:
+            print(f"[{result['index']}] already done: {outputs_text(result['output_path'])}")
+        else:
+            print(f"[{result['index']}] saved {outputs_text(result['output_path'])}")
+
+    journal = None
+    try:
+        journal_path = f"{args.batch}.journal" if args.journal is None else args.journal
+        if journal_path:
+            journal = BatchJournal(journal_path)
+        results = generate_images_batch(
+            read_jobs(args.batch),
+            concurrency=concurrency,
+            min_concurrency=(
+                args.min_concurrency
+                or config.get("min_concurrency")
+                or DEFAULT_MIN_CONCURRENCY
+            ),
+            max_concurrency=(
+                args.max_concurrency
+                or config.get("max_concurrency")
+                or DEFAULT_MAX_CONCURRENCY
+            ),
+            on_result=on_result,
+            on_span=on_span,
+            journal=journal,
+            **common,
+        )
+    except OSError as exc:
+        print(str(exc), file=sys.stderr)
+        raise SystemExit(1) from exc
+    finally:
+        if journal:
+            journal.close()
+    failed = sum(1 for result in results if result["error"])
+    skipped = sum(1 for result in results if result["skipped"])
+    print(
+        f"Batch finished: {len(results) - failed - skipped} succeeded, "
+        f"{skipped} already done, {failed} failed"
+    )
+    if failed:
+        raise SystemExit(1)
+
+
+def run_serve(args, config, common):
+    from core.service import JobQueue, JobService, make_server
+
+    queue = JobQueue(args.queue_db or config.get("queue_db") or get_queue_path())
+    service = JobService(
+        queue,
+        concurrency=args.concurrency or config.get("concurrency") or DEFAULT_CONCURRENCY,
+        min_concurrency=(
+            args.min_concurrency or config.get("min_concurrency") or DEFAULT_MIN_CONCURRENCY
+        ),
+        max_concurrency=(
+            args.max_concurrency or config.get("max_concurrency") or DEFAULT_MAX_CONCURRENCY
+        ),
+        output_dir=args.output_dir or "output",
+        image_root=args.image_root or config.get("serve_image_root") or DEFAULT_SERVE_IMAGE_ROOT,
+        **common,
+    )
+    try:
+        server = make_server(
+            service,
+            args.host or config.get("serve_host") or DEFAULT_SERVE_HOST,
+            first_set(args.port, config.get("serve_port"), DEFAULT_SERVE_PORT),
+            args.token or config.get("serve_token") or DEFAULT_SERVE_TOKEN,
+        )
+    except (OSError, RuntimeError) as exc:
+        queue.close()
+        print(str(exc), file=sys.stderr)
+        raise SystemExit(1) from exc
+    service.start()
+    host, port = server.server_address[:2]
+    print(f"Serving jobs on http://{host}:{port} (queue {queue.path})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        queue.close()
+
+
 if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        # Needed by the transcoding process pool in frozen builds.
+        import multiprocessing
+
+        multiprocessing.freeze_support()
     main()
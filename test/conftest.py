@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+# Manual scripts that call the live API; run them directly, not under pytest.
+collect_ignore = ["test_gen_img.py", "test_google.py"]
+
+
+@pytest.fixture(autouse=True)
+def isolated_home(tmp_path_factory, monkeypatch):
+    """Keep config, caches and refs under ~/.ai-draw out of the real home."""
+    home = tmp_path_factory.mktemp("home")
+    monkeypatch.setenv("HOME", str(home))
+    monkeypatch.setenv("USERPROFILE", str(home))
+    return home
+
+
+@pytest.fixture
+def mock_server():
+    """bench/mock_server.py on a free port, answering after 0.3s."""
+    from mock_server import MockServer
+
+    server = MockServer(latency="0.3", image_bytes={"1K": 4096}).start()
+    yield server
+    server.stop()
+
+
+def served(server):
+    """Requests the mock has answered, once its bookkeeping has caught up.
+
+    The mock counts a request after writing the response, so a client can
+    see its reply a moment before the count moves.
+    """
+    import time
+
+    count = server.state.stats()["requests"]
+    for _ in range(20):
+        time.sleep(0.02)
+        latest = server.state.stats()["requests"]
+        if latest == count:
+            return count
+        count = latest
+    return count
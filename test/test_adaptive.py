@@ -0,0 +1,29 @@
+import time
+
+from core.batch import AdaptiveConcurrency
+
+
+def test_concurrency_cut_once_per_burst():
+    changes = []
+    controller = AdaptiveConcurrency(8, 1, 16, on_change=lambda limit, _: changes.append(limit))
+    # Jobs that were all in flight when the first one was throttled.
+    for _ in range(5):
+        controller.record(1.0, overloaded=True)
+    assert controller.current == 4
+    assert changes == [4]
+
+    # A job started after the cut may cut again.
+    time.sleep(0.01)
+    controller.record(0.001, overloaded=True)
+    assert controller.current == 2
+
+
+def test_concurrency_stays_within_bounds():
+    controller = AdaptiveConcurrency(2, 2, 3)
+    for _ in range(3):
+        time.sleep(0.01)
+        controller.record(0.001, overloaded=True)
+    assert controller.current == 2
+    for _ in range(50):
+        controller.record(0.1)
+    assert controller.current == 3
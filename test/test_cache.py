@@ -0,0 +1,64 @@
+import os
+import time
+
+from core.cache import ResponseCache, payload_cache_key
+
+
+def image(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def payload(prompt):
+    return {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": {}}
+
+
+def test_cache_key_is_stable():
+    assert payload_cache_key("m", payload("a")) == payload_cache_key("m", payload("a"))
+    assert payload_cache_key("m", payload("a")) != payload_cache_key("m", payload("b"))
+    assert payload_cache_key("m", payload("a")) != payload_cache_key("n", payload("a"))
+
+
+def test_put_and_get(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    first, second = image(tmp_path, "a", 10), image(tmp_path, "b", 20)
+    cache.put("k" * 64, [first, second])
+    paths = cache.get("k" * 64)
+    assert [os.path.getsize(path) for path in paths] == [10, 20]
+    assert cache.get("x" * 64) is None
+
+
+def test_modes(tmp_path):
+    root = str(tmp_path / "cache")
+    ResponseCache(root, mode="readonly").put("k" * 64, [image(tmp_path, "a", 10)])
+    assert ResponseCache(root).get("k" * 64) is None
+    ResponseCache(root, mode="refresh").put("k" * 64, [image(tmp_path, "a", 10)])
+    assert ResponseCache(root, mode="refresh").get("k" * 64) is None
+    assert ResponseCache(root).get("k" * 64)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"), max_bytes=350)
+    for key in "abc":
+        cache.put(key * 64, [image(tmp_path, key, 100)])
+        time.sleep(0.01)
+    # Reading "a" makes "b" the least recently used entry.
+    assert cache.get("a" * 64)
+    time.sleep(0.01)
+    cache.put("d" * 64, [image(tmp_path, "d", 100)])
+    assert cache.get("b" * 64) is None
+    assert cache.get("a" * 64) and cache.get("c" * 64) and cache.get("d" * 64)
+    assert cache.size == 300
+
+
+def test_stores_under_the_limit_do_not_walk_the_cache(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache"), max_bytes=10_000)
+    scans = []
+    walk = cache.entries
+    monkeypatch.setattr(cache, "entries", lambda: scans.append(1) or walk())
+    for key in "abcde":
+        cache.put(key * 64, [image(tmp_path, key, 100)])
+    cache.put("a" * 64, [image(tmp_path, "a2", 300)])
+    assert len(scans) == 1
+    assert cache.size == 700
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from core.app import GenerationCancelled, generate_image
+
+
+@pytest.fixture
+def stalling_server():
+    """Sends the first part of every body, then stalls until the test ends.
+
+    The part is longer than one read chunk, so the client has consumed some
+    of it (and opened its .part file) by the time it blocks.
+    """
+    release = threading.Event()
+    started = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        def stall(self, head):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(head) + 1024 * 1024))
+            self.end_headers()
+            self.wfile.write(head)
+            self.wfile.flush()
+            started.set()
+            release.wait(10)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self.stall(
+                b'{"candidates":[{"content":{"parts":[{"inlineData":'
+                b'{"mimeType":"image/png","data":"' + b"A" * 256 * 1024
+            )
+
+        def do_GET(self):
+            self.stall(b"\x89PNG" + b"\0" * 4096)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.started = started
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def cancel_once_started(server, ready=None, **kwargs):
+    """Run generate_image, cancel it mid-transfer; return (error, seconds to stop)."""
+    cancel_event = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            generate_image(
+                prompt="stall",
+                api_base=f"{server.url}/v1beta",
+                api_key="test",
+                rate_limit=0,
+                max_retries=0,
+                timeout=30,
+                cancel_event=cancel_event,
+                **kwargs,
+            )
+        except Exception as exc:
+            outcome["error"] = exc
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert server.started.wait(5)
+    deadline = time.monotonic() + 5
+    while ready and not ready() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert ready is None or ready()
+    cancelled_at = time.monotonic()
+    cancel_event.set()
+    thread.join(10)
+    assert not thread.is_alive()
+    return outcome.get("error"), time.monotonic() - cancelled_at
+
+
+def test_cancel_mid_stream_removes_partial_file(stalling_server, tmp_path):
+    part = tmp_path / "out.png.part"
+    error, elapsed = cancel_once_started(
+        stalling_server, ready=part.exists, output_path=str(tmp_path / "out.png")
+    )
+    assert isinstance(error, GenerationCancelled)
+    # Well under the 30s request timeout: the socket was shut down, not waited out.
+    assert elapsed < 2
+    assert os.listdir(tmp_path) == []
+
+
+def test_cancel_aborts_reference_download(stalling_server, tmp_path):
+    error, elapsed = cancel_once_started(
+        stalling_server,
+        output_path=str(tmp_path / "out.png"),
+        image_urls=[f"{stalling_server.url}/ref.png"],
+    )
+    assert isinstance(error, GenerationCancelled)
+    assert elapsed < 2
+    assert os.listdir(tmp_path) == []
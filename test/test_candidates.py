@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+
+from conftest import served
+from core.app import (
+    MAX_CANDIDATE_FANOUT,
+    candidate_batches,
+    candidate_output_paths,
+    generate_image,
+)
+
+
+def generate(server, path, count):
+    return generate_image(
+        prompt="cat",
+        output_path=str(path),
+        api_base=server.api_base,
+        api_key="test",
+        rate_limit=0,
+        max_retries=0,
+        candidate_count=count,
+    )
+
+
+def test_candidate_names():
+    assert candidate_output_paths("out/cat.png", 1) == ["out/cat.png"]
+    assert candidate_output_paths("out/cat.png", 3) == [
+        "out/cat_1.png",
+        "out/cat_2.png",
+        "out/cat_3.png",
+    ]
+
+
+def test_candidate_batches():
+    assert candidate_batches(list("abcde"), 2) == [["a", "b"], ["c", "d"], ["e"]]
+    assert candidate_batches(list("ab"), 0) == [["a"], ["b"]]
+
+
+def test_one_request_for_all_candidates(mock_server, tmp_path):
+    paths = generate(mock_server, tmp_path / "cat.png", 3)
+    assert paths == [str(tmp_path / f"cat_{number}.png") for number in (1, 2, 3)]
+    assert all(os.path.getsize(path) for path in paths)
+    assert served(mock_server) == 1
+
+
+def test_capped_candidates_are_requested_again_in_batches(tmp_path):
+    from mock_server import MockServer
+
+    server = MockServer(image_bytes={"1K": 1024}, max_candidates=2).start()
+    try:
+        paths = generate(server, tmp_path / "cat.png", 7)
+        # 2 from the first request, then the other 5 as batches of 2, 2 and 1.
+        assert served(server) == 4
+    finally:
+        server.stop()
+    assert [os.path.basename(path) for path in paths] == [f"cat_{n}.png" for n in range(1, 8)]
+    assert all(os.path.getsize(path) for path in paths)
+
+
+def test_fan_out_is_capped(tmp_path):
+    from mock_server import MockServer
+
+    server = MockServer(image_bytes={"1K": 1024}, max_candidates=1).start()
+    active = peak = 0
+    lock = threading.Lock()
+
+    def latency():
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.2)
+        with lock:
+            active -= 1
+        return 0.0
+
+    server.state.latency = latency
+    count = MAX_CANDIDATE_FANOUT + 3
+    try:
+        paths = generate(server, tmp_path / "cat.png", count)
+        assert served(server) == count
+    finally:
+        server.stop()
+    assert peak == MAX_CANDIDATE_FANOUT
+    assert all(os.path.exists(path) for path in paths)
@@ -0,0 +1,68 @@
+import asyncio
+import filecmp
+import threading
+
+from conftest import served
+from core.aio import agenerate_image
+from core.app import generate_image
+
+
+def run_together(server, paths, **kwargs):
+    results = {}
+
+    def run(path):
+        results[path] = generate_image(
+            prompt="same",
+            output_path=path,
+            api_base=server.api_base,
+            api_key="test",
+            rate_limit=0,
+            max_retries=0,
+            **kwargs,
+        )
+
+    threads = [threading.Thread(target=run, args=(path,)) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_identical_calls_are_sent_separately_by_default(mock_server, tmp_path):
+    paths = [str(tmp_path / "a.png"), str(tmp_path / "b.png")]
+    results = run_together(mock_server, paths)
+    assert results == {path: path for path in paths}
+    assert served(mock_server) == 2
+
+
+def test_coalesce_sends_identical_calls_once(mock_server, tmp_path):
+    paths = [str(tmp_path / "a.png"), str(tmp_path / "b.png"), str(tmp_path / "c.png")]
+    results = run_together(mock_server, paths, coalesce=True)
+    assert results == {path: path for path in paths}
+    assert served(mock_server) == 1
+    assert filecmp.cmp(paths[0], paths[2], shallow=False)
+
+
+def test_async_coalescing_is_opt_in(mock_server, tmp_path):
+    async def run(prefix, coalesce):
+        return await asyncio.gather(
+            *[
+                agenerate_image(
+                    prompt="same",
+                    output_path=str(tmp_path / f"{prefix}{index}.png"),
+                    api_base=mock_server.api_base,
+                    api_key="test",
+                    rate_limit=0,
+                    max_retries=0,
+                    coalesce=coalesce,
+                )
+                for index in range(2)
+            ]
+        )
+
+    asyncio.run(run("separate", False))
+    assert served(mock_server) == 2
+    mock_server.state.reset()
+    asyncio.run(run("shared", True))
+    assert served(mock_server) == 1
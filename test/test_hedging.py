@@ -0,0 +1,150 @@
+import base64
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from core.app import fetch_image_hedged
+from core.hedging import MAX_HEDGE_CREDIT, MIN_LATENCY_SAMPLES, Hedger, get_hedger
+from core.ratelimit import AdaptiveRateLimiter
+
+KEY = ("model", "1K")
+
+
+@pytest.fixture
+def slow_first_server():
+    """Answers the first request after ``server.first_delay`` seconds, later ones at once."""
+    body = json.dumps(
+        {
+            "candidates": [
+                {
+                    "content": {
+                        "parts": [
+                            {
+                                "inlineData": {
+                                    "mimeType": "image/png",
+                                    "data": base64.b64encode(b"image").decode("ascii"),
+                                }
+                            }
+                        ]
+                    }
+                }
+            ]
+        }
+    ).encode("utf-8")
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with lock:
+                self.server.requests += 1
+                first = self.server.requests == 1
+            if first:
+                time.sleep(self.server.first_delay)
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except OSError:
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.requests = 0
+    server.first_delay = 1.0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/generate"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def primed_hedger(seconds=0.05, max_ratio=1.0):
+    hedger = Hedger(95, max_ratio)
+    for _ in range(MIN_LATENCY_SAMPLES):
+        hedger.record(KEY, seconds)
+    return hedger
+
+
+def fetch(server, hedger, tmp_path, limiter=None):
+    started = time.monotonic()
+    saved = fetch_image_hedged(
+        server.url,
+        "test",
+        {"contents": []},
+        [str(tmp_path / "out.png")],
+        10,
+        None,
+        hedger,
+        KEY,
+        limiter=limiter,
+    )
+    return saved, time.monotonic() - started
+
+
+def test_no_hedge_delay_until_enough_samples():
+    hedger = Hedger(95)
+    for _ in range(MIN_LATENCY_SAMPLES - 1):
+        hedger.record(KEY, 1.0)
+    assert hedger.delay(KEY) is None
+    hedger.record(KEY, 1.0)
+    assert hedger.delay(KEY) == 1.0
+
+
+def test_hedges_stay_under_max_ratio():
+    hedger = Hedger(95, 0.25)
+    hedged = 0
+    for _ in range(200):
+        hedger.delay(KEY)
+        hedged += hedger.try_hedge()
+    assert hedged == 50
+
+
+def test_unused_credit_is_capped():
+    hedger = Hedger(95, 0.5)
+    for _ in range(1000):
+        hedger.delay(KEY)
+    hedged = 0
+    while hedger.try_hedge():
+        hedged += 1
+    assert hedged == MAX_HEDGE_CREDIT
+
+
+def test_get_hedger_is_off_without_percentile():
+    assert get_hedger(None) is None
+    assert get_hedger(95, 0) is None
+    assert get_hedger(95, 0.05) is get_hedger(95.0, 0.05)
+
+
+def test_slow_request_is_hedged_and_the_hedge_wins(slow_first_server, tmp_path):
+    saved, elapsed = fetch(slow_first_server, primed_hedger(), tmp_path)
+    assert saved == [str(tmp_path / "out.png")]
+    assert elapsed < slow_first_server.first_delay
+    assert slow_first_server.requests == 2
+    assert os.listdir(tmp_path) == ["out.png"]
+
+
+def test_no_hedge_without_budget(slow_first_server, tmp_path):
+    slow_first_server.first_delay = 0.3
+    _, elapsed = fetch(slow_first_server, primed_hedger(max_ratio=0.05), tmp_path)
+    assert elapsed >= 0.3
+    assert slow_first_server.requests == 1
+
+
+def test_no_hedge_when_rate_limiter_is_empty(slow_first_server, tmp_path):
+    slow_first_server.first_delay = 0.3
+    limiter = AdaptiveRateLimiter(1)
+    while limiter.try_acquire():
+        pass
+    _, elapsed = fetch(slow_first_server, primed_hedger(), tmp_path, limiter)
+    assert elapsed >= 0.3
+    assert slow_first_server.requests == 1
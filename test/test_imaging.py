@@ -0,0 +1,55 @@
+import gc
+import os
+
+import pytest
+
+from core.cache import pin_file, pinned_blob, prune_directory
+from core.imaging import downscale_reference
+from core.streaming import InlineBlob
+
+
+def write_png(path, side):
+    QtGui = pytest.importorskip("PySide6.QtGui")
+    image = QtGui.QImage(side, side, QtGui.QImage.Format.Format_RGB32)
+    image.fill(QtGui.QColor(20, 120, 220))
+    assert image.save(str(path), "PNG")
+
+
+def test_pruning_skips_pinned_files(tmp_path):
+    for name in ("a", "b", "c"):
+        (tmp_path / name).write_bytes(b"x" * 100)
+    assert pin_file(str(tmp_path / "b"))
+    blob = pinned_blob(str(tmp_path / "b"))
+    prune_directory(str(tmp_path), 0)
+    assert sorted(os.listdir(tmp_path)) == ["b"]
+    del blob
+    gc.collect()
+    prune_directory(str(tmp_path), 0)
+    assert os.listdir(tmp_path) == []
+    assert not pin_file(str(tmp_path / "b"))
+
+
+def test_downscaled_reference_survives_pruning_while_used(tmp_path):
+    source = tmp_path / "source.png"
+    write_png(source, 64)
+    scaled, mime_type = downscale_reference(InlineBlob(path=str(source)), "image/png", 256)
+    assert mime_type == "image/jpeg"
+    refs = os.path.dirname(scaled.path)
+
+    prune_directory(refs, 0)
+    assert os.path.exists(scaled.path)
+    again, _ = downscale_reference(InlineBlob(path=str(source)), "image/png", 256)
+    assert again.path == scaled.path
+
+    path = scaled.path
+    del scaled, again
+    gc.collect()
+    prune_directory(refs, 0)
+    assert not os.path.exists(path)
+
+
+def test_small_reference_is_sent_as_is(tmp_path):
+    source = tmp_path / "source.png"
+    write_png(source, 8)
+    blob = InlineBlob(path=str(source))
+    assert downscale_reference(blob, "image/png", 256) == (blob, "image/png")
@@ -0,0 +1,49 @@
+from core.journal import BatchJournal, job_spec_hash
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_half_written_last_line(tmp_path):
+    out = tmp_path / "a.png"
+    write(out, b"image")
+    journal_path = tmp_path / "batch.journal"
+    with BatchJournal(journal_path) as journal:
+        journal.record("done", "first", 0, str(out))
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write('{"status": "done", "spec": "sec')
+
+    with BatchJournal(journal_path) as journal:
+        assert journal.completed("first", str(out))
+        assert not journal.completed("second", str(out))
+        journal.record("done", "third", 2, str(out))
+
+    with BatchJournal(journal_path) as journal:
+        assert journal.completed("first", str(out))
+        assert journal.completed("third", str(out))
+
+
+def test_multi_candidate_outputs(tmp_path):
+    outs = [str(tmp_path / f"out_{index}.png") for index in (1, 2)]
+    for index, path in enumerate(outs):
+        write(path, b"candidate %d" % index)
+    journal_path = tmp_path / "batch.journal"
+    with BatchJournal(journal_path) as journal:
+        journal.record("done", "spec", 0, outs)
+
+    with BatchJournal(journal_path) as journal:
+        assert journal.completed("spec", outs)
+        assert not journal.completed("spec", outs[:1])
+        assert not journal.completed("spec", outs[0])
+
+    write(outs[1], b"edited")
+    with BatchJournal(journal_path) as journal:
+        assert not journal.completed("spec", outs)
+
+
+def test_spec_hash_ignores_default_candidate_count():
+    spec = {"prompt": "cat", "output_path": "a.png"}
+    assert job_spec_hash(spec) == job_spec_hash({**spec, "candidate_count": 1})
+    assert job_spec_hash(spec) != job_spec_hash({**spec, "candidate_count": 2})
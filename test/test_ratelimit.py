@@ -0,0 +1,94 @@
+import http.client
+import socket
+import time
+import urllib.error
+
+import pytest
+
+from core.ratelimit import (
+    AdaptiveRateLimiter,
+    call_with_retries,
+    get_rate_limiter,
+    is_transient,
+    parse_retry_after,
+)
+
+
+def http_error(code):
+    return urllib.error.HTTPError("http://x", code, "error", {}, None)
+
+
+def test_cut_once_per_burst():
+    limiter = AdaptiveRateLimiter(4)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.on_throttle(started=started)
+    assert limiter.rate == 2
+    limiter.on_throttle(started=time.monotonic())
+    assert limiter.rate == 1
+
+
+def test_new_settings_keep_the_learned_rate():
+    limiter = get_rate_limiter("http://ratelimit.test", "m", 4)
+    limiter.on_throttle()
+    assert get_rate_limiter("http://ratelimit.test", "m", 10) is limiter
+    assert limiter.rate == 2 and limiter.max_rate == 10
+    get_rate_limiter("http://ratelimit.test", "m", 1)
+    assert limiter.rate == 1
+
+
+def test_try_acquire_never_waits():
+    limiter = AdaptiveRateLimiter(1)
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+
+def test_transient_errors():
+    for code in (429, 500, 503):
+        assert is_transient(http_error(code))
+    for code in (400, 401, 404):
+        assert not is_transient(http_error(code))
+    assert is_transient(TimeoutError("timed out"))
+    assert is_transient(urllib.error.URLError(TimeoutError("timed out")))
+    assert is_transient(ConnectionResetError())
+    assert is_transient(http.client.RemoteDisconnected())
+    assert is_transient(http.client.IncompleteRead(b""))
+
+
+def test_unreachable_hosts_are_not_retried():
+    assert not is_transient(socket.gaierror(-2, "Name or service not known"))
+    assert not is_transient(urllib.error.URLError(socket.gaierror(-2, "unknown")))
+    assert not is_transient(ConnectionRefusedError())
+    assert not is_transient(urllib.error.URLError(ConnectionRefusedError()))
+
+
+def test_refused_connection_fails_without_backoff(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda *args: pytest.fail("retried"))
+    calls = []
+
+    def refused():
+        calls.append(1)
+        raise urllib.error.URLError(ConnectionRefusedError(111, "Connection refused"))
+
+    with pytest.raises(urllib.error.URLError):
+        call_with_retries(refused, max_retries=3)
+    assert len(calls) == 1
+
+
+def test_server_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda *args: None)
+    results = iter([http_error(503), http_error(500), "ok"])
+
+    def flaky():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert call_with_retries(flaky, max_retries=3) == "ok"
+
+
+def test_retry_after():
+    assert parse_retry_after("2") == 2
+    assert parse_retry_after("-5") == 0
+    assert parse_retry_after("soon") is None
@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from core.service import JobQueue, JobService, is_loopback, make_server, resolve_under
+
+
+@pytest.fixture
+def service(tmp_path):
+    queue = JobQueue(tmp_path / "queue.sqlite3")
+    service = JobService(queue, concurrency=1, output_dir=str(tmp_path / "output"))
+    yield service
+    queue.close()
+
+
+def serve(service, token=None):
+    server = make_server(service, "127.0.0.1", 0, token=token)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def post(url, body, content_type="application/json", token=None):
+    headers = {"Content-Type": content_type}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers=headers)
+    try:
+        with urllib.request.urlopen(request) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as exc:
+        with exc:
+            return exc.code, json.loads(exc.read())
+
+
+def test_resolve_under_keeps_paths_inside_root(tmp_path):
+    root = str(tmp_path)
+    expected = os.path.join(os.path.realpath(root), "a", "b.png")
+    assert resolve_under(root, "a/b.png", "out") == expected
+    for path in ("/etc/passwd", "../x.png", "a/../../x.png", "a\\..\\x.png"):
+        with pytest.raises(RuntimeError):
+            resolve_under(root, path, "out")
+
+
+def test_resolve_under_refuses_symlinks_out_of_root(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    os.symlink(str(tmp_path), str(root / "up"))
+    with pytest.raises(RuntimeError):
+        resolve_under(str(root), "up/x.png", "out")
+
+
+def test_job_kwargs_confines_paths(service, tmp_path):
+    kwargs = service.job_kwargs({"prompt": "p", "out": "sub/a.png"})
+    assert kwargs["output_path"] == os.path.join(str(tmp_path / "output"), "sub", "a.png")
+    with pytest.raises(RuntimeError):
+        service.job_kwargs({"prompt": "p", "out": "/tmp/a.png"})
+    with pytest.raises(RuntimeError):
+        service.job_kwargs({"prompt": "p", "image": "secret.png"})
+    assert service.job_kwargs({"prompt": "p", "image": "https://e.x/a.png"})["image_path"]
+
+
+def test_token_required_off_loopback(service):
+    assert is_loopback("127.0.0.1") and is_loopback("::1") and is_loopback("localhost")
+    assert not is_loopback("0.0.0.0")
+    with pytest.raises(RuntimeError):
+        make_server(service, "0.0.0.0", 0)
+
+
+def test_http_api_checks_token_and_content_type(service):
+    server, base = serve(service, token="secret")
+    try:
+        assert post(f"{base}/jobs", {"prompt": "p"})[0] == 401
+        assert post(f"{base}/jobs", {"prompt": "p"}, token="wrong")[0] == 401
+        assert post(f"{base}/jobs", {"prompt": "p"}, "text/plain", token="secret")[0] == 415
+        assert post(f"{base}/jobs", {"prompt": "p", "out": "../x.png"}, token="secret")[0] == 400
+        status, job = post(f"{base}/jobs", {"prompt": "p"}, token="secret")
+        assert status == 202 and job["status"] == "queued"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_interrupted_job_gives_up_after_max_attempts(tmp_path):
+    from core.service import MAX_JOB_ATTEMPTS
+
+    path = tmp_path / "queue.sqlite3"
+    queue = JobQueue(path)
+    job = queue.submit({"prompt": "p"})
+    for _ in range(MAX_JOB_ATTEMPTS):
+        assert queue.claim(timeout=0)["id"] == job["id"]
+        queue.recover()
+    assert queue.get(job["id"])["status"] == "failed"
+    queue.close()
+
+
+def test_job_with_candidates_serves_each_image(mock_server, tmp_path):
+    queue = JobQueue(tmp_path / "queue.sqlite3")
+    service = JobService(
+        queue,
+        concurrency=1,
+        output_dir=str(tmp_path / "output"),
+        api_base=mock_server.api_base,
+        api_key="test",
+        rate_limit=0,
+        max_retries=0,
+    ).start()
+    server, base = serve(service)
+    try:
+        status, job = post(f"{base}/jobs", {"prompt": "p", "count": 2})
+        assert status == 202
+        with urllib.request.urlopen(f"{base}/jobs/{job['id']}?wait=30") as resp:
+            job = json.loads(resp.read())
+        assert job["status"] == "succeeded"
+        assert [os.path.basename(path) for path in job["output_paths"]] == [
+            f"job-{job['id']}_1.png",
+            f"job-{job['id']}_2.png",
+        ]
+        for index, path in enumerate(job["output_paths"], 1):
+            with urllib.request.urlopen(f"{base}/jobs/{job['id']}/image?index={index}") as resp:
+                with open(path, "rb") as f:
+                    assert resp.read() == f.read()
+        with pytest.raises(urllib.error.HTTPError) as info:
+            urllib.request.urlopen(f"{base}/jobs/{job['id']}/image?index=3")
+        assert info.value.code == 404
+        info.value.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+        queue.close()
+
+
+def test_queue_from_before_candidates_is_migrated(tmp_path):
+    import sqlite3
+
+    path = tmp_path / "queue.sqlite3"
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE jobs (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL UNIQUE, "
+        "priority INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, spec TEXT NOT NULL, "
+        "output_path TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+        "created_at REAL NOT NULL, started_at REAL, finished_at REAL);"
+        "INSERT INTO jobs (id, status, spec, output_path, created_at) "
+        "VALUES ('old', 'succeeded', '{}', '/tmp/old.png', 0);"
+    )
+    conn.commit()
+    conn.close()
+    queue = JobQueue(path)
+    assert queue.get("old")["output_paths"] == ["/tmp/old.png"]
+    queue.close()
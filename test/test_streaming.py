@@ -0,0 +1,66 @@
+import base64
+import io
+import json
+
+from core.streaming import InlineImageScanner
+
+IMAGE = bytes(range(256)) * 40
+
+
+class Sink(io.BytesIO):
+    def close(self):
+        self.data = self.getvalue()
+        super().close()
+
+
+def scan(text, chunk_size):
+    sinks = []
+
+    def open_sink(index):
+        sinks.append(Sink())
+        return sinks[-1]
+
+    scanner = InlineImageScanner(open_sink)
+    raw = text.encode("ascii")
+    for start in range(0, len(raw), chunk_size):
+        scanner.feed(raw[start : start + chunk_size])
+    return scanner.finish(), [sink.data for sink in sinks]
+
+
+def response(data, key='"inlineData"', data_key='"data"'):
+    return (
+        '{"candidates": [{"content": {"parts": [{"text": "ok"}, '
+        f'{{{key}: {{"mimeType": "image/png", {data_key}: "{data}"}}}}]}}}}]}}'
+    )
+
+
+def test_every_chunk_boundary():
+    text = response(base64.b64encode(IMAGE[:300]).decode("ascii"))
+    for chunk_size in range(1, 40):
+        skeleton, images = scan(text, chunk_size)
+        assert images == [IMAGE[:300]]
+        assert skeleton["candidates"][0]["content"]["parts"][0]["text"] == "ok"
+
+
+def test_escaped_slashes_in_data():
+    data = base64.b64encode(IMAGE).decode("ascii")
+    assert "/" in data
+    for chunk_size in (1, 2, 3, 7, 4096):
+        _, images = scan(response(data.replace("/", "\\/")), chunk_size)
+        assert images == [IMAGE]
+
+
+def test_unicode_escaped_keys():
+    data = base64.b64encode(IMAGE[:99]).decode("ascii")
+    text = response(data, key='"inline\\u005fdata"', data_key='"\\u0064ata"')
+    for chunk_size in (1, 3, 5, 4096):
+        skeleton, images = scan(text, chunk_size)
+        assert images == [IMAGE[:99]]
+        assert "inline_data" in skeleton["candidates"][0]["content"]["parts"][1]
+
+
+def test_other_strings_keep_their_escapes():
+    text = json.dumps({"candidates": [], "note": 'a "quoted" é \\ path/x'})
+    skeleton, images = scan(text, 2)
+    assert images == []
+    assert skeleton["note"] == 'a "quoted" é \\ path/x'
@@ -0,0 +1,105 @@
+import base64
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from core.app import generate_image
+from core.transcode import normalize_quality, sniff_format, with_format_extension
+
+
+def png_bytes():
+    QtCore = pytest.importorskip("PySide6.QtCore")
+    QtGui = pytest.importorskip("PySide6.QtGui")
+    image = QtGui.QImage(8, 8, QtGui.QImage.Format.Format_ARGB32)
+    image.fill(QtGui.QColor(200, 40, 40, 128))
+    buffer = QtCore.QBuffer()
+    buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, "PNG")
+    return bytes(buffer.data())
+
+
+@pytest.fixture
+def png_server():
+    body = json.dumps(
+        {
+            "candidates": [
+                {
+                    "content": {
+                        "parts": [
+                            {
+                                "inlineData": {
+                                    "mimeType": "image/png",
+                                    "data": base64.b64encode(png_bytes()).decode("ascii"),
+                                }
+                            }
+                        ]
+                    }
+                }
+            ]
+        }
+    ).encode("utf-8")
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1beta"
+    server.shutdown()
+    server.server_close()
+
+
+def test_png_response_saved_as_requested_jpg(png_server, tmp_path):
+    requested = str(tmp_path / "out.png")
+    saved = generate_image(
+        prompt="red square",
+        output_path=requested,
+        output_format="jpg",
+        api_base=png_server,
+        api_key="test",
+        rate_limit=0,
+        max_retries=0,
+    )
+    assert saved == str(tmp_path / "out.jpg")
+    assert sniff_format(saved) == "jpg"
+    assert not os.path.exists(requested)
+
+
+def test_png_response_kept_when_png_requested(png_server, tmp_path):
+    saved = generate_image(
+        prompt="red square",
+        output_path=str(tmp_path / "out.png"),
+        output_format="png",
+        api_base=png_server,
+        api_key="test",
+        rate_limit=0,
+        max_retries=0,
+    )
+    assert sniff_format(saved) == "png"
+
+
+def test_with_format_extension():
+    assert with_format_extension("a.png", "jpeg") == "a.jpg"
+    assert with_format_extension("a.JPG", "jpg") == "a.JPG"
+    assert with_format_extension("notes.txt", "webp") == "notes.txt"
+    assert with_format_extension("a.png", None) == "a.png"
+
+
+def test_quality_range():
+    assert normalize_quality("0") == 0
+    assert normalize_quality(100) == 100
+    for value in (-1, 101, "high", None):
+        with pytest.raises(RuntimeError):
+            normalize_quality(value)
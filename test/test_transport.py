@@ -0,0 +1,84 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from core.transport import PooledTransport, UrllibTransport, create_transport
+
+
+@pytest.fixture
+def keepalive_server():
+    """HTTP/1.1 server that records the client port of every request.
+
+    Set ``server.drop_after_reply`` to close each connection once its reply is
+    sent, while still advertising keep-alive, the way an idle timeout does.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.server.ports.append(self.client_address[1])
+            body = self.path.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            if self.server.drop_after_reply:
+                self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.ports = []
+    server.drop_after_reply = False
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def transport():
+    transport = PooledTransport()
+    transport._proxies = {}
+    yield transport
+    transport.close()
+
+
+def fetch(transport, url):
+    with transport.open("GET", url, timeout=5) as response:
+        return response.read()
+
+
+def test_pooled_transport_reuses_one_connection(keepalive_server, transport):
+    for index in range(3):
+        assert fetch(transport, f"{keepalive_server.url}/{index}") == f"/{index}".encode()
+    assert len(keepalive_server.ports) == 3
+    assert len(set(keepalive_server.ports)) == 1
+
+
+def test_pooled_transport_reconnects_after_server_closes(keepalive_server, transport):
+    keepalive_server.drop_after_reply = True
+    assert fetch(transport, f"{keepalive_server.url}/a") == b"/a"
+    # The pooled connection is dead by now; the request goes out again on a new one.
+    assert fetch(transport, f"{keepalive_server.url}/b") == b"/b"
+    assert len(set(keepalive_server.ports)) == 2
+
+
+def test_unread_response_is_not_pooled(keepalive_server, transport):
+    response = transport.open("GET", f"{keepalive_server.url}/a", timeout=5)
+    response.close()
+    assert fetch(transport, f"{keepalive_server.url}/b") == b"/b"
+    assert len(set(keepalive_server.ports)) == 2
+
+
+def test_create_transport_names():
+    assert isinstance(create_transport("urllib"), UrllibTransport)
+    pooled = create_transport("pooled")
+    assert isinstance(pooled, PooledTransport)
+    pooled.close()
+    with pytest.raises(RuntimeError):
+        create_transport("curl")
@@ -0,0 +1,86 @@
+import gc
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from core.app import restore_cached
+from core.cache import ResponseCache, UrlCache, prune_directory
+
+
+@pytest.fixture
+def image_server():
+    state = {"body": b"A" * 5000, "gets": 0, "not_modified": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["gets"] += 1
+            etag = f'"{len(state["body"])}"'
+            if self.headers.get("If-None-Match") == etag:
+                state["not_modified"] += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(state["body"])))
+            self.end_headers()
+            self.wfile.write(state["body"])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{server.server_address[1]}/ref.png"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_revalidates_and_stores_bodies_by_content(image_server, tmp_path):
+    cache = UrlCache(str(tmp_path), max_age=0)
+    first, content_type = cache.fetch_blob(image_server["url"])
+    assert content_type == "image/png"
+    assert first.size == 5000
+
+    second, _ = cache.fetch_blob(image_server["url"])
+    assert image_server["not_modified"] == 1
+    assert second.path == first.path
+
+    image_server["body"] = b"B" * 7000
+    third, _ = cache.fetch_blob(image_server["url"])
+    assert third.path != first.path and third.size == 7000
+    # The body already handed out is untouched.
+    assert os.path.getsize(first.path) == 5000
+
+
+def test_fresh_entries_skip_the_server(image_server, tmp_path):
+    cache = UrlCache(str(tmp_path), max_age=3600)
+    cache.fetch_blob(image_server["url"])
+    cache.fetch_blob(image_server["url"])
+    assert image_server["gets"] == 1
+
+
+def test_bodies_in_use_survive_pruning(image_server, tmp_path):
+    cache = UrlCache(str(tmp_path), max_age=0, max_bytes=1)
+    blob, _ = cache.fetch_blob(image_server["url"])
+    prune_directory(cache.root, 0)
+    assert os.path.exists(blob.path)
+    path = blob.path
+    del blob
+    gc.collect()
+    prune_directory(cache.root, 0)
+    assert not os.path.exists(path)
+
+
+def test_failed_restore_is_a_miss(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache"))
+    source = tmp_path / "image.png"
+    source.write_bytes(b"image")
+    cache.put("k" * 64, [str(source)])
+    assert not restore_cached(cache, "k" * 64, [str(tmp_path / "missing" / "out.png")])
+    assert restore_cached(cache, "k" * 64, [str(tmp_path / "out.png")])
+    assert (tmp_path / "out.png").read_bytes() == b"image"